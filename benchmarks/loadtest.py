@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+    benchmarks.loadtest
+    ~~~~~~~~~~~~~~~~~~~
+
+    Measure the throughput of the preview server on a synthetic site::
+
+        $ python benchmarks/loadtest.py --clients 32 --workers 16
+
+    Every client keeps one connection open and requests the pages and
+    assets of the site in turn.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sitegen import generate_site  # noqa
+
+
+def site_urls(sitedir, limit=200):
+    rv = []
+    for dirpath, dirnames, filenames in os.walk(sitedir):
+        for filename in filenames:
+            if filename.endswith(('.gz', '.br')):
+                continue
+            filepath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(filepath, sitedir)
+            rv.append('/' + relpath.replace(os.path.sep, '/'))
+    return sorted(rv)[:limit]
+
+
+def client(host, port, urls, requests, timings, errors):
+    conn = httplib.HTTPConnection(host, port, timeout=30)
+    try:
+        for i in range(requests):
+            url = urls[i % len(urls)]
+            begin = time.time()
+            try:
+                conn.request('GET', url)
+                resp = conn.getresponse()
+                resp.read()
+            except Exception:
+                errors.append(url)
+                conn.close()
+                conn = httplib.HTTPConnection(host, port, timeout=30)
+                continue
+            timings.append((time.time() - begin) * 1000)
+            if resp.status >= 400:
+                errors.append(url)
+    finally:
+        conn.close()
+
+
+def run_load(host, port, urls, clients, requests):
+    timings = []
+    errors = []
+    threads = []
+    begin = time.time()
+    for i in range(clients):
+        t = threading.Thread(
+            target=client,
+            args=(host, port, urls[i:] + urls[:i], requests, timings, errors),
+        )
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    elapsed = time.time() - begin
+
+    timings.sort()
+    total = len(timings)
+    print('  requests   %i (%i errors)' % (total, len(errors)))
+    print('  elapsed    %.3f s' % elapsed)
+    print('  throughput %.1f req/s' % (total / elapsed if elapsed else 0))
+    if total:
+        print('  latency    p50 %.3f ms  p99 %.3f ms  max %.3f ms' % (
+            timings[total // 2], timings[int(total * 0.99)], timings[-1]
+        ))
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the server.')
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--sitedir', help='serve a built site instead')
+    args = parser.parse_args(argv)
+
+    from writeup import Writeup
+    from writeup.server import Server
+
+    logging.getLogger('writeup').setLevel(logging.ERROR)
+    cwd = os.getcwd()
+    tmpdir = None
+    sitedir = args.sitedir
+    try:
+        if not sitedir:
+            tmpdir = tempfile.mkdtemp(prefix='writeup-load-')
+            generate_site(tmpdir, posts=args.posts)
+            os.chdir(tmpdir)
+            Writeup(config='_config.yml').run()
+            sitedir = os.path.join(tmpdir, '_site')
+
+        urls = site_urls(sitedir)
+        server = Server(sitedir).make_server('127.0.0.1', 0, args.workers)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        print('  %i urls, %i clients, %i workers' % (
+            len(urls), args.clients, args.workers
+        ))
+        errors = run_load(
+            '127.0.0.1', server.server_address[1], urls,
+            args.clients, args.requests,
+        )
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
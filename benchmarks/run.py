@@ -0,0 +1,213 @@
+# coding: utf-8
+"""
+    benchmarks.run
+    ~~~~~~~~~~~~~~
+
+    Benchmark the hot paths of writeup on a synthetic site, and compare
+    the results with a stored baseline::
+
+        $ python benchmarks/run.py --save       # record the baseline
+        $ python benchmarks/run.py              # compare with it
+
+    A benchmark regresses when its best time is slower than the
+    baseline by more than the threshold, the exit code is 1 then.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sitegen import generate_site  # noqa
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def clean(*names):
+    for name in names:
+        if os.path.isdir(name):
+            shutil.rmtree(name)
+
+
+def post_files():
+    rv = []
+    for dirpath, dirnames, filenames in os.walk('_posts'):
+        for filename in filenames:
+            if filename.endswith('.md'):
+                rv.append(os.path.join(dirpath, filename))
+    return sorted(rv)
+
+
+def bench_create_index():
+    from writeup.app import Application
+    clean('.cache')
+    app = Application(config='_config.yml')
+    with app.create_context():
+        app.create_index()
+
+
+def bench_parse():
+    from writeup.parser import parse
+    for filepath in post_files():
+        parse(filepath)
+
+
+def bench_markdown():
+    from writeup.parser import parse
+    from writeup.filters import markdown
+    contents = [parse(filepath)['content'] for filepath in post_files()]
+
+    def run():
+        for content in contents:
+            markdown(content, cache_key=None)
+    return run
+
+
+def bench_cold_build():
+    from writeup import Writeup
+    clean('_site', '.cache')
+    Writeup(config='_config.yml').run()
+
+
+def bench_noop_build():
+    from writeup import Writeup
+    Writeup(config='_config.yml').run()
+
+
+def bench_edit_build():
+    from writeup import Writeup
+    filepath = post_files()[0]
+    with open(filepath, 'a') as f:
+        f.write('\nedited\n')
+    Writeup(config='_config.yml').run()
+
+
+# name, function, the function prepares the real one or not
+BENCHMARKS = [
+    ('create_index', bench_create_index, False),
+    ('parse', bench_parse, False),
+    ('markdown', bench_markdown, True),
+    ('cold_build', bench_cold_build, False),
+    ('noop_build', bench_noop_build, False),
+    ('edit_build', bench_edit_build, False),
+]
+
+
+def measure(func, repeat):
+    timings = []
+    for i in range(repeat):
+        begin = time.time()
+        func()
+        timings.append((time.time() - begin) * 1000)
+    timings.sort()
+    return {
+        'min': round(timings[0], 3),
+        'median': round(timings[len(timings) // 2], 3),
+    }
+
+
+def run_benchmarks(names=None, repeat=3):
+    rv = {}
+    for name, func, prepare in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if name == 'noop_build' and not os.path.isdir('_site'):
+            bench_cold_build()
+        if prepare:
+            func = func()
+        rv[name] = measure(func, repeat)
+        print('  %-14s min %10.3f ms  median %10.3f ms' % (
+            name, rv[name]['min'], rv[name]['median']
+        ))
+    return rv
+
+
+def compare(results, baseline, threshold):
+    """Return names of the regressed benchmarks."""
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['min']
+        new = results[name]['min']
+        if old and new > old * (1 + threshold):
+            regressions.append(name)
+            print('  REGRESSION %s: %.3f ms -> %.3f ms (+%.1f%%)' % (
+                name, old, new, (new - old) * 100.0 / old
+            ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark writeup.')
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--code-density', type=float, default=0.3)
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--save', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('writeup').setLevel(logging.ERROR)
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            data = json.load(f)
+        # results are only comparable on the same site
+        if data.get('options') == vars_of(args):
+            baseline = data['results']
+
+    cwd = os.getcwd()
+    sitedir = tempfile.mkdtemp(prefix='writeup-bench-')
+    try:
+        generate_site(
+            sitedir, posts=args.posts, tags=args.tags,
+            code_density=args.code_density, per_page=args.per_page,
+        )
+        os.chdir(sitedir)
+        results = run_benchmarks(args.only, args.repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(sitedir)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'options': vars_of(args), 'results': results}, f,
+                      indent=2, sort_keys=True)
+        print('  Baseline saved to %s' % args.baseline)
+        return 0
+
+    if baseline is None:
+        print('  No comparable baseline, run with --save to record one.')
+        return 0
+
+    if compare(results, baseline, args.threshold):
+        return 1
+    print('  No regression beyond %.0f%%' % (args.threshold * 100))
+    return 0
+
+
+def vars_of(args):
+    return {
+        'posts': args.posts,
+        'tags': args.tags,
+        'code_density': args.code_density,
+        'per_page': args.per_page,
+    }
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+    benchmarks.sitegen
+    ~~~~~~~~~~~~~~~~~~
+
+    Generate a deterministic synthetic site for benchmarks::
+
+        $ python benchmarks/sitegen.py /tmp/site --posts 5000
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import sys
+import random
+import argparse
+import datetime
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+    'eiusmod tempor incididunt ut labore et dolore magna aliqua enim '
+    'minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+    'commodo consequat duis aute irure reprehenderit voluptate velit esse'
+).split()
+
+CODE = {
+    'python': 'def fib(n):\n    if n < 2:\n        return n\n'
+              '    return fib(n - 1) + fib(n - 2)\n',
+    'javascript': 'function fib(n) {\n  return n < 2 ? n : '
+                  'fib(n - 1) + fib(n - 2);\n}\n',
+    'c': 'int fib(int n) {\n    return n < 2 ? n : '
+         'fib(n - 1) + fib(n - 2);\n}\n',
+}
+
+CONFIG = """\
+title: Benchmark
+baseurl: http://example.com
+permalink: /:year/:filename.html
+paginate: %(per_page)i
+"""
+
+POST_LAYOUT = """\
+<!doctype html>
+<html>
+<head><title>{{ page.title }}</title></head>
+<body>
+  <article>
+    <h1>{{ page.title }}</h1>
+    <p>{{ page.date }} {{ page.tags|join(', ') }}</p>
+    {{ page.content|markdown }}
+  </article>
+  <ul>
+  {% for post in site.related(page) %}
+    <li><a href="{{ post.url }}">{{ post.title }}</a></li>
+  {% endfor %}
+  </ul>
+</body>
+</html>
+"""
+
+PAGINATOR = """\
+<ul>
+{% for post in paginator.posts %}
+  <li><a href="{{ post.url }}">{{ post.title }}</a></li>
+{% endfor %}
+</ul>
+{% if paginator.has_next %}
+<a href="{{ paginator.next_url }}">next</a>
+{% endif %}
+"""
+
+FEED = """\
+<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+{% for post in site.posts(count=20) %}
+<entry>
+  <title>{{ post.title }}</title>
+  <link href="{{ post.full_url }}"/>
+</entry>
+{% endfor %}
+</feed>
+"""
+
+
+def sentence(rnd, count):
+    return ' '.join(rnd.choice(WORDS) for i in range(count))
+
+
+def create_post(rnd, index, tags, code_density):
+    date = datetime.datetime(2010, 1, 1) + datetime.timedelta(hours=index * 7)
+    lines = [
+        '# %s' % sentence(rnd, 5).title(),
+        '',
+        '- date: %s' % date.strftime('%Y-%m-%d %H:%M'),
+        '- tags: %s' % ', '.join(tags),
+        '',
+        sentence(rnd, 20),
+        '',
+        '---',
+        '',
+    ]
+    for i in range(8):
+        lines.append(sentence(rnd, rnd.randint(30, 80)))
+        lines.append('')
+        if rnd.random() < code_density:
+            lang = rnd.choice(sorted(CODE))
+            lines.append('```%s' % lang)
+            lines.append(CODE[lang])
+            lines.append('```')
+            lines.append('')
+    return date, '\n'.join(lines)
+
+
+def fwrite(filepath, content):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(filepath, 'w') as f:
+        f.write(content)
+
+
+def generate_site(dest, posts=1000, tags=50, tag_skew=1.0,
+                  code_density=0.3, per_page=10, sections=1, seed=42):
+    """Generate a site into the dest directory.
+
+    :param posts: count of posts
+    :param tags: count of distinct tags
+    :param tag_skew: zipf exponent of the tag distribution
+    :param code_density: probability of a code block after a paragraph
+    :param per_page: posts per paginator page, smaller means deeper
+    :param sections: count of sub directories with their own paginator
+    :param seed: seed of the random generator
+    """
+    rnd = random.Random(seed)
+    names = ['tag%i' % i for i in range(tags)]
+    weights = [1.0 / (i + 1) ** tag_skew for i in range(tags)]
+
+    fwrite(os.path.join(dest, '_config.yml'), CONFIG % {'per_page': per_page})
+    fwrite(os.path.join(dest, '_layouts', 'post.html'), POST_LAYOUT)
+    fwrite(os.path.join(dest, 'feed.xml'), FEED)
+    fwrite(os.path.join(dest, '_posts', 'index.html'), PAGINATOR)
+
+    for i in range(sections):
+        index = os.path.join(dest, '_posts', 'section%i' % i, 'index.html')
+        fwrite(index, PAGINATOR)
+
+    for i in range(posts):
+        count = rnd.randint(1, min(4, tags))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.add(weighted_choice(rnd, names, weights))
+        date, content = create_post(rnd, i, sorted(chosen), code_density)
+        section = 'section%i' % (i % sections)
+        filepath = os.path.join(
+            dest, '_posts', section, str(date.year), 'post-%i.md' % i
+        )
+        fwrite(filepath, content)
+    return dest
+
+
+def weighted_choice(rnd, items, weights):
+    value = rnd.random() * sum(weights)
+    for item, weight in zip(items, weights):
+        value -= weight
+        if value <= 0:
+            return item
+    return items[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a test site.')
+    parser.add_argument('dest')
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--tag-skew', type=float, default=1.0)
+    parser.add_argument('--code-density', type=float, default=0.3)
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--sections', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    generate_site(
+        args.dest, posts=args.posts, tags=args.tags,
+        tag_skew=args.tag_skew, code_density=args.code_density,
+        per_page=args.per_page, sections=args.sections, seed=args.seed,
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
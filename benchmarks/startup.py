@@ -0,0 +1,102 @@
+# coding: utf-8
+"""
+    benchmarks.startup
+    ~~~~~~~~~~~~~~~~~~
+
+    Check the startup cost of writeup against a budget::
+
+        $ python benchmarks/startup.py --budget 75
+
+    ``import writeup`` must not import the heavy dependencies, they are
+    loaded on first use. On Python 3.7+ the import time is measured by
+    ``python -X importtime``, otherwise by the wall time of the import.
+    The exit code is 1 when the budget is exceeded.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: must not be imported by ``import writeup``
+DEFERRED = (
+    'jinja2', 'markupsafe', 'mistune', 'pygments', 'pytz', 'yaml', 'PIL',
+)
+
+SCRIPT = '''
+import sys, time, json
+begin = time.time()
+import writeup
+elapsed = (time.time() - begin) * 1000
+loaded = sorted(set(m.split('.')[0] for m in sys.modules))
+print(json.dumps({'ms': elapsed, 'modules': loaded}))
+'''
+
+
+def run_python(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    proc = subprocess.Popen(
+        [sys.executable] + args, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+def importtime(stderr, name='writeup'):
+    """Cumulative microseconds of a module in ``-X importtime``."""
+    for line in stderr.splitlines():
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == name:
+            return int(parts[1])
+    return None
+
+
+def measure(repeat):
+    timings = []
+    modules = []
+    for i in range(repeat):
+        args = ['-c', SCRIPT]
+        if sys.version_info >= (3, 7):
+            args = ['-X', 'importtime'] + args
+        out, err = run_python(args)
+        data = json.loads(out)
+        us = importtime(err)
+        timings.append(us / 1000.0 if us is not None else data['ms'])
+        modules = data['modules']
+    return min(timings), modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check startup time.')
+    parser.add_argument('--budget', type=float, default=75,
+                        help='milliseconds allowed for import writeup')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    ms, modules = measure(args.repeat)
+    print('  import writeup  %.3f ms (budget %.0f ms)' % (ms, args.budget))
+
+    rv = 0
+    eager = [name for name in DEFERRED if name in modules]
+    if eager:
+        print('  EAGER IMPORTS %s' % ', '.join(eager))
+        rv = 1
+    if ms > args.budget:
+        print('  OVER BUDGET by %.3f ms' % (ms - args.budget))
+        rv = 1
+    return rv
+
+
+if __name__ == '__main__':
+    sys.exit(main())
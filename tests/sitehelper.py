@@ -0,0 +1,100 @@
+# coding: utf-8
+"""Create small sites in temporary directories for tests."""
+
+import os
+import time
+import shutil
+import logging
+import pkgutil
+import tempfile
+import importlib
+from contextlib import contextmanager
+
+import writeup
+
+# the package may be imported by a relative path, tests change the
+# working directory, so every module is imported before
+for _finder, _name, _ispkg in pkgutil.iter_modules(writeup.__path__):
+    importlib.import_module('writeup.' + _name)
+
+logging.getLogger('writeup').setLevel(logging.ERROR)
+
+LAYOUT = u'''<html><head><title>{{ page.title }}</title></head>
+<body><h1>{{ page.title }}</h1>
+{{ page.content|markdown }}
+</body></html>
+'''
+
+
+def post(title, date, tags=None, body=u'Hello.', **meta):
+    lines = [title, u'=' * len(title), u'', u'- date: %s' % date]
+    if tags:
+        lines.append(u'- tags: %s' % u', '.join(tags))
+    for key in sorted(meta):
+        lines.append(u'- %s: %s' % (key, meta[key]))
+    lines.extend([u'', u'---', u'', body, u''])
+    return u'\n'.join(lines)
+
+
+class Site(object):
+    """A site in a temporary directory.
+
+    :param files: a dict of relative paths to contents
+    :param config: the lines of ``_config.yml``
+    """
+    def __init__(self, files=None, config=u''):
+        self.basedir = tempfile.mkdtemp(prefix='writeup-test-')
+        self.write('_layouts/post.html', LAYOUT)
+        self.write('_config.yml', u'title: test\n' + config)
+        for name in files or {}:
+            self.write(name, files[name])
+
+    def path(self, name):
+        return os.path.join(self.basedir, name)
+
+    def write(self, name, content, later=False):
+        """Write a file, ``later`` sets the mtime into the future so
+        an incremental build sees it changed."""
+        filepath = self.path(name)
+        folder = os.path.dirname(filepath)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(filepath, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        if later:
+            mtime = time.time() + 10
+            os.utime(filepath, (mtime, mtime))
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    @contextmanager
+    def cwd(self):
+        """Work in the directory of the site, paths of the config are
+        relative to it."""
+        cwd = os.getcwd()
+        os.chdir(self.basedir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+    def create(self):
+        from writeup import Writeup
+        with self.cwd():
+            return Writeup(config='_config.yml')
+
+    def build(self, **config):
+        """Build the site with a new application, return it."""
+        with self.cwd():
+            wp = self.create()
+            wp.app.config.update(config)
+            wp.build_site()
+            return wp
+
+    def remove(self):
+        shutil.rmtree(self.basedir)
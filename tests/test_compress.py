@@ -0,0 +1,62 @@
+# coding: utf-8
+
+import os
+import gzip
+import shutil
+import tempfile
+
+from writeup.compress import Compressor
+from sitehelper import Site
+
+
+def read_gzip(filepath):
+    f = gzip.open(filepath, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def test_compressor():
+    sitedir = tempfile.mkdtemp(prefix='writeup-test-')
+    db_file = os.path.join(sitedir, 'compress.index')
+    html = os.path.join(sitedir, 'index.html')
+    image = os.path.join(sitedir, 'a.png')
+    try:
+        for filepath in (html, image):
+            with open(filepath, 'wb') as f:
+                f.write(b'<p>home</p>')
+
+        compressor = Compressor(db_file, sitedir)
+        compressor.add(html)
+        compressor.add(image)
+        compressor.run()
+        assert read_gzip(html + '.gz') == b'<p>home</p>'
+        assert not os.path.exists(image + '.gz')
+
+        # unchanged outputs are not compressed again
+        compressor = Compressor(db_file, sitedir)
+        assert compressor.compress(html) is False
+        with open(html, 'wb') as f:
+            f.write(b'<p>changed</p>')
+        assert compressor.compress(html) is True
+        assert read_gzip(html + '.gz') == b'<p>changed</p>'
+
+        os.remove(html + '.gz')
+        assert compressor.compress(html) is True
+        assert Compressor(db_file, sitedir, force=True).compress(html)
+    finally:
+        shutil.rmtree(sitedir)
+
+
+def test_precompress_site():
+    site = Site({
+        'index.html': u'<p>home</p>',
+        'a.txt': u'text',
+    }, u'precompress: true\n')
+    try:
+        site.build()
+        assert read_gzip(site.path('_site/index.html.gz')) == b'<p>home</p>'
+        assert site.exists('_site/a.txt.gz')
+    finally:
+        site.remove()
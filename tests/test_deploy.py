@@ -0,0 +1,80 @@
+# coding: utf-8
+
+import os
+import json
+import shutil
+import tempfile
+
+from writeup.deploy import deploy, diff, MANIFEST_NAME
+
+
+class Dirs(object):
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='writeup-test-')
+        self.sitedir = os.path.join(self.root, 'site')
+        self.target = os.path.join(self.root, 'target')
+        self.cachedir = os.path.join(self.root, 'cache')
+        os.makedirs(self.cachedir)
+
+    def write(self, name, data):
+        filepath = os.path.join(self.sitedir, name)
+        folder = os.path.dirname(filepath)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+
+    def deploy(self, force=False):
+        return deploy(self.sitedir, self.target, self.cachedir, force=force)
+
+    def deployed(self, name):
+        return os.path.join(self.target, name)
+
+    def remove(self):
+        shutil.rmtree(self.root)
+
+
+def test_diff():
+    outputs = {'a': '1', 'b': '2', 'c': '3'}
+    deployed = {'a': '1', 'b': '0', 'd': '4'}
+    assert diff(outputs, deployed) == (['b', 'c'], ['d'])
+
+
+def test_deploy_changes():
+    dirs = Dirs()
+    try:
+        dirs.write('index.html', b'home')
+        dirs.write('a/b/c.html', b'c')
+        assert dirs.deploy() == (['a/b/c.html', 'index.html'], [])
+        with open(dirs.deployed(MANIFEST_NAME), 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        assert sorted(manifest['outputs']) == ['a/b/c.html', 'index.html']
+
+        assert dirs.deploy() == ([], [])
+
+        dirs.write('index.html', b'changed')
+        os.remove(os.path.join(dirs.sitedir, 'a/b/c.html'))
+        assert dirs.deploy() == (['index.html'], ['a/b/c.html'])
+        with open(dirs.deployed('index.html'), 'rb') as f:
+            assert f.read() == b'changed'
+        # empty parents are removed
+        assert not os.path.exists(dirs.deployed('a'))
+
+        assert dirs.deploy(force=True) == (['index.html'], [])
+    finally:
+        dirs.remove()
+
+
+def test_deploy_into_the_site():
+    dirs = Dirs()
+    try:
+        dirs.write('index.html', b'home')
+        target = os.path.join(dirs.sitedir, 'public')
+        try:
+            deploy(dirs.sitedir, target, dirs.cachedir)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('deployed into the site directory')
+    finally:
+        dirs.remove()
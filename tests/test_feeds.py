@@ -0,0 +1,58 @@
+# coding: utf-8
+
+from sitehelper import Site, post
+
+
+def create_site():
+    return Site({
+        '_posts/2015/hello.md': post(u'Hello', u'2015-01-02'),
+        '_posts/2015/second.md': post(u'Second', u'2015-02-03'),
+        '_posts/2015/third.md': post(u'Third', u'2015-03-04'),
+    }, u'baseurl: http://a\nsitemap:\n  limit: 1\n')
+
+
+def test_sitemap_parts():
+    site = create_site()
+    try:
+        site.build()
+        index = site.read('_site/sitemap.xml')
+        assert u'<sitemapindex' in index
+        assert u'http://a/sitemap-3.xml' in index
+        assert u'/third' in site.read('_site/sitemap-3.xml')
+
+        site.build(sitemap={'limit': 2})
+        assert site.exists('_site/sitemap-2.xml')
+        assert not site.exists('_site/sitemap-3.xml')
+
+        site.build(sitemap={'limit': 10})
+        assert u'<urlset' in site.read('_site/sitemap.xml')
+        assert not site.exists('_site/sitemap-1.xml')
+    finally:
+        site.remove()
+
+
+def test_feed_entries():
+    site = Site({
+        '_posts/2015/hello.md': post(u'Hello', u'2015-01-02', body=u'*a*'),
+        '_posts/2015/second.md': post(u'Second <b>', u'2015-02-03'),
+        '_posts/2015/third.md': post(u'Third', u'2015-03-04'),
+    }, u'baseurl: http://a\nfeed:\n  count: 2\ntimezone: UTC\n')
+    try:
+        site.build()
+        feed = site.read('_site/feed.xml')
+        assert feed.index(u'Third') < feed.index(u'Second')
+        assert u'<title>Hello</title>' not in feed
+        assert u'<title>Second &lt;b&gt;</title>' in feed
+        assert u'<updated>2015-03-04T00:00:00+00:00</updated>' in feed
+
+        site.write(
+            '_posts/2015/hello.md',
+            post(u'Hello', u'2015-04-05', body=u'*a*'), later=True,
+        )
+        site.build()
+        feed = site.read('_site/feed.xml')
+        assert u'<title>Hello</title>' in feed
+        assert u'Second' not in feed
+        assert u'&lt;em&gt;a&lt;/em&gt;' in feed
+    finally:
+        site.remove()
@@ -0,0 +1,14 @@
+# coding: utf-8
+
+from writeup.filters import wordcount, linguist
+
+
+def test_wordcount():
+    assert wordcount(u'Hello world, 中文') == 4
+    # a run of kana is one word
+    assert wordcount(u'ひらがな 한국어') == 4
+
+
+def test_linguist():
+    assert linguist(u'Hello world') == 'en'
+    assert linguist(u'你好，世界 hello') == 'zh'
@@ -0,0 +1,55 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+
+from writeup.fingerprint import Fingerprints
+from sitehelper import Site, post
+
+
+def test_feed_depends_on_the_urls_and_dates():
+    config = {'baseurl': 'http://a', 'feed': True}
+    digest = Fingerprints('fingerprint.json', config).digest('feed')
+    for key, value in (('permalink', '/:year/:filename/'),
+                       ('timezone', 'UTC')):
+        changed = dict(config, **{key: value})
+        assert Fingerprints('x', changed).digest('feed') != digest
+
+
+def test_prune_only_when_changed():
+    cachedir = tempfile.mkdtemp(prefix='writeup-test-')
+    db_file = os.path.join(cachedir, 'fingerprint.json')
+
+    def touch(name):
+        open(os.path.join(cachedir, name), 'wb').close()
+
+    try:
+        Fingerprints(db_file, {}).save()
+        touch('feed.stale.key')
+        Fingerprints(db_file, {}).save()
+        assert os.path.exists(os.path.join(cachedir, 'feed.stale.key'))
+
+        fingerprints = Fingerprints(db_file, {'feed': True})
+        touch('feed.%s.key' % fingerprints.digest('feed'))
+        fingerprints.save()
+        assert sorted(os.listdir(cachedir)) == [
+            'feed.%s.key' % fingerprints.digest('feed'), 'fingerprint.json',
+        ]
+    finally:
+        shutil.rmtree(cachedir)
+
+
+def test_feed_entry_urls_follow_the_permalink():
+    site = Site({
+        '_posts/2015/hello.md': post(u'Hello', u'2015-01-02'),
+    }, u'baseurl: http://a\nfeed: true\npermalink: /:year/:filename.html\n')
+    try:
+        site.build()
+        assert u'http://a/2015/hello.html' in site.read('_site/feed.xml')
+        site.build(permalink='/:year/:filename/')
+        feed = site.read('_site/feed.xml')
+        assert u'http://a/2015/hello/' in feed
+        assert u'hello.html' not in feed
+    finally:
+        site.remove()
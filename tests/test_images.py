@@ -0,0 +1,41 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+from nose import SkipTest
+
+from writeup.images import ImageIndex, load_pillow
+
+
+def create_index(basedir, **options):
+    cachedir = os.path.join(basedir, 'cache')
+    os.makedirs(cachedir)
+    db_file = os.path.join(basedir, 'images.index')
+    return ImageIndex(db_file, basedir, cachedir, options)
+
+
+def test_corrupt_images_are_skipped():
+    Image = load_pillow()
+    if Image is None:
+        raise SkipTest('Pillow is not installed')
+
+    basedir = tempfile.mkdtemp(prefix='writeup-test-')
+    try:
+        Image.new('RGB', (600, 300)).save(os.path.join(basedir, 'a.png'))
+        for name in ('b.jpg', 'c.png'):
+            with open(os.path.join(basedir, name), 'wb') as f:
+                f.write(b'not an image')
+
+        images = create_index(basedir, widths=[300], workers=2)
+        assert images.process(['a.png', 'b.jpg', 'c.png']) == 1
+        assert images.get('a.png')['width'] == 600
+        assert sorted(images.failed) == ['b.jpg', 'c.png']
+
+        # failed images are not tried again until they change
+        assert images.process(['b.jpg']) == 0
+        assert images.attributes('/b.jpg') is None
+        attrs = dict(images.attributes('/a.png'))
+        assert attrs['srcset'].endswith('/a.png 600w')
+    finally:
+        shutil.rmtree(basedir)
@@ -0,0 +1,67 @@
+# coding: utf-8
+
+from sitehelper import Site, post
+
+QUERY = u'''<ul>{% for p in site.query(tag='a') %}
+<li>{{ p.title }}</li>{% endfor %}</ul>
+'''
+
+INCLUDE = u'''<ul>{% for p in site.posts(count=5) %}
+<li>{{ p.title }}</li>{% endfor %}</ul>
+'''
+
+
+def create_site():
+    return Site({
+        '_posts/2015/hello.md': post(u'Hello', u'2015-01-02', [u'a']),
+        '_posts/2015/second.md': post(u'Second', u'2015-02-03', [u'a']),
+        '_includes/latest.html': INCLUDE,
+        'tags.html': QUERY,
+        'latest.html': u'{% include "latest.html" %}',
+        'about.html': u'<p>about</p>',
+    })
+
+
+def test_query_page_is_built_again():
+    site = create_site()
+    try:
+        site.build()
+        assert u'Second' in site.read('_site/tags.html')
+
+        site.write(
+            '_posts/2015/second.md',
+            post(u'Second Edited', u'2015-02-03', [u'a']), later=True,
+        )
+        site.build()
+        assert u'Second Edited' in site.read('_site/tags.html')
+    finally:
+        site.remove()
+
+
+def test_included_listing_is_recorded():
+    site = create_site()
+    try:
+        wp = site.build()
+        listed = set(wp.app.listing_index)
+        assert site.path('latest.html') in listed
+        assert site.path('about.html') not in listed
+
+        site.write(
+            '_posts/2015/hello.md',
+            post(u'Hello Edited', u'2015-01-02', [u'a']), later=True,
+        )
+        site.build()
+        assert u'Hello Edited' in site.read('_site/latest.html')
+    finally:
+        site.remove()
+
+
+def test_edited_page_is_built_again():
+    site = create_site()
+    try:
+        site.build()
+        site.write('about.html', u'<p>edited</p>', later=True)
+        site.build()
+        assert site.read('_site/about.html') == u'<p>edited</p>'
+    finally:
+        site.remove()
@@ -0,0 +1,61 @@
+# coding: utf-8
+
+from writeup.minify import minify_html, minify_css, minify_js
+from writeup.minify import rebase_css_urls
+
+
+def test_js_comment_in_the_middle_of_a_line():
+    text = u'foo(); /* start\n  end */ bar();'
+    assert minify_js(text) == u'foo();\nbar();'
+
+
+def test_js_comment_in_one_line():
+    assert minify_js(u'a = 1;/* x */b = 2;') == u'a = 1; b = 2;'
+    assert minify_js(u'  /* x */\n  b = 2; // y') == u'b = 2;'
+
+
+def test_js_comment_tokens_in_strings():
+    text = u'var a = "/* no";\nvar b = \'// no\';\nvar c = "*/";'
+    assert minify_js(text) == text
+
+
+def test_js_template_literal():
+    text = u'var a = `x\n  // kept\n\n  /* kept */ `;\n  // removed'
+    assert minify_js(text) == u'var a = `x\n  // kept\n\n  /* kept */ `;'
+
+
+def test_js_continued_string():
+    text = u'var a = "x\\\n// kept";'
+    assert minify_js(text) == text
+
+
+def test_js_regular_expressions():
+    text = u'var a = /[/*]/g;\nvar b = /https?:\\/\\//;\nvar c = x / 2 / y;'
+    assert minify_js(text) == text
+    assert minify_js(u'return /"/.test(s); // q') == u'return /"/.test(s);'
+
+
+def test_js_kept_comment():
+    text = u'/*! license\n * MIT */\nvar a;'
+    assert minify_js(text) == u'/*! license\n* MIT */\nvar a;'
+
+
+def test_css():
+    text = u'a {\n  color: red;\n}\n/* x */\nb { content: "/* y */"; }'
+    assert minify_css(text) == u'a{color: red} b{content: "/* y */"}'
+
+
+def test_css_rebase_urls():
+    text = u'a { background: url(../img/x.png) }'
+    rv = rebase_css_urls(text, u'css', u'bundles')
+    assert rv == u'a { background: url(../img/x.png) }'
+    rv = rebase_css_urls(u'a { b: url("img/x.png") }', u'', u'bundles/s')
+    assert rv == u'a { b: url("../../img/x.png") }'
+    for url in (u'/x.png', u'data:image/png;base64,AA', u'http://a/b.png'):
+        text = u'a { b: url(%s) }' % url
+        assert rebase_css_urls(text, u'css', u'bundles') == text
+
+
+def test_html_keeps_pre():
+    html = u'<div>\n  <p> a  b </p>\n</div><pre>  x\n  y</pre><!-- c -->'
+    assert minify_html(html) == u'<div><p>a b</p></div><pre>  x\n  y</pre>'
@@ -0,0 +1,40 @@
+# coding: utf-8
+
+import json
+from sitehelper import Site, post
+
+
+def test_redirect_maps():
+    site = Site({
+        '_posts/2015/hello.md': post(
+            u'Hello', u'2015-01-02', redirect_from=u'[/old/, /older.html]'
+        ),
+    }, u'permalink: /:year/:filename/\nredirects: [nginx, apache]\n')
+    try:
+        site.build()
+        data = json.loads(site.read('_site/redirects.json'))
+        assert data == {
+            u'/old/': u'/2015/hello/', u'/older.html': u'/2015/hello/',
+        }
+        nginx = site.read('_site/redirects.map')
+        assert u'    "/old/" "/2015/hello/";' in nginx
+        apache = site.read('_site/.htaccess')
+        assert u'Redirect 301 "/older.html" "/2015/hello/"' in apache
+        # no html stubs with a map
+        assert not site.exists('_site/old/index.html')
+    finally:
+        site.remove()
+
+
+def test_html_stubs():
+    site = Site({
+        '_posts/2015/hello.md': post(
+            u'Hello', u'2015-01-02', redirect_from=u'[/old/]'
+        ),
+    }, u'permalink: /:year/:filename/\n')
+    try:
+        site.build()
+        assert u'/2015/hello/' in site.read('_site/old/index.html')
+        assert not site.exists('_site/redirects.json')
+    finally:
+        site.remove()
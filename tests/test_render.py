@@ -0,0 +1,30 @@
+# coding: utf-8
+
+from sitehelper import Site, post
+from writeup.render import Renderer
+
+INDEX = u'''{% for p in paginator.posts %}
+<div>{{ p.content|markdown }}</div>{% endfor %}
+'''
+
+
+def test_listing_is_rendered_again_after_an_edit():
+    site = Site({
+        '_posts/2015/hello.md': post(u'Hello', u'2015-01-02', body=u'One.'),
+        '_posts/index.html': INDEX,
+    })
+    try:
+        with site.cwd():
+            app = site.create().app
+            renderer = Renderer(app, interval=0)
+            entry = renderer.get('/')
+            assert b'One.' in entry.body
+
+            site.write(
+                '_posts/2015/hello.md',
+                post(u'Hello', u'2015-01-02', body=u'Two.'), later=True,
+            )
+            entry = renderer.get('/')
+            assert b'Two.' in entry.body
+    finally:
+        site.remove()
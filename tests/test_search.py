@@ -0,0 +1,56 @@
+# coding: utf-8
+
+import os
+import json
+from writeup.search import tokenize, shard_name
+from sitehelper import Site, post
+
+
+def test_tokenize():
+    assert tokenize(u'Hello, a World') == [u'hello', u'world']
+    assert tokenize(u'中文 ひら') == [u'中', u'文', u'ひ', u'ら']
+
+
+def test_shard_name():
+    assert shard_name(u'ab') == u'ab'
+    assert shard_name(u'docs') == u'_64-6f-63-73'
+    assert shard_name(u'中文') == u'_4e2d-6587'
+
+
+def load(site, name):
+    return json.loads(site.read('_site/search/%s.json' % name))
+
+
+def test_shards():
+    site = Site({
+        '_posts/2015/apple.md': post(u'Apple', u'2015-01-02', body=u'pie'),
+        '_posts/2015/banana.md': post(u'Banana', u'2015-02-03', body=u'pie'),
+        '_posts/2015/cherry.md': post(u'Cherry', u'2015-03-04', body=u'tart'),
+    }, u'search: true\n')
+    try:
+        site.build()
+        assert load(site, 'index') == {
+            u'prefix': 2, u'shards': [u'ap', u'ba', u'ch', u'pi', u'ta'],
+        }
+        docs = load(site, 'docs')['docs']
+        pie = load(site, 'pi')[u'pie']
+        assert sorted(docs[i][1] for i, _ in pie) == [u'Apple', u'Banana']
+        mtime = os.path.getmtime(site.path('_site/search/ch.json'))
+
+        os.remove(site.path('_posts/2015/apple.md'))
+        site.write(
+            '_posts/2015/banana.md',
+            post(u'Banana', u'2015-02-03', body=u'cake'), later=True,
+        )
+        site.build()
+        assert load(site, 'index')[u'shards'] == [
+            u'ba', u'ca', u'ch', u'ta',
+        ]
+        assert not site.exists('_site/search/ap.json')
+        assert not site.exists('_site/search/pi.json')
+        docs = load(site, 'docs')['docs']
+        assert [doc and doc[1] for doc in docs].count(None) == 1
+        # shards without changed terms are not written again
+        assert os.path.getmtime(site.path('_site/search/ch.json')) == mtime
+    finally:
+        site.remove()
@@ -0,0 +1,232 @@
+# coding: utf-8
+
+import os
+import time
+import json
+import shutil
+import socket
+import tempfile
+import threading
+from wsgiref import util
+
+from writeup.server import Server, FileCache, parse_range
+from writeup.compress import gzip_compress
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+
+class Response(object):
+    def __init__(self, server, path, **headers):
+        environ = {'PATH_INFO': path}
+        for key in headers:
+            environ['HTTP_' + key.upper()] = headers[key]
+        util.setup_testing_defaults(environ)
+        self.body = b''.join(server.wsgi(environ, self.start_response))
+
+    def start_response(self, status, headers):
+        self.status = int(status.split()[0])
+        self.headers = dict(headers)
+
+
+class SiteDir(object):
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='writeup-test-')
+
+    def write(self, name, data, mtime=None):
+        filepath = os.path.join(self.path, name)
+        folder = os.path.dirname(filepath)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+
+def test_etag_and_not_modified():
+    site = SiteDir()
+    try:
+        site.write('index.html', b'<p>home</p>')
+        server = Server(site.path)
+        rv = Response(server, '/')
+        assert rv.status == 200
+        assert rv.body == b'<p>home</p>'
+        etag = rv.headers['Etag']
+        last_modified = rv.headers['Last-Modified']
+
+        rv = Response(server, '/', if_none_match=etag)
+        assert rv.status == 304
+        assert rv.body == b''
+        rv = Response(server, '/', if_none_match='W/%s' % etag)
+        assert rv.status == 304
+        rv = Response(server, '/', if_modified_since=last_modified)
+        assert rv.status == 304
+
+        site.write('index.html', b'<p>changed</p>', time.time() + 10)
+        rv = Response(server, '/', if_none_match=etag)
+        assert rv.status == 200
+        assert rv.body == b'<p>changed</p>'
+    finally:
+        site.remove()
+
+
+def test_precompressed_sibling():
+    site = SiteDir()
+    try:
+        mtime = time.time() - 10
+        site.write('a.css', b'a { color: red }', mtime)
+        site.write('a.css.gz', gzip_compress(b'a { color: red }'), mtime)
+        server = Server(site.path)
+        rv = Response(server, '/a.css', accept_encoding='gzip')
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        etag = rv.headers['Etag']
+
+        rv = Response(server, '/a.css', accept_encoding='gzip;q=0')
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.body == b'a { color: red }'
+        # the validator of the identity body does not match the sibling
+        rv = Response(server, '/a.css', if_none_match=etag)
+        assert rv.status == 200
+
+        # an older sibling is stale
+        site.write('a.css', b'a { color: blue }')
+        rv = Response(server, '/a.css', accept_encoding='gzip')
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.body == b'a { color: blue }'
+    finally:
+        site.remove()
+
+
+def test_range():
+    site = SiteDir()
+    try:
+        site.write('a.txt', b'0123456789')
+        # files larger than max_body are streamed from the disk
+        for cache in (FileCache(), FileCache(max_body=4)):
+            server = Server(site.path, cache=cache)
+            rv = Response(server, '/a.txt', range='bytes=2-4')
+            assert rv.status == 206
+            assert rv.body == b'234'
+            assert rv.headers['Content-Range'] == 'bytes 2-4/10'
+            assert rv.headers['Content-Length'] == '3'
+
+            rv = Response(server, '/a.txt', range='bytes=-3')
+            assert rv.body == b'789'
+            rv = Response(server, '/a.txt', range='bytes=20-')
+            assert rv.status == 416
+            assert rv.headers['Content-Range'] == 'bytes */10'
+
+            rv = Response(
+                server, '/a.txt', range='bytes=2-4', if_range='"other"'
+            )
+            assert rv.status == 200
+            assert rv.body == b'0123456789'
+    finally:
+        site.remove()
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-', 5) == (0, 4)
+    assert parse_range('bytes=3-100', 5) == (3, 4)
+    assert parse_range('bytes=0-1,3-4', 5) is None
+    assert parse_range('items=0-1', 5) is None
+    assert parse_range('bytes=a-b', 5) is None
+
+
+def test_redirects_and_not_found():
+    site = SiteDir()
+    try:
+        site.write('404.html', b'missing')
+        site.write('redirects.json', json.dumps({'/old/': '/new/'}).encode())
+        server = Server(site.path)
+        rv = Response(server, '/old/')
+        assert rv.status == 301
+        assert rv.headers['Location'] == '/new/'
+        rv = Response(server, '/new/')
+        assert rv.status == 404
+        assert rv.body == b'missing'
+    finally:
+        site.remove()
+
+
+def test_file_cache_lru():
+    site = SiteDir()
+    try:
+        names = ['a', 'b', 'c']
+        paths = dict((n, site.write(n, n.encode() * 4)) for n in names)
+        cache = FileCache(max_entries=2)
+        a = cache.get(paths['a'])
+        cache.get(paths['b'])
+        assert cache.get(paths['a']) is a
+        cache.get(paths['c'])
+        # b is the least recently used
+        assert list(cache._entries) == [paths['a'], paths['c']]
+        assert cache.memory == 8
+
+        cache = FileCache(max_memory=8, max_body=4)
+        for name in names:
+            cache.get(paths[name])
+        assert list(cache._entries) == [paths['b'], paths['c']]
+        assert cache.memory == 8
+
+        site.write('c', b'cccccc', time.time() + 10)
+        entry = cache.get(paths['c'])
+        assert entry.body is None
+        assert cache.memory == 4
+        os.unlink(paths['c'])
+        assert cache.get(paths['c']) is None
+        assert cache.memory == 4
+    finally:
+        site.remove()
+
+
+def test_keep_alive():
+    site = SiteDir()
+    try:
+        site.write('index.html', b'<p>home</p>')
+        site.write('a.css', b'a { color: red }')
+        httpd = Server(site.path).make_server('127.0.0.1', 0, workers=2)
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        try:
+            port = httpd.server_address[1]
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            resp = conn.getresponse()
+            assert resp.read() == b'<p>home</p>'
+            sock = conn.sock
+            assert sock is not None
+
+            conn.request('GET', '/a.css')
+            resp = conn.getresponse()
+            assert resp.status == 200
+            assert resp.read() == b'a { color: red }'
+            # the second request is served on the same connection
+            assert conn.sock is sock
+            conn.close()
+
+            # HTTP/1.0 closes the connection after a response
+            client = socket.create_connection(('127.0.0.1', port), 5)
+            client.sendall(b'GET / HTTP/1.0\r\n\r\n')
+            data = b''
+            while True:
+                chunk = client.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            client.close()
+            assert data.endswith(b'<p>home</p>')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+    finally:
+        site.remove()
@@ -0,0 +1,29 @@
+# coding: utf-8
+
+from writeup.app import Application
+
+
+def create_app(basedir, index):
+    app = Application(basedir=basedir)
+    app.config['shard'] = (index, 3)
+    return app
+
+
+def owners(basedir, key):
+    return [i for i in (1, 2, 3) if create_app(basedir, i).in_shard(key)]
+
+
+def test_url_shard_is_independent_of_basedir():
+    for key in ('/', '/page/2', '/feed.xml', '/2010/', 'redirects'):
+        shallow = owners('/tmp/a', key)
+        deep = owners('/home/ci/work/build/site', key)
+        assert len(shallow) == 1
+        assert shallow == deep
+
+
+def test_source_shard_is_independent_of_basedir():
+    for basedir in ('/tmp/a', '/home/ci/work/build/site'):
+        app = create_app(basedir, 1)
+        key = app.source_key(basedir + '/_posts/2015/hello.md')
+        assert key == '_posts/2015/hello.md'
+    assert owners('/tmp/a', key) == owners('/home/ci/work/build/site', key)
@@ -0,0 +1,53 @@
+# coding: utf-8
+
+import os
+from writeup.staging import Generations
+from sitehelper import Site
+
+
+def test_atomic_builds_and_rollback():
+    site = Site({'index.html': u'<p>one</p>'}, u'atomic: true\n')
+    try:
+        with site.cwd():
+            wp = site.create()
+            wp.run()
+        sitedir = site.path('_site')
+        assert os.path.islink(sitedir)
+        assert site.read('_site/index.html') == u'<p>one</p>'
+        first = os.path.realpath(sitedir)
+
+        site.write('index.html', u'<p>two</p>', later=True)
+        with site.cwd():
+            site.create().run()
+        assert site.read('_site/index.html') == u'<p>two</p>'
+        # the previous generation keeps its outputs
+        with open(os.path.join(first, 'index.html'), 'rb') as f:
+            assert f.read() == b'<p>one</p>'
+
+        generations = Generations(sitedir)
+        assert len(generations.names()) == 2
+        assert generations.rollback() == first
+        assert site.read('_site/index.html') == u'<p>one</p>'
+        try:
+            generations.rollback()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('rolled back beyond the first generation')
+    finally:
+        site.remove()
+
+
+def test_cleanup():
+    site = Site()
+    try:
+        generations = Generations(site.path('_site'), keep=1)
+        for i in range(3):
+            staging = generations.stage()
+            generations.swap(staging)
+            generations.cleanup()
+        names = generations.names()
+        assert len(names) == 2
+        assert os.path.basename(generations.current()) == names[-1]
+    finally:
+        site.remove()
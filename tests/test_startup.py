@@ -0,0 +1,32 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import sys, json
+import writeup
+before = sorted(sys.modules)
+writeup.Application
+print(json.dumps({'before': before, 'after': sorted(sys.modules)}))
+'''
+
+
+def run_script():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+    return json.loads(out.decode('utf-8'))
+
+
+def test_import_is_lazy():
+    data = run_script()
+    for name in ('jinja2', 'yaml', 'mistune', 'writeup.app'):
+        assert name not in data['before']
+    assert 'writeup.app' in data['after']
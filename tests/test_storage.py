@@ -0,0 +1,54 @@
+# coding: utf-8
+
+import os
+from writeup.storage import FileStorage, MemoryStorage, create_storage
+from writeup.storage import build_to_memory
+from sitehelper import Site
+
+
+def test_memory_storage():
+    storage = MemoryStorage('/site')
+    storage.write('/site/a/index.html', u'<p>a</p>')
+    storage.write_stream('/site/b.txt', [u'b', b'c'])
+    assert storage.files == {'a/index.html': b'<p>a</p>', 'b.txt': b'bc'}
+    assert storage.exists('/site/b.txt')
+    assert storage.mtime('/site/b.txt') is not None
+    storage.link('/site/b.txt', '/site/c.txt')
+    assert storage.read('/site/c.txt') == b'bc'
+    storage.remove('/site/b.txt')
+    assert not storage.exists('/site/b.txt')
+    assert storage.mtime('/site/b.txt') is None
+    try:
+        storage.read('/site/b.txt')
+    except IOError:
+        pass
+    else:
+        raise AssertionError('read a removed output')
+
+
+def test_file_storage_breaks_hard_links():
+    site = Site()
+    try:
+        storage = create_storage('file', site.path('_site'))
+        assert isinstance(storage, FileStorage)
+        old = site.path('_site/old.html')
+        dest = site.path('_site/index.html')
+        storage.write(old, u'old')
+        storage.link(old, dest)
+        storage.write(dest, u'new')
+        assert site.read('_site/old.html') == u'old'
+        assert site.read('_site/index.html') == u'new'
+    finally:
+        site.remove()
+
+
+def test_build_to_memory():
+    site = Site({'index.html': u'<p>home</p>', 'a.txt': u'text'})
+    try:
+        with site.cwd():
+            files = build_to_memory('_config.yml')
+        assert files['index.html'] == b'<p>home</p>'
+        assert files['a.txt'] == b'text'
+        assert not os.path.exists(site.path('_site'))
+    finally:
+        site.remove()
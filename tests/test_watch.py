@@ -0,0 +1,26 @@
+# coding: utf-8
+
+import os
+from writeup.watch import Watcher
+from sitehelper import Site
+
+
+def test_static_url_of_a_changed_asset():
+    site = Site({
+        'css/a.css': u'a { color: red }',
+        'index.html': u'<link href="{{ static_url("css/a.css") }}">',
+    })
+    try:
+        with site.cwd():
+            wp = site.create()
+            wp.build_site()
+            mtime = int(os.path.getmtime(site.path('css/a.css')))
+            assert u'?t=%i' % mtime in site.read('_site/index.html')
+
+            site.write('css/a.css', u'a { color: blue }', later=True)
+            Watcher(wp).rebuild([site.path('css/a.css')])
+            mtime = int(os.path.getmtime(site.path('css/a.css')))
+            assert u'?t=%i' % mtime in site.read('_site/index.html')
+            assert u'blue' in site.read('_site/css/a.css')
+    finally:
+        site.remove()
@@ -12,30 +12,192 @@ __license__ = 'BSD'
 __homepage__ = 'https://github.com/lepture/writeup'
 
 
-from .app import Application
-from .builder import PostBuilder, PageBuilder, FileBuilder
+import sys
+import types
+import logging
+import importlib
+
+logger = logging.getLogger('writeup')
+
+#: names exported by the package, their modules are imported on use,
+#: ``writeup --help`` needs nothing but the version
+_exports = {
+    'Application': 'app',
+    'PostBuilder': 'builder',
+    'PageBuilder': 'builder',
+    'FileBuilder': 'builder',
+    'BundleBuilder': 'builder',
+    'SitemapBuilder': 'feeds',
+    'FeedBuilder': 'feeds',
+    'RedirectBuilder': 'redirects',
+    'SearchBuilder': 'search',
+    'ArchiveBuilder': 'archives',
+    'ImageBuilder': 'images',
+    'Generations': 'staging',
+    'shard_dirname': 'shard',
+    'write_manifest': 'shard',
+    'build_to_memory': 'storage',
+}
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name)
+        )
+    module = importlib.import_module('.' + _exports[name], __name__)
+    return getattr(module, name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
 
 
 class Writeup(object):
     def __init__(self, config=None, **kwargs):
+        from .app import Application
+        from .builder import PostBuilder, PageBuilder, FileBuilder
+        from .builder import BundleBuilder
+        from .feeds import SitemapBuilder, FeedBuilder
+        from .redirects import RedirectBuilder
+        from .search import SearchBuilder
+        from .archives import ArchiveBuilder
+        from .images import ImageBuilder
+
         app = Application(config=config, **kwargs)
         self.post_builder = PostBuilder(app)
         self.page_builder = PageBuilder(app)
         self.file_builder = FileBuilder(app)
+        self.bundle_builder = BundleBuilder(app)
+        self.sitemap_builder = SitemapBuilder(app)
+        self.feed_builder = FeedBuilder(app)
+        self.redirect_builder = RedirectBuilder(app)
+        self.search_builder = SearchBuilder(app)
+        self.archive_builder = ArchiveBuilder(app)
+        self.image_builder = ImageBuilder(app)
         self.app = app
 
     def build(self, filepath):
         with self.app.create_context():
+            self.bundle_builder.run()
             if filepath in self.app.post_indexer.keys():
                 self.post_builder.build(filepath)
+                self.redirect_builder.run()
             elif filepath in self.app.page_indexer.keys():
                 self.page_builder.build(filepath)
+                self.redirect_builder.run()
             else:
                 self.file_builder.build(filepath)
+            self.feed_builder.run()
+            self.archive_builder.run()
+            self.search_builder.run()
+            self.compress()
+            self.app.output_manifest.save()
+            self.app.save_dependencies()
 
     def run(self):
+        shard = self.app.config.get('shard')
+        if shard:
+            from .shard import shard_dirname, write_manifest
+            index, total = shard
+            sitedir = shard_dirname(self.app.sitedir, index, total)
+            self.app.sitedir = sitedir
+            self.build_site()
+            write_manifest(self.app, index, total)
+            return
+
+        if not self.app.config.get('atomic'):
+            return self.build_site()
+
+        from .staging import Generations
+        keep = self.app.config.get('generations', 3)
+        generations = Generations(self.app.sitedir, keep=keep)
+        staging = generations.stage()
+        self.app.sitedir = staging
+        try:
+            self.build_site()
+        except BaseException:
+            generations.discard(staging)
+            raise
+        generations.swap(staging)
+        generations.cleanup()
+
+    def build_site(self):
+        profiler = self.app.profiler
+        shard = self.app.config.get('shard')
         with self.app.create_context():
             self.app.create_index()
-            self.post_builder.run()
-            self.page_builder.run()
-            self.file_builder.run()
+            with profiler.span('bundles'):
+                self.bundle_builder.run()
+            with profiler.span('images'):
+                self.image_builder.run()
+            with profiler.span('posts'):
+                self.post_builder.run()
+            with profiler.span('pages'):
+                self.page_builder.run()
+            with profiler.span('redirects'):
+                self.redirect_builder.run()
+            with profiler.span('files'):
+                self.file_builder.run()
+            with profiler.span('archives'):
+                self.archive_builder.run()
+            with profiler.span('feeds'):
+                self.sitemap_builder.run()
+                self.feed_builder.run()
+            with profiler.span('search'):
+                self.search_builder.run()
+            with profiler.span('compress'):
+                self.compress()
+            if self.app.config.get('prune') and not shard and \
+                    not self.app.in_memory:
+                self.prune()
+            self.app.output_manifest.save()
+            self.app.save_dependencies()
+            if not self.app.in_memory:
+                # outputs in the site directory match the config now
+                self.app.fingerprints.save()
+            self.report()
+
+    def compress(self):
+        if self.app.compressor:
+            self.app.compressor.run()
+
+    def prune(self):
+        """Delete outputs whose source no longer exists."""
+        sources = self.app.live_sources()
+        count = self.app.output_manifest.prune(sources)
+        logger.info('PRUNING %i' % count)
+
+    def report(self):
+        governor = self.app.memory_governor
+        if governor and governor.peak:
+            logger.info('MEMORY peak %i MB, limit %i MB' % (
+                governor.peak // 1024, governor.limit // 1024
+            ))
+        minifier = self.app.minifier
+        if minifier and minifier.original_bytes:
+            logger.info('MINIFYING %i -> %i bytes' % (
+                minifier.original_bytes, minifier.minified_bytes
+            ))
+
+
+class _LazyModule(types.ModuleType):
+    """The package on Python < 3.7, without module ``__getattr__``
+    (PEP 562) the exports are resolved by a module proxy."""
+
+    def __getattr__(self, name):
+        value = __getattr__(name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_exports))
+
+
+if sys.version_info < (3, 7):
+    _module = _LazyModule(__name__)
+    _module.__dict__.update(globals())
+    # Python 2 clears the globals of a deallocated module, functions
+    # of the package still use them
+    _module._original = sys.modules[__name__]
+    sys.modules[__name__] = _module
@@ -1,13 +1,21 @@
 # coding: utf-8
 
 import os
-import pytz
 import json
+import time
 import fnmatch
 import logging
 import datetime
+import threading
 from contextlib import contextmanager
 from .request import Request
+from .assets import AssetManifest
+from .compress import Compressor
+from .minify import Minifier
+from .manifest import OutputManifest
+from .profiler import Profiler
+from .memory import MemoryGovernor
+from .shard import shard_of
 from .utils import _top
 from .utils import cached_property, json_dump, is_subdir
 
@@ -27,9 +35,13 @@ class Application(object):
             kwargs.update(load_config(config))
 
         self.config = kwargs
+        #: with ``force``, caches older than it are not trusted
+        self.started = time.time()
+        self._dependencies_changed = False
 
     @cached_property
     def timezone(self):
+        import pytz
         return pytz.timezone(self.config.get('timezone', 'Asia/Shanghai'))
 
     @cached_property
@@ -56,6 +68,18 @@ class Application(object):
         os.makedirs(directory)
         return directory
 
+    @cached_property
+    def statedir(self):
+        """Directory of the indexes that describe outputs. In-memory
+        builds keep their own, a build on disk never trusts outputs
+        that only lived in memory."""
+        if not self.in_memory:
+            return self.cachedir
+        directory = os.path.join(self.cachedir, 'memory')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return directory
+
     @cached_property
     def jinja(self):
         layouts = self.config.get('layouts', '_layouts')
@@ -66,25 +90,226 @@ class Application(object):
 
     @contextmanager
     def create_context(self):
+        # contexts can be nested, e.g. a build inside a watcher
+        previous = getattr(_top, 'app', None)
         _top.app = self
         yield
-        del _top.app
+        if previous is None:
+            del _top.app
+        else:
+            _top.app = previous
 
     @cached_property
     def post_indexer(self):
         db_file = os.path.join(self.cachedir, 'post.index')
-        return Indexer(db_file, 'timestamp', 'dirname', 'tags')
+        return Indexer(
+            db_file, 'timestamp', 'dirname', 'tags', 'url', 'redirect_from'
+        )
 
     @cached_property
     def page_indexer(self):
         db_file = os.path.join(self.cachedir, 'page.index')
-        return Indexer(db_file, 'timestamp', 'dirname', 'filename')
+        return Indexer(
+            db_file, 'timestamp', 'dirname', 'filename', 'url', 'redirect_from'
+        )
 
     @cached_property
     def file_indexer(self):
         db_file = os.path.join(self.cachedir, 'file.index')
         return Indexer(db_file, 'timestamp', 'dirname', 'filename')
 
+    @cached_property
+    def profiler(self):
+        return Profiler(enabled=bool(self.config.get('profile')))
+
+    @cached_property
+    def fingerprints(self):
+        from .fingerprint import Fingerprints
+        db_file = os.path.join(self.cachedir, 'fingerprint.json')
+        return Fingerprints(db_file, self.config)
+
+    def is_stale(self, layer):
+        """If caches of a layer are not trusted in this build, because
+        the config or a library it depends on changed, or it is forced."""
+        if self.config.get('force'):
+            return True
+        return self.fingerprints.changed(layer)
+
+    def is_cached(self, cache_file):
+        """If a cache file can be read. With ``force``, only the files
+        written in this build are read."""
+        try:
+            mtime = os.path.getmtime(cache_file)
+        except OSError:
+            return False
+        return not self.config.get('force') or mtime >= self.started
+
+    @cached_property
+    def storage(self):
+        from .storage import create_storage
+        name = self.config.get('storage', 'file')
+        return create_storage(name, self.sitedir)
+
+    @property
+    def in_memory(self):
+        return self.config.get('storage') == 'memory'
+
+    @cached_property
+    def output_manifest(self):
+        db_file = os.path.join(self.statedir, 'output.manifest')
+        return OutputManifest(db_file, self.sitedir)
+
+    @cached_property
+    def asset_manifest(self):
+        db_file = os.path.join(self.statedir, 'asset.manifest')
+        return AssetManifest(db_file, self.basedir)
+
+    @cached_property
+    def static_urls(self):
+        """Urls memoized by ``static_url``, keyed by ``(name, url)``."""
+        return {}
+
+    def reset_assets(self, names):
+        """Check the changed assets again, return True if a page links
+        one of them by ``static_url``, the url of it changed."""
+        names = set(names)
+        for name in names:
+            self.asset_manifest.reset(name)
+        linked = any(key[0] in names for key in self.static_urls)
+        self.__dict__.pop('static_urls', None)
+        return linked
+
+    @cached_property
+    def compressor(self):
+        encodings = self.config.get('precompress')
+        if not encodings or self.in_memory:
+            return None
+        if encodings is True:
+            encodings = ['gzip']
+        db_file = os.path.join(self.cachedir, 'compress.index')
+        workers = self.config.get('compress_workers', 4)
+        return Compressor(
+            db_file, self.sitedir, encodings, workers=workers,
+            force=self.config.get('force'),
+        )
+
+    @cached_property
+    def minifier(self):
+        if not self.config.get('minify'):
+            return None
+        return Minifier(
+            self.cachedir, is_cached=self.is_cached,
+            ident=self.fingerprints.digest('minify'),
+        )
+
+    @cached_property
+    def images(self):
+        options = self.config.get('images')
+        if not options:
+            return None
+        from .images import ImageIndex, load_pillow
+        if load_pillow() is None:
+            logger.warn('Pillow is not installed, images are not resized')
+            return None
+        if options is True:
+            options = {}
+        db_file = os.path.join(self.cachedir, 'image.index')
+        cachedir = os.path.join(self.cachedir, 'images')
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        return ImageIndex(
+            db_file, self.basedir, cachedir, options,
+            force=self.config.get('force'),
+        )
+
+    @cached_property
+    def memory_governor(self):
+        limit = self.config.get('memory_limit')
+        if not limit:
+            return None
+        batch = self.config.get('memory_batch', 100)
+        return MemoryGovernor(
+            limit, batch, release=self.release_caches,
+            strict=self.config.get('memory_strict', False),
+        )
+
+    def release_caches(self):
+        """Release caches that grow with the pages built, they are
+        loaded again when needed."""
+        jinja = self.__dict__.get('jinja')
+        if jinja is not None and jinja.cache is not None:
+            jinja.cache.clear()
+        self.__dict__.pop('buckets', None)
+        from .markdown import release_renderers
+        release_renderers()
+        if self.compressor:
+            # compress what is written so far
+            self.compressor.run()
+
+    @cached_property
+    def bundle_index(self):
+        db_file = os.path.join(self.statedir, 'bundle.index')
+        if not os.path.exists(db_file):
+            return {}
+        with open(db_file, 'rb') as f:
+            return json.load(f)
+
+    @cached_property
+    def related_index(self):
+        """The posts that each source lists as related posts, the
+        source is built again when one of them changes."""
+        db_file = os.path.join(self.statedir, 'related.index')
+        if not os.path.exists(db_file):
+            return {}
+        with open(db_file, 'rb') as f:
+            return json.load(f)
+
+    def record_related(self, req, keys):
+        """Record related posts listed by the request being built."""
+        # a template may list related posts more than once
+        listed = req.__dict__.setdefault('_related', [])
+        listed.extend(k for k in keys if k not in listed)
+        if self.related_index.get(req.filepath) != listed:
+            self.related_index[req.filepath] = list(listed)
+            self._dependencies_changed = True
+
+    @cached_property
+    def listing_index(self):
+        """Sources whose templates listed posts when they were built,
+        they are built again when posts change."""
+        db_file = os.path.join(self.statedir, 'listing.index')
+        if not os.path.exists(db_file):
+            return set()
+        with open(db_file, 'rb') as f:
+            return set(json.load(f))
+
+    def record_listing(self, req):
+        """Record that the request being built lists posts."""
+        if req.filepath not in self.listing_index:
+            self.listing_index.add(req.filepath)
+            self._dependencies_changed = True
+
+    def forget_listing(self, filepath):
+        """Forget a source before it is built again, it is recorded
+        again if it still lists posts."""
+        if filepath in self.listing_index:
+            self.listing_index.discard(filepath)
+            self._dependencies_changed = True
+
+    def save_dependencies(self):
+        """Save the related posts and the listings of sources."""
+        if not self._dependencies_changed:
+            return
+        # loaded before the files are truncated
+        data = {
+            'related.index': self.related_index,
+            'listing.index': sorted(self.listing_index),
+        }
+        for name in data:
+            with open(os.path.join(self.statedir, name), 'wb') as f:
+                json_dump(data[name], f)
+        self._dependencies_changed = False
+
     def filter_post_files(self, dirname=None, reverse=True, count=None):
         data = self.post_indexer
 
@@ -102,17 +327,109 @@ class Application(object):
             keys = keys[:count]
         return keys
 
+    @cached_property
+    def buckets(self):
+        """Posts grouped by ``tag``, ``year`` and ``month`` (``2015/02``),
+        the newest first. It is reset when the indexes are updated."""
+        data = self.post_indexer
+        rv = {'tag': {}, 'year': {}, 'month': {}}
+        for filepath in self.filter_post_files():
+            value = data[filepath]
+            date = datetime.datetime(1970, 1, 1)
+            date += datetime.timedelta(seconds=value['timestamp'])
+            for tag in value.get('tags') or []:
+                rv['tag'].setdefault(tag, []).append(filepath)
+            year = '%04d' % date.year
+            rv['year'].setdefault(year, []).append(filepath)
+            month = '%s/%02d' % (year, date.month)
+            rv['month'].setdefault(month, []).append(filepath)
+        return rv
+
+    def query_post_files(self, tag=None, year=None, month=None,
+                         dirname=None, reverse=True, limit=None, offset=0):
+        """Query posts from the buckets, it costs the size of the
+        smallest matched bucket instead of the whole site."""
+        candidates = []
+        if tag is not None:
+            candidates.append(self.buckets['tag'].get(tag, []))
+        if year is not None and month is not None:
+            key = '%04d/%02d' % (int(year), int(month))
+            candidates.append(self.buckets['month'].get(key, []))
+        elif year is not None:
+            key = '%04d' % int(year)
+            candidates.append(self.buckets['year'].get(key, []))
+        elif month is not None:
+            raise RuntimeError('Query by month requires a year.')
+
+        if not candidates:
+            keys = self.filter_post_files(dirname=dirname)
+        else:
+            candidates.sort(key=len)
+            others = [set(c) for c in candidates[1:]]
+            keys = [
+                k for k in candidates[0]
+                if all(k in other for other in others)
+            ]
+            if dirname:
+                data = self.post_indexer
+                keys = [
+                    k for k in keys
+                    if is_subdir(data[k]['dirname'], dirname)
+                ]
+
+        if not reverse:
+            keys = keys[::-1]
+        if limit:
+            return keys[offset:offset + limit]
+        return keys[offset:]
+
+    def source_key(self, filepath):
+        """The shard key of a source file, relative to the basedir so
+        it is the same on every machine."""
+        relpath = os.path.relpath(filepath, self.basedir)
+        return relpath.replace(os.path.sep, '/')
+
+    def in_shard(self, key):
+        """If a key is built by the current shard. The key is hashed as
+        it is given: an url, a logical name, or a :meth:`source_key`."""
+        shard = self.config.get('shard')
+        if not shard:
+            return True
+        return shard_of(key, shard[1]) == shard[0]
+
+    def live_sources(self):
+        """All the source files that are still in the indexes."""
+        rv = set(self.post_indexer.keys())
+        rv.update(self.page_indexer.keys())
+        rv.update(self.file_indexer.keys())
+        return rv
+
     def create_index(self):
+        with self.profiler.span('index'):
+            self._create_index()
+
+    def _create_index(self):
         logger.info('INDEXING DATA')
 
+        indexers = {
+            'post': self.post_indexer,
+            'page': self.page_indexer,
+            'file': self.file_indexer,
+        }
+        seen = set()
+        # timestamps and urls in the indexes depend on the config
+        force = self.is_stale('index') or self.is_stale('url')
+
         def index_request(req):
             logger.debug('indexing [%s]: %s' % (req.file_type, req.relpath))
+            if req.file_type in indexers:
+                seen.add((req.file_type, req.filepath))
             if req.file_type == 'post':
-                self.post_indexer.add(req)
+                self.post_indexer.add(req, force=force)
             elif req.file_type == 'page':
-                self.page_indexer.add(req)
+                self.page_indexer.add(req, force=force)
             elif req.file_type == 'file':
-                self.file_indexer.add(req)
+                self.file_indexer.add(req, force=force)
 
         if self.basedir in self.postsdir:
             includes = [os.path.relpath(self.postsdir, self.basedir)]
@@ -126,9 +443,69 @@ class Application(object):
             for filename in walk_tree(self.postsdir):
                 index_request(Request(filename))
 
+        # remove deleted files and posts turned into drafts
+        for file_type in indexers:
+            indexer = indexers[file_type]
+            for filepath in list(indexer.keys()):
+                if (file_type, filepath) not in seen:
+                    logger.debug('removing [%s]: %s' % (file_type, filepath))
+                    del indexer[filepath]
+
         self.post_indexer.save()
         self.page_indexer.save()
         self.file_indexer.save()
+        self.__dict__.pop('buckets', None)
+
+    def is_source(self, filepath):
+        """If a file would be indexed by :meth:`create_index`."""
+        if is_subdir(filepath, self.postsdir):
+            relpath = os.path.relpath(filepath, self.postsdir)
+        elif is_subdir(filepath, self.basedir):
+            relpath = os.path.relpath(filepath, self.basedir)
+        else:
+            return False
+        for name in relpath.split(os.path.sep):
+            if name.startswith('.') or name.startswith('_'):
+                return False
+        return True
+
+    def update_index(self, filepaths):
+        """Update the indexes for the given files only.
+
+        Return a list of ``(file_type, filepath, old, new)`` for every
+        entry that is added, changed or removed.
+        """
+        indexers = {
+            'post': self.post_indexer,
+            'page': self.page_indexer,
+            'file': self.file_indexer,
+        }
+        changes = []
+        for filepath in filepaths:
+            filepath = os.path.abspath(filepath)
+            req = None
+            if os.path.isfile(filepath) and self.is_source(filepath):
+                req = Request(filepath)
+
+            for file_type in indexers:
+                indexer = indexers[file_type]
+                old = indexer.get(filepath)
+                if req is not None and req.file_type == file_type:
+                    indexer.add(req, force=True)
+                elif old is not None:
+                    del indexer[filepath]
+                else:
+                    continue
+                changes.append(
+                    (file_type, filepath, old, indexer.get(filepath))
+                )
+
+        if changes:
+            self.post_indexer.save()
+            self.page_indexer.save()
+            self.file_indexer.save()
+            self.__dict__.pop('buckets', None)
+        return changes
 
 
 class Indexer(object):
@@ -150,8 +527,8 @@ class Indexer(object):
         with open(self.db_file, 'rb') as f:
             return json.load(f)
 
-    def add(self, req):
-        if self.mtime and self.mtime > req.mtime:
+    def add(self, req, force=False):
+        if not force and self.mtime and self.mtime > req.mtime:
             # ignore this file
             return
         value = {k: getattr(req, k) for k in self._keeps}
@@ -160,6 +537,9 @@ class Indexer(object):
     def keys(self):
         return self._data.keys()
 
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
     def flush(self):
         self._data = {}
         self.save()
@@ -195,8 +575,24 @@ def create_jinja(layouts='_layouts', includes='_includes'):
         loaders.append(includes)
 
     from jinja2 import Environment, FileSystemLoader
+
+    class Loader(FileSystemLoader):
+        """Count the templates loaded by each thread, a template is
+        only loaded when it is not in the cache."""
+        def __init__(self, searchpath):
+            FileSystemLoader.__init__(self, searchpath)
+            self._local = threading.local()
+
+        @property
+        def loads(self):
+            return getattr(self._local, 'loads', 0)
+
+        def load(self, environment, name, globals=None):
+            self._local.loads = self.loads + 1
+            return FileSystemLoader.load(self, environment, name, globals)
+
     jinja = Environment(
-        loader=FileSystemLoader(loaders),
+        loader=Loader(loaders),
         trim_blocks=True,
         lstrip_blocks=True,
         autoescape=False,
@@ -266,7 +662,14 @@ def create_jinja_globals(app):
     site = app.config.copy()
     site['now'] = app.timezone.localize(datetime.datetime.now())
 
+    def record_listing():
+        current = getattr(_top, 'request', None)
+        if current is not None:
+            app.record_listing(current)
+        return current
+
     def filter_posts(dirname=None, reverse=True, count=None):
+        record_listing()
         keys = app.filter_post_files(dirname, reverse=reverse, count=count)
 
         for k in keys:
@@ -290,20 +693,62 @@ def create_jinja_globals(app):
         keys = sorted(
             keys, key=lambda k: data[k]['timestamp'], reverse=True,
         )
+        current = record_listing()
+        if current is not None:
+            app.record_related(current, keys)
+        for k in keys:
+            yield Request(k)
+
+    def query_posts(tag=None, year=None, month=None, dirname=None,
+                    reverse=True, limit=None, offset=0):
+        record_listing()
+        keys = app.query_post_files(
+            tag=tag, year=year, month=month, dirname=dirname,
+            reverse=reverse, limit=limit, offset=offset,
+        )
         for k in keys:
             yield Request(k)
 
     site['posts'] = filter_posts
+    site['query'] = query_posts
     site['related'] = get_related_posts
     # site['request'] = _top.request
 
-    def static_url(filepath, url=None):
-        """Generate static url."""
-        if not url:
-            url = '/' + filepath
-
-        abspath = os.path.join(app.basedir, filepath)
-        t = int(os.path.getmtime(abspath))
-        return '%s?t=%i' % (url, t)
+    fingerprint = app.config.get('fingerprint', False)
 
-    return {'site': site, 'static_url': static_url}
+    def static_url(filepath, url=None):
+        """Generate static url.
+
+        With ``fingerprint`` enabled, it is the url of the fingerprinted
+        asset, e.g. ``/css/site.0123456789.css``.
+        """
+        key = (filepath, url)
+        static_urls = app.static_urls
+        if key in static_urls:
+            return static_urls[key]
+
+        entry = app.asset_manifest.get(filepath)
+        if entry is None:
+            raise RuntimeError('Static file not found: %s' % filepath)
+
+        if fingerprint and not url:
+            rv = '/' + entry['name']
+        elif fingerprint:
+            rv = '%s?v=%s' % (url, entry['digest'][:10])
+        else:
+            rv = '%s?t=%i' % (url or '/' + filepath, int(entry['mtime']))
+        static_urls[key] = rv
+        return rv
+
+    def bundle_url(name):
+        """Generate the url of a fingerprinted bundle."""
+        entry = app.bundle_index.get(name)
+        if entry is None:
+            raise RuntimeError('Bundle not found: %s' % name)
+        return '/' + entry['name']
+
+    return {
+        'site': site,
+        'static_url': static_url,
+        'bundle_url': bundle_url,
+    }
@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+    writeup.archives
+    ~~~~~~~~~~~~~~~~
+
+    Generate paginated tag and date archive pages from the buckets of
+    the post index::
+
+        archives:
+          tag:
+            template: tag.html
+            path: /tag/:name/
+          year:
+            template: archive.html
+            path: /:year/
+          month:
+            template: archive.html
+            path: /:year/:month/
+
+    A template gets ``paginator`` and ``archive``, which has ``kind``
+    and ``name`` of the bucket. Only buckets whose posts changed are
+    built again.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import hashlib
+import logging
+from .builder import Builder, Paginator
+from .request import Request
+from .utils import slugify
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+DEFAULT_PATHS = {
+    'tag': '/tag/:name/',
+    'year': '/:year/',
+    'month': '/:year/:month/',
+}
+
+
+class ArchiveBuilder(Builder):
+    """Write the archive pages of every tag, year and month."""
+
+    @property
+    def db_file(self):
+        return os.path.join(self.app.statedir, 'archive.index')
+
+    def load(self):
+        if not os.path.exists(self.db_file):
+            return {}
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def save(self, data):
+        data = json.dumps(data)
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(data))
+
+    def create_url(self, kind, name, path):
+        if kind == 'tag':
+            return path.replace(':name', slugify(name))
+        parts = name.split('/')
+        url = path.replace(':year', parts[0])
+        if len(parts) > 1:
+            url = url.replace(':month', parts[1])
+        return url
+
+    def signature(self, options, items):
+        """Digest of the options and the posts of a bucket, with their
+        mtimes, a changed post changes the signature of its buckets."""
+        data = [
+            options, self.app.config.get('paginate', 10),
+            self.app.jinja._mtime,
+        ]
+        for filepath in items:
+            try:
+                data.append([filepath, os.path.getmtime(filepath)])
+            except OSError:
+                data.append([filepath, None])
+        text = json.dumps(data, sort_keys=True)
+        return hashlib.md5(to_bytes(text)).hexdigest()
+
+    def build_bucket(self, kind, name, options, items):
+        path = options.get('path', DEFAULT_PATHS[kind])
+        template = options.get('template', 'archive.html')
+        tpl = self.get_template(template)
+
+        paginator = Paginator(items, 1, root=self.create_url(kind, name, path))
+        paginator.per_page = self.app.config.get('paginate', 10)
+        paginator.path = self.app.config.get('paginate_path', 'page/:num')
+
+        logger.debug('building [%s]: %s' % (kind, name))
+        context = {
+            'paginator': paginator,
+            'archive': {'kind': kind, 'name': name},
+        }
+        outputs = []
+        for i in range(1, paginator.pages + 1):
+            paginator.page = i
+            dest = paginator.create_dest(self.app.sitedir)
+            outputs.append(self.app.output_manifest.relpath(dest))
+            if not self.app.in_shard(paginator.url):
+                continue
+            # filters like markdown read the current request
+            req = Request(tpl.filename, url=paginator.url)
+            with self.create_context(req):
+                content = self.render(tpl, context)
+                self.write(content, dest)
+        return outputs
+
+    def remove(self, outputs):
+        for name in outputs:
+            dest = os.path.join(self.app.sitedir, name)
+            self.app.storage.remove(dest)
+            self.app.output_manifest.discard(dest)
+
+    def run(self):
+        archives = self.app.config.get('archives')
+        if not archives:
+            return
+
+        logger.info('BUILDING ARCHIVES')
+        old = self.load()
+        stale = self.app.is_stale('output')
+        data = {}
+        buckets = self.app.buckets
+        for kind in archives:
+            options = archives[kind] or {}
+            if kind not in buckets:
+                raise RuntimeError('Unsupported archive: %s' % kind)
+            for name in buckets[kind]:
+                key = '%s:%s' % (kind, name)
+                items = buckets[kind][name]
+                signature = self.signature(options, items)
+                entry = old.pop(key, None)
+                if entry and not stale and \
+                        entry['signature'] == signature and all(
+                        self.app.storage.exists(
+                            os.path.join(self.app.sitedir, p))
+                        for p in entry['outputs']):
+                    data[key] = entry
+                    continue
+                outputs = self.build_bucket(kind, name, options, items)
+                if entry:
+                    self.remove(set(entry['outputs']) - set(outputs))
+                data[key] = {'signature': signature, 'outputs': outputs}
+
+        # buckets that have no post any more
+        for key in old:
+            self.remove(old[key]['outputs'])
+
+        logger.info('WRITTING %i/%i' % (self.write_count, len(data)))
+        self.save(data)
@@ -0,0 +1,250 @@
+# coding: utf-8
+"""
+    writeup.assets
+    ~~~~~~~~~~~~~~
+
+    Publish static assets into the site directory.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import threading
+from .utils import cached_property
+from ._compat import to_bytes, to_unicode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('writeup')
+
+#: ioctl request number of FICLONE on Linux (btrfs, xfs)
+FICLONE = 0x40049409
+
+#: publishing strategies, each one falls back to the next one
+STRATEGIES = ('hardlink', 'reflink', 'copy')
+
+# errors meaning the strategy is not available on this filesystem
+_unsupported = set([
+    errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOSYS,
+    errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+    getattr(errno, 'ENOTTY', errno.EINVAL),
+])
+
+
+def file_digest(filepath, blocksize=65536):
+    """Calculate the md5 hex digest of a file's content."""
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        chunk = f.read(blocksize)
+        while chunk:
+            md5.update(chunk)
+            chunk = f.read(blocksize)
+    return md5.hexdigest()
+
+
+def hardlink(source, dest):
+    """Publish a file as a hard link of the source."""
+    os.link(source, dest)
+
+
+def reflink(source, dest):
+    """Publish a copy-on-write clone of the source.
+
+    It tries the FICLONE ioctl first, then the in-kernel
+    ``copy_file_range`` copy, an ``OSError`` is raised when
+    none of them is supported.
+    """
+    if fcntl is None and not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported')
+
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            if fcntl is None:
+                raise OSError(errno.EOPNOTSUPP, 'FICLONE is not supported')
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (IOError, OSError) as e:
+            if e.errno not in _unsupported:
+                raise
+            if not hasattr(os, 'copy_file_range'):
+                raise OSError(e.errno, 'reflink is not supported')
+            size = os.fstat(src.fileno()).st_size
+            offset = 0
+            while offset < size:
+                sent = os.copy_file_range(
+                    src.fileno(), dst.fileno(), size - offset,
+                )
+                if not sent:
+                    break
+                offset += sent
+    shutil.copymode(source, dest)
+
+
+def copy(source, dest):
+    """Publish a plain copy of the source."""
+    shutil.copy(source, dest)
+
+
+_publishers = {
+    'hardlink': hardlink,
+    'reflink': reflink,
+    'copy': copy,
+}
+
+
+class AssetPublisher(object):
+    """Publish assets with the given strategy.
+
+    Available strategies are ``hardlink``, ``reflink`` and ``copy``.
+    When a strategy is not supported by the filesystem, the publisher
+    falls back to the next one and never tries it again.
+
+    :param strategy: the preferred strategy
+    :param dedupe: link files with identical content to one copy
+    """
+    def __init__(self, strategy='copy', dedupe=True):
+        if strategy not in STRATEGIES:
+            raise RuntimeError('Unknown asset strategy: %s' % strategy)
+        self.strategies = STRATEGIES[STRATEGIES.index(strategy):]
+        self.dedupe = dedupe
+        self._disabled = set()
+        self._published = {}
+        self._lock = threading.Lock()
+
+    def _link_duplicate(self, digest, dest):
+        with self._lock:
+            published = self._published.get(digest)
+            if published is None:
+                self._published[digest] = dest
+                return False
+        try:
+            os.link(published, dest)
+            logger.debug('dedupe [assets]: %s -> %s' % (dest, published))
+            return True
+        except OSError:
+            return False
+
+    def publish(self, source, dest):
+        """Publish the source file to the destination."""
+        folder = os.path.split(dest)[0]
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as e:
+                # another worker created it
+                if e.errno != errno.EEXIST:
+                    raise
+
+        # never write through an existing link of the source
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        strategies = [s for s in self.strategies if s not in self._disabled]
+        if self.dedupe and strategies[0] != 'hardlink':
+            digest = file_digest(source)
+            if self._link_duplicate(digest, dest):
+                return 'dedupe'
+
+        for name in strategies:
+            if name == 'copy':
+                copy(source, dest)
+                return name
+            try:
+                _publishers[name](source, dest)
+                return name
+            except (IOError, OSError) as e:
+                if e.errno not in _unsupported:
+                    raise
+                logger.debug('%s is not supported, fallback' % name)
+                self._disabled.add(name)
+                if os.path.lexists(dest):
+                    os.unlink(dest)
+
+
+def fingerprint_name(name, digest, length=10):
+    """Insert the digest into a file name::
+
+        css/site.css -> css/site.0123456789.css
+    """
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, digest[:length], ext)
+
+
+class AssetManifest(object):
+    """Content fingerprints of assets, persisted between builds.
+
+    Every entry keeps the mtime and size of the asset, the digest is
+    only calculated again when one of them changed.
+
+    :param db_file: the file to persist the manifest
+    :param basedir: the directory that asset names are relative to
+    """
+    def __init__(self, db_file, basedir):
+        self.db_file = db_file
+        self.basedir = basedir
+        self._lock = threading.Lock()
+        self._changed = False
+
+    @cached_property
+    def _data(self):
+        if not os.path.exists(self.db_file):
+            return {}
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def get(self, name):
+        """Get the manifest entry of an asset, ``None`` if missing."""
+        entry = self._data.get(name)
+        if entry is not None and entry.get('checked'):
+            return entry
+
+        try:
+            stat = os.stat(os.path.join(self.basedir, name))
+        except OSError:
+            return None
+
+        if (entry is None or entry['mtime'] != stat.st_mtime or
+                entry['size'] != stat.st_size):
+            digest = file_digest(os.path.join(self.basedir, name))
+            entry = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'digest': digest,
+                'name': fingerprint_name(name, digest),
+            }
+            with self._lock:
+                self._data[name] = entry
+                self._changed = True
+
+        entry['checked'] = True
+        return entry
+
+    def reset(self, name):
+        """Stat an asset again on the next :meth:`get`, it changed."""
+        entry = self._data.get(name)
+        if entry is not None:
+            entry.pop('checked', None)
+
+    def update(self, names):
+        """Calculate entries of the given asset names at once."""
+        for name in names:
+            self.get(name)
+
+    def save(self):
+        if not self._changed:
+            return
+        data = {}
+        for name in self._data:
+            entry = dict(self._data[name])
+            entry.pop('checked', None)
+            data[name] = entry
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(json.dumps(data)))
+        self._changed = False
@@ -0,0 +1,101 @@
+# coding: utf-8
+"""
+    writeup.batch
+    ~~~~~~~~~~~~~
+
+    Build many sites in one process::
+
+        $ writeup build-many blog-a/_config.yml blog-b/_config.yml
+
+    Every site is built in the directory of its config, with its own
+    application, caches and context. The interpreter and the imports
+    are shared, :func:`warm_up` also loads the lexers of common
+    languages, the HTML formatter and the default markdown renderer
+    once for every site. With workers, sites are built in a pool of
+    processes forked after the warm up.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import time
+import logging
+from .utils import _top
+
+logger = logging.getLogger('writeup')
+
+
+#: lexers loaded by :func:`warm_up`, pygments keeps the modules
+WARM_LEXERS = (
+    'python', 'javascript', 'html', 'css', 'bash', 'json', 'yaml', 'c',
+    'go', 'ruby', 'java', 'sql',
+)
+
+
+def warm_up():
+    """Load what every site needs, before forking workers."""
+    import jinja2  # noqa
+    import yaml  # noqa
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import HtmlFormatter
+    from pygments.util import ClassNotFound
+    from . import app, builder, markdown, parser  # noqa
+    parser._get_rules()
+
+    for name in WARM_LEXERS:
+        try:
+            get_lexer_by_name(name)
+        except ClassNotFound:
+            continue
+    # imports the default style
+    HtmlFormatter()
+    # the renderer of the markdown filter with default arguments
+    markdown._get_md(True, False, False, False)
+
+
+def build_site(config):
+    """Build a site in the directory of its config.
+
+    Return ``(config, milliseconds, error)``, an error of a site does
+    not stop the other sites.
+    """
+    from . import Writeup
+
+    directory, filename = os.path.split(os.path.abspath(config))
+    cwd = os.getcwd()
+    begin = time.time()
+    error = None
+    os.chdir(directory)
+    # nothing of the previous site is left in the context
+    _top.request = None
+    try:
+        wp = Writeup(config=filename)
+        wp.run()
+    except Exception as e:
+        logger.error('BUILDING ERROR %s: %r' % (config, e))
+        error = repr(e)
+    finally:
+        _top.request = None
+        os.chdir(cwd)
+    return config, (time.time() - begin) * 1000, error
+
+
+def build_many(configs, workers=1):
+    """Build sites of the configs, in a pool of processes if workers is
+    more than one. Return a list of ``(config, milliseconds, error)``
+    in the order of the configs."""
+    for config in configs:
+        if not os.path.isfile(config):
+            raise RuntimeError('Config does not exist: %s' % config)
+
+    warm_up()
+    if workers < 2 or len(configs) < 2:
+        return [build_site(config) for config in configs]
+
+    from multiprocessing import Pool
+    pool = Pool(min(workers, len(configs)))
+    try:
+        return pool.map(build_site, configs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -11,11 +11,16 @@
 
 import os
 import re
-import shutil
+import json
+import hashlib
 import logging
+import posixpath
 from contextlib import contextmanager
-from .utils import _top
+from multiprocessing.pool import ThreadPool
+from .utils import _top, cached_property
 from .request import Request
+from .assets import AssetPublisher, fingerprint_name
+from .minify import minify_css, minify_js, rebase_css_urls
 from ._compat import to_unicode, to_bytes
 
 
@@ -23,6 +28,9 @@ logger = logging.getLogger('writeup')
 
 
 class Builder(object):
+    #: skip outputs that are newer than their sources
+    incremental = True
+
     def __init__(self, app):
         self.app = app
         self.write_count = 0
@@ -34,17 +42,66 @@ class Builder(object):
         yield
         del _top.request
 
-    def write(self, content, dest):
-        """Write given content to the destination."""
+    def get_template(self, name):
+        """Load a template, hits of the template cache are counted."""
+        jinja = self.app.jinja
+        loads = jinja.loader.loads
+        tpl = jinja.get_template(name)
+        if jinja.cache is not None:
+            # the loader is only called on a miss
+            self.app.profiler.count('template', jinja.loader.loads == loads)
+        return tpl
+
+    def render(self, tpl, context=None, source=None):
+        """Render a template, the time is recorded by the profiler."""
+        name = tpl.name
+        if name is None and source:
+            name = os.path.relpath(source, self.app.basedir)
+        with self.app.profiler.span(name, 'template', source=source):
+            return tpl.render(context or {})
+
+    def postprocess(self, content, dest):
+        """Process the rendered content before writing."""
+        if self.app.minifier and dest.endswith('.html'):
+            content = self.app.minifier.minify(content)
+        return content
+
+    def write(self, content, dest, source=None):
+        """Write given content to the destination.
+
+        :param content: the rendered content
+        :param dest: the output file path
+        :param source: the source file that produced this output
+        """
+        self.write_count += 1
+        content = self.postprocess(content, dest)
+
+        with self.app.profiler.span('write', 'write'):
+            self.app.storage.write(dest, to_bytes(content))
+
+        self.app.output_manifest.record(dest, source)
+        if self.app.compressor:
+            self.app.compressor.add(dest)
+
+    def write_stream(self, chunks, dest, source=None):
+        """Write an iterable of chunks to the destination, the content
+        is never held in memory."""
         self.write_count += 1
 
-        # make sure the directory exists
-        folder = os.path.split(dest)[0]
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
+        with self.app.profiler.span('write', 'write'):
+            self.app.storage.write_stream(dest, chunks)
+
+        self.app.output_manifest.record(dest, source)
+        if self.app.compressor:
+            self.app.compressor.add(dest)
 
-        with open(dest, 'wb') as f:
-            f.write(to_bytes(content))
+    def batches(self, items):
+        """Split items into batches by the memory governor, there is
+        only one batch without a memory limit."""
+        governor = self.app.memory_governor
+        if governor is None:
+            return [list(items)]
+        return governor.batches(items)
 
     def log_build(self, func, filepath):
         try:
@@ -63,12 +120,22 @@ class PostBuilder(Builder):
 
     def get_destination(self, req):
         dest = self.get_html_destination(req.url)
+        if not self.incremental or self.app.is_stale('output'):
+            return dest
         mtime = max(self.app.jinja._mtime, req.mtime)
-        if os.path.isfile(dest) and os.path.getmtime(dest) > mtime:
+        if self.app.images is not None:
+            # attributes of the images are rendered into the page
+            mtime = max(mtime, self.app.images.latest(req.content))
+        output_time = self.app.storage.mtime(dest)
+        if output_time is not None and output_time > mtime:
             return None
         return dest
 
     def build_redirect(self, redirect_from, req):
+        from .redirects import redirect_formats
+        if 'html' not in redirect_formats(self.app.config):
+            # it is in the redirect maps
+            return
         logger.debug('building [redirect]: %s -> %s' % (
             redirect_from, req.url))
         dest = self.get_html_destination(redirect_from)
@@ -79,41 +146,66 @@ class PostBuilder(Builder):
             '<script>location.href="%(url)s"</script>'
             '</head></html>'
         ) % {'title': req.title, 'url': req.full_url}
-        self.write(html, dest)
+        self.write(html, dest, req.filepath)
 
-    def build(self, filepath):
+    def build(self, filepath, force=False):
+        """Build a post, ``force`` builds it even if the output is
+        newer than the source, e.g. a related post changed."""
         self.build_count += 1
         req = Request(filepath)
         logger.debug('building [%s]: %s' % (req.file_type, req.relpath))
-        dest = self.get_destination(req)
+        if force:
+            dest = self.get_html_destination(req.url)
+        else:
+            dest = self.get_destination(req)
         if not dest:
             return
         template = req.template or 'post.html'
-        tpl = self.app.jinja.get_template(template)
+        tpl = self.get_template(template)
 
         for redirect_from in req._data.get('redirect_from', []):
             self.build_redirect(redirect_from, req)
 
         with self.create_context(req):
-            content = tpl.render({'page': req})
-            self.write(content, dest)
+            content = self.render(tpl, {'page': req}, filepath)
+            self.write(content, dest, filepath)
+        req.release()
+
+    def build_all(self, indexer):
+        filepaths = [
+            f for f in indexer if self.app.in_shard(self.app.source_key(f))
+        ]
+        for batch in self.batches(filepaths):
+            for filepath in batch:
+                self.log_build(self.build, filepath)
 
     def run(self):
         logger.info('BUILDING POSTS')
-        for filepath in self.app.post_indexer:
-            self.log_build(self.build, filepath)
+        self.build_all(self.app.post_indexer)
         logger.info('WRITTING %i/%i' % (self.write_count, self.build_count))
 
 
 class PageBuilder(PostBuilder):
     def run(self):
         logger.info('BUILDING PAGES')
-        for filepath in self.app.page_indexer:
-            self.log_build(self.build, filepath)
+        self.build_all(self.app.page_indexer)
         logger.info('WRITTING %i/%i' % (self.write_count, self.build_count))
 
 
+#: templates using these globals list posts
+listing_pattern = re.compile(
+    r'''\bsite(?:\.|\[['"])(?:posts|query|related)\b'''
+)
+
+
 class FileBuilder(Builder):
+    def lists_posts(self, filepath, source):
+        """If a template lists posts, by its source or by the queries
+        recorded when it was built, e.g. in an included template."""
+        if listing_pattern.search(source):
+            return True
+        return filepath in self.app.listing_index
+
     def should_build_paginator(self, filepath):
         if self.app.postsdir not in filepath:
             return False
@@ -130,20 +222,24 @@ class FileBuilder(Builder):
 
         with open(filepath, 'rb') as f:
             source = to_unicode(f.read())
-            if u'site.posts' not in source and os.path.isfile(dest):
-                if os.path.getmtime(dest) > self.app.jinja._mtime:
+            source_time = os.fstat(f.fileno()).st_mtime
+            output_time = self.app.storage.mtime(dest)
+            if not self.lists_posts(filepath, source) and \
+                    self.incremental and output_time is not None and \
+                    not self.app.is_stale('output'):
+                if output_time > max(self.app.jinja._mtime, source_time):
                     # ignore building html file when it don't iter posts
                     return
             tpl = self.app.jinja.from_string(source)
 
+        # recorded again by the queries of the template
+        self.app.forget_listing(filepath)
         with self.create_context(Request(filepath)):
-            content = tpl.render()
-            self.write(content, dest)
-
-    def build_paginator(self, filepath):
-        with open(filepath, 'rb') as f:
-            tpl = self.app.jinja.from_string(to_unicode(f.read()))
+            content = self.render(tpl, source=filepath)
+            self.write(content, dest, filepath)
 
+    def create_paginator(self, filepath):
+        """Create the paginator of an ``index.html`` in posts dir."""
         name = os.path.relpath(filepath, self.app.postsdir)
 
         dirname = os.path.dirname(name) or None
@@ -155,52 +251,108 @@ class FileBuilder(Builder):
         else:
             root = '/' + root
 
-        if dirname:
-            items = self.app.filter_post_files(dirname=dirname)
-        else:
-            items = self.app.post_indexer.keys()
+        # a stable order, every shard must paginate the same list
+        items = self.app.filter_post_files(dirname=dirname)
 
         paginator = Paginator(items, 1, root=root)
-        logger.info(
-            'BUILDING %s [%i|%i]' % (name, paginator.pages, paginator.total)
-        )
         paginator.per_page = self.app.config.get('paginate', 10)
         paginator.path = self.app.config.get('paginate_path', 'page/:num')
+        return paginator
 
-        with self.create_context(Request(filepath, url=paginator.url)):
-            content = tpl.render({'paginator': paginator})
-            self.write(content, paginator.create_dest(self.app.sitedir))
+    def build_paginator(self, filepath, pages=None):
+        """Build the pages of a paginator.
 
-        if paginator.pages < 2:
-            return
+        :param filepath: the ``index.html`` in posts dir
+        :param pages: build only these page numbers
+        """
+        with open(filepath, 'rb') as f:
+            tpl = self.app.jinja.from_string(to_unicode(f.read()))
 
-        for i in range(2, paginator.pages + 1):
-            paginator.page = i
-            with self.create_context(Request(filepath, url=paginator.url)):
-                content = tpl.render({'paginator': paginator})
-                self.write(content, paginator.create_dest(self.app.sitedir))
+        name = os.path.relpath(filepath, self.app.postsdir)
+        paginator = self.create_paginator(filepath)
+        logger.info(
+            'BUILDING %s [%i|%i]' % (name, paginator.pages, paginator.total)
+        )
+
+        context = {'paginator': paginator}
+        numbers = [
+            i for i in range(1, paginator.pages + 1)
+            if pages is None or i in pages
+        ]
+        for batch in self.batches(numbers):
+            for i in batch:
+                paginator.page = i
+                if not self.app.in_shard(paginator.url):
+                    continue
+                req = Request(filepath, url=paginator.url)
+                with self.create_context(req):
+                    content = self.render(tpl, context, filepath)
+                    dest = paginator.create_dest(self.app.sitedir)
+                    self.write(content, dest, filepath)
+
+    @cached_property
+    def publisher(self):
+        strategy = self.app.config.get('asset_strategy', 'copy')
+        dedupe = self.app.config.get('asset_dedupe', True)
+        return AssetPublisher(strategy, dedupe=dedupe)
+
+    def is_template(self, filepath):
+        if self.should_build_paginator(filepath):
+            return True
+        return filepath.endswith('.html') or filepath.endswith('.xml')
 
     def build_asset(self, filepath):
         if self.app.postsdir in filepath:
             # ignore assets in posts dir
             return
 
-        if not os.path.exists(filepath):
+        try:
+            source_time = os.stat(filepath).st_mtime
+        except OSError:
             del self.app.file_indexer[filepath]
             return
 
         name = os.path.relpath(filepath, self.app.basedir)
         dest = os.path.join(self.app.sitedir, name)
 
-        source_time = os.path.getmtime(filepath)
-        if os.path.exists(dest) and source_time <= os.path.getmtime(dest):
+        output_time = self.app.storage.mtime(dest)
+        fresh = output_time is not None and source_time <= output_time
+
+        self.app.output_manifest.record(dest, filepath)
+        if not fresh:
+            logger.debug('building [assets]: %s' % name)
+            with self.app.profiler.span(name, 'asset'):
+                self.app.storage.publish(self.publisher, filepath, dest)
+            if self.app.compressor:
+                self.app.compressor.add(dest)
+
+        if self.app.config.get('fingerprint'):
+            self.build_fingerprint(filepath, dest)
+
+    def build_fingerprint(self, filepath, dest):
+        name = os.path.relpath(filepath, self.app.basedir)
+        entry = self.app.asset_manifest.get(name)
+        target = os.path.join(self.app.sitedir, entry['name'])
+        self.app.output_manifest.record(target, filepath)
+        if self.app.storage.exists(target):
+            # the name contains the digest, content is the same
+            return
+        self.app.storage.link(dest, target)
+
+    def build_assets(self, filepaths):
+        """Publish assets, large trees are published in a thread pool."""
+        workers = self.app.config.get('asset_workers', 4)
+        if workers < 2 or len(filepaths) <= workers:
+            for filepath in filepaths:
+                self.build_asset(filepath)
             return
 
-        logger.debug('building [assets]: %s' % name)
-        folder = os.path.split(dest)[0]
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
-        shutil.copy(filepath, dest)
+        pool = ThreadPool(workers)
+        try:
+            pool.map(self.build_asset, filepaths)
+        finally:
+            pool.close()
+            pool.join()
 
     def build(self, filepath):
         if self.should_build_paginator(filepath):
@@ -212,8 +364,98 @@ class FileBuilder(Builder):
 
     def run(self):
         logger.info('BUILDING FILES')
-        for filepath in self.app.file_indexer:
-            self.build(filepath)
+        assets = []
+        for filepath in list(self.app.file_indexer):
+            if self.should_build_paginator(filepath):
+                # paginator pages are sharded one by one
+                self.build(filepath)
+            elif not self.app.in_shard(self.app.source_key(filepath)):
+                continue
+            elif self.is_template(filepath):
+                self.build(filepath)
+            else:
+                assets.append(filepath)
+        self.build_assets(assets)
+        self.app.asset_manifest.save()
+
+
+class BundleBuilder(Builder):
+    """Concatenate and minify CSS and JavaScript bundles.
+
+    Bundles are defined in ``_config.yml``::
+
+        bundles:
+          site.css:
+            - css/normalize.css
+            - css/main.css
+    """
+
+    def read_member(self, name):
+        with open(os.path.join(self.app.basedir, name), 'rb') as f:
+            return to_unicode(f.read())
+
+    def member_mtime(self, bundle, name):
+        try:
+            return os.path.getmtime(os.path.join(self.app.basedir, name))
+        except OSError:
+            raise RuntimeError(
+                'Member of bundle %s does not exist: %s' % (bundle, name)
+            )
+
+    def build(self, name):
+        members = self.app.config['bundles'][name]
+        mtimes = [[m, self.member_mtime(name, m)] for m in members]
+
+        entry = self.app.bundle_index.get(name)
+        if self.incremental and entry and entry['members'] == mtimes and \
+                not self.app.is_stale('output'):
+            output = os.path.join(self.app.sitedir, entry['name'])
+            if self.app.storage.exists(output):
+                return
+
+        logger.debug('building [bundle]: %s' % name)
+        chunks = [self.read_member(m) for m in members]
+        dirname = self.app.config.get('bundle_dir', 'bundles')
+        ext = os.path.splitext(name)[1]
+        if ext == '.css':
+            # relative urls point to the same files from the bundle
+            target = posixpath.dirname(posixpath.join(dirname, name))
+            chunks = [
+                rebase_css_urls(chunk, posixpath.dirname(m), target)
+                for m, chunk in zip(members, chunks)
+            ]
+            content = minify_css(u'\n'.join(chunks))
+        elif ext == '.js':
+            content = minify_js(u';\n'.join(chunks))
+        else:
+            raise RuntimeError('Unsupported bundle: %s' % name)
+
+        content = to_bytes(content)
+        digest = hashlib.md5(content).hexdigest()
+        output = fingerprint_name(posixpath.join(dirname, name), digest)
+
+        if entry and entry['name'] != output:
+            # remove the outdated bundle
+            old = os.path.join(self.app.sitedir, entry['name'])
+            self.app.storage.remove(old)
+
+        self.write(content, os.path.join(self.app.sitedir, output))
+        self.app.bundle_index[name] = {'members': mtimes, 'name': output}
+
+    def run(self):
+        bundles = self.app.config.get('bundles')
+        if not bundles:
+            return
+
+        logger.info('BUILDING BUNDLES')
+        for name in bundles:
+            if self.app.in_shard(name):
+                self.build(name)
+
+        data = json.dumps(self.app.bundle_index)
+        db_file = os.path.join(self.app.statedir, 'bundle.index')
+        with open(db_file, 'wb') as f:
+            f.write(to_bytes(data))
 
 
 class Paginator(object):
@@ -251,7 +493,7 @@ class Paginator(object):
 
     def create_dest(self, sitedir):
         dest = self.url.lstrip('/')
-        if dest.endswith('/'):
+        if not dest or dest.endswith('/'):
             dest += 'index.html'
         elif not dest.endswith('.html'):
             dest += '.html'
@@ -0,0 +1,154 @@
+# coding: utf-8
+"""
+    writeup.compress
+    ~~~~~~~~~~~~~~~~
+
+    Precompress site outputs into ``.gz`` and ``.br`` siblings, which
+    can be served directly by nginx ``gzip_static``.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import io
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+from .utils import cached_property
+from ._compat import to_bytes, to_unicode
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('writeup')
+
+#: file name suffix of each encoding
+SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    # mtime is fixed, the same input gives the same output
+    f = gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+def brotli_compress(data):
+    return brotli.compress(data)
+
+
+_compressors = {
+    'gzip': gzip_compress,
+    'br': brotli_compress,
+}
+
+
+class Compressor(object):
+    """Compress changed outputs in a thread pool.
+
+    The digest of every compressed output is persisted, an output is
+    compressed again only when its content changed.
+
+    :param db_file: the file to persist digests of outputs
+    :param sitedir: the site directory, outputs are keyed relative to it
+    :param encodings: a list of ``gzip`` and ``br``
+    :param workers: size of the thread pool
+    :param force: compress every output again
+    """
+    extensions = (
+        '.html', '.xml', '.css', '.js', '.json', '.svg', '.txt',
+    )
+
+    def __init__(self, db_file, sitedir, encodings=('gzip',), workers=4,
+                 force=False):
+        encodings = list(encodings)
+        if 'br' in encodings and brotli is None:
+            logger.warn('brotli is not installed, ignore .br siblings')
+            encodings.remove('br')
+
+        self.db_file = db_file
+        self.sitedir = sitedir
+        self.encodings = encodings
+        self.workers = workers
+        self.force = force
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @cached_property
+    def _data(self):
+        if self.force or not os.path.exists(self.db_file):
+            return {}
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def should_compress(self, dest):
+        return os.path.splitext(dest)[1] in self.extensions
+
+    def add(self, dest):
+        """Schedule an output to be compressed. Only the path is kept,
+        the content is read back when it is compressed.
+
+        :param dest: path of the output
+        """
+        if not self.encodings or not self.should_compress(dest):
+            return
+        with self._lock:
+            self._pending.add(dest)
+
+    def compress(self, dest):
+        try:
+            with open(dest, 'rb') as f:
+                content = f.read()
+        except IOError:
+            # removed after it was written, e.g. pruned
+            return False
+
+        key = os.path.relpath(dest, self.sitedir)
+        digest = hashlib.md5(content).hexdigest()
+        siblings = [dest + SUFFIXES[name] for name in self.encodings]
+        if self._data.get(key) == digest and all(
+                os.path.isfile(p) for p in siblings):
+            return False
+
+        for name in self.encodings:
+            sibling = dest + SUFFIXES[name]
+            if os.path.lexists(sibling):
+                os.unlink(sibling)
+            with open(sibling, 'wb') as f:
+                f.write(_compressors[name](content))
+        self._data[key] = digest
+        return True
+
+    def run(self):
+        """Compress all the scheduled outputs."""
+        with self._lock:
+            pending = self._pending
+            self._pending = set()
+
+        if not pending:
+            return
+
+        items = sorted(pending)
+        if self.workers > 1 and len(items) > 1:
+            pool = ThreadPool(self.workers)
+            try:
+                rv = pool.map(self.compress, items)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            rv = [self.compress(item) for item in items]
+
+        logger.info('COMPRESSING %i/%i' % (rv.count(True), len(rv)))
+        data = json.dumps(self._data)
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(data))
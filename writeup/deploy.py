@@ -0,0 +1,149 @@
+# coding: utf-8
+"""
+    writeup.deploy
+    ~~~~~~~~~~~~~~
+
+    Deploy the site by syncing only the outputs that changed::
+
+        $ writeup deploy /var/www/site
+
+    The digests of all outputs are compared with the manifest of the
+    last deployment in the target. Added and changed files are copied,
+    removed files are deleted, then the new manifest is written.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import shutil
+import logging
+from .assets import file_digest
+from .shard import walk_outputs
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: the manifest file in the root of a deployment
+MANIFEST_NAME = '.writeup-deploy.json'
+
+
+class DigestCache(object):
+    """Digests of outputs keyed by their mtime and size, only files
+    that changed since the last deployment are read again.
+
+    :param db_file: the file to persist the digests
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._data = load_json(db_file)
+
+    def digest(self, name, filepath):
+        stat = os.stat(filepath)
+        entry = self._data.get(name)
+        if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+        digest = file_digest(filepath)
+        self._data[name] = [stat.st_mtime, stat.st_size, digest]
+        return digest
+
+    def save(self, names):
+        data = dict((k, self._data[k]) for k in names if k in self._data)
+        write_atomic(self.db_file, json.dumps(data))
+
+
+def load_json(filepath):
+    if not os.path.isfile(filepath):
+        return {}
+    with open(filepath, 'rb') as f:
+        return json.loads(to_unicode(f.read()))
+
+
+def write_atomic(filepath, text):
+    """Write a file by renaming a temporary file over it."""
+    tmp = '%s.%i.tmp' % (filepath, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(to_bytes(text))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, filepath)
+
+
+def copy_atomic(source, dest):
+    """Copy a file, a reader of the target never sees half of it."""
+    folder = os.path.dirname(dest)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmp = '%s.%i.tmp' % (dest, os.getpid())
+    shutil.copy2(source, tmp)
+    os.rename(tmp, dest)
+
+
+def remove(target, name):
+    filepath = os.path.join(target, name)
+    try:
+        os.unlink(filepath)
+    except OSError:
+        # removed by hand, or an interrupted deployment
+        return
+    # remove empty parents
+    dirpath = os.path.dirname(filepath)
+    while dirpath != target and dirpath.startswith(target + os.path.sep):
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            return
+        dirpath = os.path.dirname(dirpath)
+
+
+def diff(outputs, deployed):
+    """Compare the digests of outputs with the deployed ones, return
+    ``(changed, removed)`` names."""
+    changed = [k for k in outputs if deployed.get(k) != outputs[k]]
+    removed = [k for k in deployed if k not in outputs]
+    return sorted(changed), sorted(removed)
+
+
+def deploy(sitedir, target, cachedir, force=False):
+    """Sync the site directory to the target directory.
+
+    :param sitedir: the built site directory
+    :param target: the deployment directory
+    :param cachedir: the directory to keep digests of outputs
+    :param force: ignore the manifest of the last deployment
+    """
+    sitedir = os.path.realpath(sitedir)
+    target = os.path.abspath(target)
+    if not os.path.isdir(sitedir):
+        raise RuntimeError('Site directory does not exist: %s' % sitedir)
+    if target == sitedir or target.startswith(sitedir + os.path.sep):
+        raise RuntimeError('Target is inside the site directory.')
+
+    cache = DigestCache(os.path.join(cachedir, 'deploy.index'))
+    outputs = {}
+    for name, filepath in walk_outputs(sitedir):
+        outputs[name] = cache.digest(name, filepath)
+
+    manifest_file = os.path.join(target, MANIFEST_NAME)
+    deployed = {}
+    if not force:
+        deployed = load_json(manifest_file).get('outputs', {})
+
+    changed, removed = diff(outputs, deployed)
+    for name in changed:
+        logger.debug('deploying [copy]: %s' % name)
+        copy_atomic(os.path.join(sitedir, name), os.path.join(target, name))
+    for name in removed:
+        logger.debug('deploying [delete]: %s' % name)
+        remove(target, name)
+
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    # written at last, an interrupted deployment is done again
+    write_atomic(manifest_file, json.dumps({'outputs': outputs}))
+    cache.save(outputs)
+
+    logger.info('DEPLOYING %i changed, %i removed, %i unchanged' % (
+        len(changed), len(removed), len(outputs) - len(changed)
+    ))
+    return changed, removed
@@ -0,0 +1,207 @@
+# coding: utf-8
+"""
+    writeup.feeds
+    ~~~~~~~~~~~~~
+
+    Generate sitemaps and Atom feeds from the indexes. The XML is
+    streamed to disk instead of rendered by a template::
+
+        sitemap:
+          path: sitemap.xml
+          limit: 50000
+        feed:
+          path: feed.xml
+          count: 20
+
+    ``sitemap: true`` and ``feed: true`` use the defaults.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import logging
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+from .builder import Builder
+from .request import Request
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: the protocol limit of urls in one sitemap file
+SITEMAP_LIMIT = 50000
+
+
+def get_options(value, **defaults):
+    if isinstance(value, dict):
+        defaults.update(value)
+    return defaults
+
+
+def w3c_date(timestamp):
+    date = datetime.datetime(1970, 1, 1)
+    date += datetime.timedelta(seconds=timestamp)
+    return date.strftime('%Y-%m-%d')
+
+
+class SitemapBuilder(Builder):
+    """Stream sitemaps of posts and pages.
+
+    When there are more urls than the limit, they are split into
+    ``sitemap-1.xml``, ``sitemap-2.xml`` and the sitemap file becomes
+    a sitemap index.
+    """
+
+    def iter_urls(self):
+        baseurl = self.app.config.get('baseurl', '').rstrip('/')
+        for indexer in (self.app.post_indexer, self.app.page_indexer):
+            for filepath in sorted(indexer.keys()):
+                data = indexer[filepath]
+                url = data.get('url') or Request(filepath).url
+                yield baseurl + url, w3c_date(data['timestamp'])
+
+    def iter_urlset(self, urls):
+        yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+        yield u'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for url, lastmod in urls:
+            yield u'<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (
+                escape(url), lastmod
+            )
+        yield u'</urlset>\n'
+
+    def iter_index(self, locs):
+        yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+        yield (
+            u'<sitemapindex '
+            u'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        )
+        for loc in locs:
+            yield u'<sitemap><loc>%s</loc></sitemap>\n' % escape(loc)
+        yield u'</sitemapindex>\n'
+
+    def part_name(self, path, index):
+        root, ext = os.path.splitext(path)
+        return '%s-%i%s' % (root, index, ext)
+
+    def remove_parts(self, path, index):
+        """Remove the parts from the index on, they are left by a build
+        with more urls."""
+        while True:
+            part = os.path.join(self.app.sitedir, self.part_name(path, index))
+            if not self.app.storage.exists(part):
+                return
+            self.app.storage.remove(part)
+            self.app.output_manifest.discard(part)
+            index += 1
+
+    def run(self):
+        value = self.app.config.get('sitemap')
+        if not value:
+            return
+        options = get_options(value, path='sitemap.xml', limit=SITEMAP_LIMIT)
+        if not self.app.in_shard(options['path']):
+            return
+
+        logger.info('BUILDING SITEMAP')
+        urls = list(self.iter_urls())
+        path = options['path']
+        limit = options['limit']
+        dest = os.path.join(self.app.sitedir, path)
+
+        if len(urls) <= limit:
+            self.write_stream(self.iter_urlset(urls), dest)
+            self.remove_parts(path, 1)
+            return
+
+        baseurl = self.app.config.get('baseurl', '').rstrip('/')
+        locs = []
+        for i in range(0, len(urls), limit):
+            name = self.part_name(path, i // limit + 1)
+            part = os.path.join(self.app.sitedir, name)
+            self.write_stream(self.iter_urlset(urls[i:i + limit]), part)
+            locs.append('%s/%s' % (baseurl, name))
+        self.write_stream(self.iter_index(locs), dest)
+        self.remove_parts(path, len(locs) + 1)
+
+
+class FeedBuilder(Builder):
+    """Stream an Atom feed of the newest posts.
+
+    Every entry is cached by the source file and its mtime, only new
+    or changed entries are serialized again.
+    """
+
+    @property
+    def options(self):
+        value = self.app.config.get('feed')
+        return get_options(value, path='feed.xml', count=20, content=True)
+
+    def entry_cache_file(self, req):
+        ident = self.app.fingerprints.digest('feed')
+        key = 'feed.%s.%s' % (ident, req._cache_key)
+        return os.path.join(self.app.cachedir, key)
+
+    def serialize_entry(self, req):
+        from .filters import markdown, xmldatetime
+
+        url = req.full_url
+        lines = [
+            u'<entry>',
+            u'<title>%s</title>' % escape(to_unicode(req.title or u'')),
+            u'<link href=%s/>' % quoteattr(url),
+            u'<id>%s</id>' % escape(url),
+            u'<updated>%s</updated>' % xmldatetime(req.date),
+        ]
+        if self.options['content'] and req.content:
+            cache_key = '%i-%s' % (len(req.content), req._cache_key)
+            html = markdown(req.content, cache_key=cache_key)
+            lines.append(u'<content type="html">%s</content>' % escape(html))
+        lines.append(u'</entry>\n')
+        return u''.join(lines)
+
+    def get_entry(self, filepath):
+        req = Request(filepath)
+        cache_file = self.entry_cache_file(req)
+        if self.app.is_cached(cache_file):
+            with open(cache_file, 'rb') as f:
+                return to_unicode(f.read())
+
+        logger.debug('serializing [feed]: %s' % req.relpath)
+        entry = self.serialize_entry(req)
+        with open(cache_file, 'wb') as f:
+            f.write(to_bytes(entry))
+        return entry
+
+    def iter_feed(self, keys):
+        from .filters import xmldatetime
+
+        baseurl = self.app.config.get('baseurl', '').rstrip('/')
+        path = self.options['path']
+        yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+        yield u'<feed xmlns="http://www.w3.org/2005/Atom">\n'
+        yield u'<title>%s</title>\n' % escape(
+            to_unicode(self.app.config.get('title', ''))
+        )
+        yield u'<link href=%s/>\n' % quoteattr(baseurl + '/')
+        yield u'<link rel="self" href=%s/>\n' % quoteattr(
+            '%s/%s' % (baseurl, path)
+        )
+        yield u'<id>%s/</id>\n' % escape(baseurl)
+        if keys:
+            updated = xmldatetime(Request(keys[0]).date)
+            yield u'<updated>%s</updated>\n' % updated
+        for filepath in keys:
+            yield self.get_entry(filepath)
+        yield u'</feed>\n'
+
+    def run(self):
+        if not self.app.config.get('feed'):
+            return
+        options = self.options
+        if not self.app.in_shard(options['path']):
+            return
+
+        logger.info('BUILDING FEED')
+        keys = self.app.filter_post_files(count=options['count'])
+        dest = os.path.join(self.app.sitedir, options['path'])
+        self.write_stream(self.iter_feed(keys), dest)
@@ -9,11 +9,17 @@
 """
 
 import re
-from .markdown import markdown
 
 __all__ = ['markdown', 'xmldatetime', 'wordcount', 'linguist']
 
 
+def markdown(text, *args, **kwargs):
+    """Markdown filter, see :func:`writeup.markdown.markdown`. Mistune
+    is imported when the first text is rendered."""
+    from .markdown import markdown as _markdown
+    return _markdown(text, *args, **kwargs)
+
+
 def xmldatetime(date):
     """Convert a Date into XML Schema RFC3339 format."""
     return date.isoformat('T')
@@ -0,0 +1,133 @@
+# coding: utf-8
+"""
+    writeup.fingerprint
+    ~~~~~~~~~~~~~~~~~~~
+
+    Fingerprints of the config keys and the library versions that every
+    cache layer depends on. A layer whose fingerprint changed since the
+    last build is not trusted, only the caches of that layer are built
+    again, e.g. changing ``baseurl`` renders every page again but keeps
+    the parsed sources and the markdown cache.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import hashlib
+import importlib
+from . import __version__
+from .utils import cached_property
+from ._compat import to_bytes, to_unicode
+
+#: config keys that never change an output
+RUNTIME_KEYS = (
+    'force', 'profile', 'shard', 'storage', 'prune', 'atomic',
+    'generations', 'memory_limit', 'memory_batch', 'memory_strict',
+    'asset_workers', 'compress_workers',
+)
+
+#: layer: (config keys, libraries), ``None`` means the whole config
+LAYERS = {
+    # parsed sources and the indexes, timestamps of posts
+    'index': (('timezone', 'basedir', 'postsdir'), ('yaml',)),
+    # urls of posts in the indexes
+    'url': (('permalink',), ()),
+    'markdown': ((), ('mistune', 'pygments')),
+    # minified html, it changes with the version of writeup only
+    'minify': ((), ()),
+    # an entry keeps the full url and the date of a post
+    'feed': (
+        ('baseurl', 'feed', 'permalink', 'timezone', 'basedir', 'postsdir'),
+        ('mistune', 'pygments', 'pytz'),
+    ),
+    'search': (('search', 'permalink'), ()),
+    'output': (None, ('jinja2', 'mistune', 'pygments')),
+}
+
+#: prefix of cache files: layer, the digest of the layer follows it
+#: in the name of a cache file, e.g. ``parse.<digest>.<key>``
+CACHE_PREFIXES = {
+    'parse': 'index',
+    'markdown': 'markdown',
+    'minify': 'minify',
+    'feed': 'feed',
+}
+
+
+def library_version(name):
+    """Version of an installed library, ``None`` if it is missing."""
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return getattr(module, '__version__', None)
+
+
+class Fingerprints(object):
+    """Compare fingerprints of the layers with the last build.
+
+    :param db_file: the file to persist the fingerprints
+    :param config: the config of the application
+    """
+    def __init__(self, db_file, config):
+        self.db_file = db_file
+        self.config = config
+        self._digests = {}
+
+    @cached_property
+    def _saved(self):
+        if not os.path.exists(self.db_file):
+            return {}
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def digest(self, layer):
+        if layer in self._digests:
+            return self._digests[layer]
+
+        keys, libraries = LAYERS[layer]
+        if keys is None:
+            keys = [k for k in self.config if k not in RUNTIME_KEYS]
+        data = {
+            'writeup': __version__,
+            'config': dict((k, self.config.get(k)) for k in keys),
+            'libraries': dict((k, library_version(k)) for k in libraries),
+        }
+        text = json.dumps(data, sort_keys=True, default=str)
+        rv = hashlib.md5(to_bytes(text)).hexdigest()[:12]
+        self._digests[layer] = rv
+        return rv
+
+    def changed(self, layer):
+        return self._saved.get(layer) != self.digest(layer)
+
+    def save(self):
+        """Persist the fingerprints, the cache files are pruned only
+        when a fingerprint changed since the last build."""
+        data = dict((layer, self.digest(layer)) for layer in LAYERS)
+        if data == self._saved:
+            return
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(json.dumps(data)))
+        self._saved = data
+        self.prune()
+
+    def prune(self):
+        """Delete cache files of the fingerprints that are not current,
+        they are never read again."""
+        cachedir = os.path.dirname(self.db_file)
+        count = 0
+        for filename in os.listdir(cachedir):
+            parts = filename.split('.', 2)
+            layer = CACHE_PREFIXES.get(parts[0])
+            if layer is None:
+                continue
+            # names without a fingerprint are of an older version
+            if len(parts) < 3 or parts[1] != self.digest(layer):
+                try:
+                    os.unlink(os.path.join(cachedir, filename))
+                    count += 1
+                except OSError:
+                    pass
+        return count
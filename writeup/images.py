@@ -0,0 +1,354 @@
+# coding: utf-8
+"""
+    writeup.images
+    ~~~~~~~~~~~~~~
+
+    Resize local images into width variants, and render ``<img>`` with
+    ``srcset``, ``sizes``, ``width`` and ``height``::
+
+        images:
+          widths: [480, 960, 1440]
+          sizes: "(max-width: 800px) 100vw, 800px"
+          quality: 82
+          workers: 4
+
+    It requires Pillow. Variants are cached by the digest of the image
+    and the settings, new images are resized in a process pool.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from .assets import AssetPublisher, file_digest, fingerprint_name
+from .builder import Builder
+from .utils import cached_property
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: images with these extensions are resized
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+DEFAULT_WIDTHS = [480, 960, 1440]
+
+#: absolute links of inline images and link definitions in markdown
+link_pattern = re.compile(
+    r'!\[[^\]]*\]\(\s*<?(/[^\s)>]+)|^ {0,3}\[[^\]]+\]:\s*<?(/[^\s>]+)',
+    re.M
+)
+
+
+def load_pillow():
+    """Import Pillow on use, None if it is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def resize_image(job):
+    """Create the width variants of an image in the cache directory.
+
+    It runs in a worker process, return ``(name, digest, width, height,
+    variants)``, a variant is ``[width, cache file]``.
+    """
+    Image = load_pillow()
+    name, source, digest, widths, quality, cachedir = job
+    ext = os.path.splitext(source)[1].lower()
+    img = Image.open(source)
+    width, height = img.size
+
+    variants = []
+    for w in sorted(widths):
+        if w >= width:
+            continue
+        filename = '%s-%iw-q%i%s' % (digest[:16], w, quality, ext)
+        cache_file = os.path.join(cachedir, filename)
+        if not os.path.isfile(cache_file):
+            h = int(round(height * w / float(width)))
+            resized = img.resize((w, h), Image.LANCZOS)
+            if ext in ('.jpg', '.jpeg') and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+            tmp = '%s.%i-%i.tmp' % (cache_file, os.getpid(), id(resized))
+            resized.save(tmp, format=img.format, quality=quality)
+            os.rename(tmp, cache_file)
+        variants.append([w, filename])
+    return name, digest, width, height, variants
+
+
+def try_resize_image(job):
+    """Resize an image like :func:`resize_image`, return ``(result,
+    None)``, or ``(None, error)`` for an image that can not be read,
+    e.g. a corrupt one, it does not fail the other images of a pool."""
+    try:
+        return resize_image(job), None
+    except Exception as e:
+        return None, repr(e)
+
+
+class ImageIndex(object):
+    """Sizes and variants of images, persisted between builds.
+
+    :param db_file: the file to persist the index
+    :param basedir: the directory that image names are relative to
+    :param cachedir: the directory of resized variants
+    :param options: the ``images`` config
+    :param force: measure every image again
+    """
+    def __init__(self, db_file, basedir, cachedir, options, force=False):
+        self.db_file = db_file
+        self.force = force
+        self.basedir = basedir
+        self.cachedir = cachedir
+        self.widths = options.get('widths', DEFAULT_WIDTHS)
+        self.sizes = options.get('sizes', '100vw')
+        self.quality = options.get('quality', 82)
+        self.workers = options.get('workers', 4)
+        #: name: (mtime, size) of images that failed, not tried again
+        #: until they change
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    @cached_property
+    def settings(self):
+        """Digest of the settings that affect the variants."""
+        text = json.dumps([sorted(self.widths), self.quality])
+        return hashlib.md5(to_bytes(text)).hexdigest()[:8]
+
+    @cached_property
+    def _data(self):
+        if self.force or not os.path.exists(self.db_file):
+            return {}
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def is_image(self, name):
+        return os.path.splitext(name)[1].lower() in EXTENSIONS
+
+    def get(self, name):
+        """Get the entry of a fresh image, ``None`` if it is missing or
+        it has to be resized again."""
+        entry = self._data.get(name)
+        try:
+            stat = os.stat(os.path.join(self.basedir, name))
+        except OSError:
+            return None
+        if not entry or entry['settings'] != self.settings or \
+                'digest' not in entry:
+            return None
+        if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            return None
+        for variant in entry['variants']:
+            if not os.path.isfile(os.path.join(self.cachedir, variant[1])):
+                return None
+        return entry
+
+    def create_job(self, name):
+        source = os.path.join(self.basedir, name)
+        return (
+            name, source, file_digest(source), self.widths, self.quality,
+            self.cachedir,
+        )
+
+    def add(self, result):
+        name, digest, width, height, variants = result
+        stat = os.stat(os.path.join(self.basedir, name))
+        entry = {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'settings': self.settings,
+            'digest': digest,
+            'width': width,
+            'height': height,
+            'variants': [
+                [w, filename, fingerprint_name(
+                    variant_name(name, w), digest
+                )]
+                for w, filename in variants
+            ],
+        }
+        with self._lock:
+            self._data[name] = entry
+        return entry
+
+    def stat_key(self, name):
+        try:
+            stat = os.stat(os.path.join(self.basedir, name))
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def is_failed(self, name):
+        key = self.failed.get(name)
+        return key is not None and key == self.stat_key(name)
+
+    def process(self, names):
+        """Resize images that are new or changed, in a process pool.
+
+        An image that fails is logged and has no variants, the original
+        is published as any other file and rendered without ``srcset``.
+        """
+        names = [
+            name for name in names
+            if self.get(name) is None and not self.is_failed(name)
+        ]
+        if not names:
+            return 0
+
+        jobs = []
+        for name in names:
+            try:
+                jobs.append(self.create_job(name))
+            except (IOError, OSError) as e:
+                self.fail(name, repr(e))
+        if self.workers > 1 and len(jobs) > 1:
+            from multiprocessing import Pool
+            pool = Pool(min(self.workers, len(jobs)))
+            try:
+                results = pool.map(try_resize_image, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [try_resize_image(job) for job in jobs]
+
+        count = 0
+        for job, (result, error) in zip(jobs, results):
+            if error is not None:
+                self.fail(job[0], error)
+                continue
+            self.add(result)
+            count += 1
+        return count
+
+    def fail(self, name, error):
+        logger.warn('image failed [%s]: %s' % (name, error))
+        with self._lock:
+            self.failed[name] = self.stat_key(name)
+
+    def ensure(self, name):
+        """Get the entry of an image, resize it now if necessary."""
+        entry = self.get(name)
+        if entry is not None:
+            return entry
+        self.process([name])
+        return self.get(name)
+
+    def references(self, text):
+        """Names of the local images referenced by a markdown text."""
+        rv = set()
+        for m in link_pattern.finditer(text or u''):
+            link = m.group(1) or m.group(2)
+            name = link.lstrip('/')
+            if not self.is_image(name) or link.startswith('//'):
+                continue
+            if os.path.isfile(os.path.join(self.basedir, name)):
+                rv.add(name)
+        return sorted(rv)
+
+    def signature(self, text):
+        """Digests of the images referenced by a markdown text, the
+        rendered html changes with them."""
+        rv = []
+        for name in self.references(text):
+            entry = self.ensure(name)
+            if entry is not None:
+                rv.append([name, entry['digest']])
+        return rv
+
+    def latest(self, text):
+        """The latest mtime of the images referenced by a text."""
+        mtimes = [
+            os.path.getmtime(os.path.join(self.basedir, name))
+            for name in self.references(text)
+        ]
+        return max(mtimes or [0])
+
+    def attributes(self, link):
+        """Attributes of ``<img>`` for an absolute local image link, a
+        list of ``(key, value)``, or None for images it does not know."""
+        if not link.startswith('/') or link.startswith('//') or '?' in link:
+            return None
+        name = link.lstrip('/')
+        if not self.is_image(name):
+            return None
+        if not os.path.isfile(os.path.join(self.basedir, name)):
+            return None
+
+        entry = self.ensure(name)
+        if entry is None:
+            return None
+
+        rv = [
+            ('width', str(entry['width'])),
+            ('height', str(entry['height'])),
+        ]
+        if entry['variants']:
+            srcset = ['/%s %iw' % (v[2], v[0]) for v in entry['variants']]
+            srcset.append('%s %iw' % (link, entry['width']))
+            rv.append(('srcset', ', '.join(srcset)))
+            rv.append(('sizes', self.sizes))
+        return rv
+
+    def save(self):
+        data = json.dumps(self._data)
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(data))
+
+
+def variant_name(name, width):
+    """The name of a width variant: ``img/a.jpg -> img/a-480w.jpg``"""
+    root, ext = os.path.splitext(name)
+    return '%s-%iw%s' % (root, width, ext)
+
+
+class ImageBuilder(Builder):
+    """Resize the images of the site and publish the variants."""
+
+    @cached_property
+    def publisher(self):
+        return AssetPublisher('hardlink', dedupe=False)
+
+    def image_names(self):
+        images = self.app.images
+        for filepath in self.app.file_indexer:
+            if self.app.postsdir in filepath:
+                continue
+            name = os.path.relpath(filepath, self.app.basedir)
+            key = self.app.source_key(filepath)
+            if images.is_image(name) and self.app.in_shard(key):
+                yield name
+
+    def publish(self, name, entry):
+        images = self.app.images
+        for w, filename, output in entry['variants']:
+            dest = os.path.join(self.app.sitedir, output)
+            self.app.output_manifest.record(
+                dest, os.path.join(self.app.basedir, name)
+            )
+            if self.app.storage.exists(dest):
+                # the name contains the digest
+                continue
+            source = os.path.join(images.cachedir, filename)
+            self.app.storage.publish(self.publisher, source, dest)
+
+    def run(self):
+        images = self.app.images
+        if images is None:
+            return
+
+        logger.info('BUILDING IMAGES')
+        names = list(self.image_names())
+        count = images.process(names)
+        for name in names:
+            entry = images.get(name)
+            if entry is not None:
+                self.publish(name, entry)
+        images.save()
+        logger.info('RESIZING %i/%i' % (count, len(names)))
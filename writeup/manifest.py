@@ -0,0 +1,190 @@
+# coding: utf-8
+"""
+    writeup.manifest
+    ~~~~~~~~~~~~~~~~
+
+    Record every output of the site and the source that produced it.
+
+    A watcher does not write the whole manifest after every change, the
+    changes are appended to a journal next to it, see
+    :meth:`OutputManifest.flush`.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import shutil
+import logging
+import posixpath
+from .utils import cached_property
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: siblings of an output, e.g. precompressed files
+SIBLING_SUFFIXES = ('.gz', '.br')
+
+
+class OutputManifest(object):
+    """Map outputs (relative to the site directory) to their sources.
+
+    :param db_file: the file to persist the manifest
+    :param sitedir: the site directory
+    """
+    def __init__(self, db_file, sitedir):
+        self.db_file = db_file
+        self.sitedir = sitedir
+        self.journal_file = db_file + '.journal'
+        # outputs produced by each source in this build
+        self._produced = {}
+        # outputs changed since the manifest or the journal was written
+        self._dirty = set()
+        self._journal_size = 0
+
+    @cached_property
+    def _data(self):
+        data = {}
+        if os.path.exists(self.db_file):
+            with open(self.db_file, 'rb') as f:
+                data = json.loads(to_unicode(f.read()))
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        item = json.loads(to_unicode(line))
+                    except ValueError:
+                        # the last line of an interrupted flush
+                        continue
+                    if len(item) == 2:
+                        data[item[0]] = item[1]
+                    else:
+                        data.pop(item[0], None)
+                    self._journal_size += 1
+        return data
+
+    def relpath(self, dest):
+        return os.path.relpath(dest, self.sitedir).replace(os.path.sep, '/')
+
+    def record(self, dest, source=None):
+        """Record an output and the source file that produced it."""
+        name = self.relpath(dest)
+        self._data[name] = source
+        self._dirty.add(name)
+        if source is not None:
+            self._produced.setdefault(source, set()).add(name)
+
+    def discard(self, dest):
+        """Forget an output that is removed."""
+        name = self.relpath(dest)
+        self._data.pop(name, None)
+        self._dirty.add(name)
+
+    def keys(self):
+        return self._data.keys()
+
+    def get(self, name):
+        return self._data.get(name)
+
+    def orphans(self, sources):
+        """Find outputs without a live source.
+
+        An output is orphaned when its source is not in the given
+        sources any more, or when its source was built again without
+        producing it (e.g. the permalink changed).
+
+        :param sources: a set of all the live source files
+        """
+        rv = []
+        for name, source in self._data.items():
+            if source is None:
+                continue
+            if source not in sources:
+                rv.append(name)
+            elif source in self._produced:
+                if name not in self._produced[source]:
+                    rv.append(name)
+        return rv
+
+    def prune(self, sources):
+        """Delete orphaned outputs and return the count of them.
+
+        Files are removed directory by directory, a directory that
+        contains nothing but orphans is removed at once.
+        """
+        groups = {}
+        for name in self.orphans(sources):
+            folder, filename = os.path.split(name)
+            groups.setdefault(folder, set()).add(filename)
+            del self._data[name]
+            self._dirty.add(name)
+
+        count = 0
+        for folder in sorted(groups, key=len, reverse=True):
+            filenames = groups[folder]
+            count += len(filenames)
+            dirpath = os.path.join(self.sitedir, folder)
+            removing = set(filenames)
+            for filename in filenames:
+                for suffix in SIBLING_SUFFIXES:
+                    removing.add(filename + suffix)
+
+            try:
+                existing = set(os.listdir(dirpath))
+            except OSError:
+                continue
+
+            if folder and existing <= removing:
+                logger.debug('pruning [dir]: %s' % folder)
+                shutil.rmtree(dirpath)
+                self._remove_empty_parents(os.path.dirname(dirpath))
+                continue
+
+            for filename in existing & removing:
+                name = posixpath.join(folder, filename)
+                logger.debug('pruning [file]: %s' % name)
+                os.unlink(os.path.join(dirpath, filename))
+            self._remove_empty_parents(dirpath)
+        return count
+
+    def _remove_empty_parents(self, dirpath):
+        sitedir = os.path.abspath(self.sitedir)
+        dirpath = os.path.abspath(dirpath)
+        while dirpath.startswith(sitedir + os.path.sep):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                # not empty
+                return
+            dirpath = os.path.dirname(dirpath)
+
+    def save(self):
+        data = json.dumps(self._data)
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(data))
+        if os.path.exists(self.journal_file):
+            os.unlink(self.journal_file)
+        self._dirty = set()
+        self._journal_size = 0
+
+    def flush(self):
+        """Append the changes since the last write to the journal, it
+        costs the size of the changes instead of the whole manifest.
+        The manifest is saved when the journal grows too large."""
+        if not self._dirty:
+            return
+        if self._journal_size + len(self._dirty) > len(self._data) // 4:
+            self.save()
+            return
+
+        lines = []
+        for name in sorted(self._dirty):
+            if name in self._data:
+                item = [name, self._data[name]]
+            else:
+                item = [name]
+            lines.append(json.dumps(item) + '\n')
+        with open(self.journal_file, 'ab') as f:
+            f.write(to_bytes(''.join(lines)))
+        self._journal_size += len(lines)
+        self._dirty = set()
@@ -2,12 +2,11 @@
 
 import os
 import re
+import json
+import hashlib
 import mistune as m
-from markupsafe import escape
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
 from .utils import _top
+from .profiler import current_profiler
 from ._compat import to_bytes, to_unicode
 
 
@@ -32,10 +31,19 @@ class BaseRenderer(m.Renderer):
         return html
 
     def image(self, link, title, alt_text):
-        if hasattr(self, '_lazyimg') and self._lazyimg:
-            html = '<img data-src="%s" alt="%s" />' % (link, alt_text)
+        lazyimg = hasattr(self, '_lazyimg') and self._lazyimg
+        if lazyimg:
+            html = '<img data-src="%s" alt="%s"' % (link, alt_text)
         else:
-            html = '<img src="%s" alt="%s" />' % (link, alt_text)
+            html = '<img src="%s" alt="%s"' % (link, alt_text)
+
+        images = _get_images()
+        attrs = images and images.attributes(link)
+        for key, value in attrs or []:
+            if lazyimg and key in ('srcset', 'sizes'):
+                key = 'data-%s' % key
+            html = '%s %s="%s"' % (html, key, value)
+        html = '%s />' % html
         if not title:
             return html
         return '<figure>%s<figcaption>%s</figcaption></figure>' % (
@@ -66,6 +74,7 @@ class BaseRenderer(m.Renderer):
 
 class HighlightRenderer(BaseRenderer):
     def block_code(self, text, lang):
+        from markupsafe import escape
         if not lang:
             text = text.strip()
             return u'<pre><code>%s</code></pre>\n' % escape(text)
@@ -78,11 +87,16 @@ class HighlightRenderer(BaseRenderer):
             linenos = self._linenos
 
         try:
+            # pygments is loaded by the first highlighted code block
+            from pygments import highlight
+            from pygments.lexers import get_lexer_by_name
+            from pygments.formatters import HtmlFormatter
             lexer = get_lexer_by_name(lang, stripall=True)
             formatter = HtmlFormatter(
                 noclasses=inlinestyles, linenos=linenos
             )
-            code = highlight(text, lexer, formatter)
+            with current_profiler().span(lang, 'highlight'):
+                code = highlight(text, lexer, formatter)
             if linenos:
                 return '<div class="highlight-wrapper">%s</div>\n' % code
             return code
@@ -94,6 +108,18 @@ class HighlightRenderer(BaseRenderer):
 _mds = {}
 
 
+def _get_images():
+    app = getattr(_top, 'app', None)
+    if app is None:
+        return None
+    return app.images
+
+
+def release_renderers():
+    """Drop the cached markdown renderers."""
+    _mds.clear()
+
+
 def _get_md(highlight, inlinestyles, linenos, lazyimg):
     global _mds
     ident = hash((highlight, inlinestyles, linenos, lazyimg))
@@ -128,21 +154,39 @@ def markdown(text, highlight=True, inlinestyles=False, linenos=False,
         return u''
 
     if cache_key is None and _top.request:
-        cache_key = '%i-%s' % (len(text), _top.request._cache_key)
+        # the text is not always the content of the request, e.g. posts
+        # listed by an index page, it is keyed by its digest
+        digest = hashlib.md5(to_bytes(text)).hexdigest()[:16]
+        cache_key = '%s-%s' % (digest, _top.request._cache_key)
 
+    profiler = current_profiler()
     if cache_key is None:
         md = _get_md(highlight, inlinestyles, linenos, lazyimg)
-        return md.render(text)
-
-    ident = hash((highlight, inlinestyles, linenos, lazyimg))
-    key = 'markdown.%i.%s' % (ident, cache_key)
-    cache_file = os.path.join(_top.app.cachedir, key)
-    if os.path.isfile(cache_file):
+        with profiler.span('markdown', 'markdown'):
+            return md.render(text)
+
+    app = _top.app
+    settings = [highlight, inlinestyles, linenos, lazyimg]
+    images = _get_images()
+    if images is not None:
+        # image attributes depend on the settings and the images
+        settings.append(images.settings)
+        settings.append(images.signature(text))
+    ident = hashlib.md5(to_bytes(json.dumps(settings))).hexdigest()[:12]
+    # the fingerprint comes first, outdated files are pruned by it
+    key = 'markdown.%s.%s.%s' % (
+        app.fingerprints.digest('markdown'), ident, cache_key
+    )
+    cache_file = os.path.join(app.cachedir, key)
+    if app.is_cached(cache_file):
+        profiler.count('markdown', True)
         with open(cache_file, 'rb') as f:
             return to_unicode(f.read())
 
+    profiler.count('markdown', False)
     md = _get_md(highlight, inlinestyles, linenos, lazyimg)
-    html = md.render(text)
+    with profiler.span(cache_key, 'markdown'):
+        html = md.render(text)
     with open(cache_file, 'wb') as f:
         f.write(to_bytes(html))
     return html
@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+    writeup.memory
+    ~~~~~~~~~~~~~~
+
+    Build very large sites within a memory ceiling::
+
+        memory_limit: 1024    # RSS ceiling in MB
+        memory_batch: 200     # the first batch size
+        memory_strict: false  # fail the build above the ceiling
+
+    Pages are built in batches in the same process. After every batch
+    the resident memory is checked: when it comes close to the ceiling
+    the caches that grow with the pages built (templates, markdown
+    renderers, post buckets) are released and the next batches are
+    smaller, so it is checked more often.
+
+    The ceiling is advisory: memory that is still referenced can not
+    be released, a warning is logged when it is exceeded. With
+    ``memory_strict`` the build fails instead.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import gc
+import logging
+from .profiler import peak_memory
+
+logger = logging.getLogger('writeup')
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+
+def resident_memory():
+    """Current resident memory of this process in KB.
+
+    It is read from ``/proc``, the peak memory is used on platforms
+    without it.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            pages = int(f.read().split()[1])
+        return pages * PAGE_SIZE // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return peak_memory()
+
+
+class MemoryGovernor(object):
+    """Split work into batches sized by the resident memory.
+
+    :param limit: the RSS ceiling in MB
+    :param batch: the first batch size
+    :param release: a function to release caches
+    :param strict: raise a RuntimeError above the limit
+    """
+    #: release caches and shrink batches above this ratio of the limit
+    high = 0.8
+    #: grow batches below this ratio of the limit
+    low = 0.5
+
+    def __init__(self, limit, batch=100, release=None, strict=False):
+        self.limit = int(limit) * 1024
+        self.batch = max(1, int(batch))
+        self.max_batch = self.batch * 8
+        self.release = release
+        self.strict = strict
+        self.peak = 0
+        self._warned = False
+
+    def batches(self, items):
+        """Iterate the items in batches, memory is checked between."""
+        items = list(items)
+        start = 0
+        while start < len(items):
+            end = start + self.batch
+            yield items[start:end]
+            start = end
+            self.check()
+
+    def check(self):
+        rss = resident_memory()
+        if rss is None:
+            return
+        self.peak = max(self.peak, rss)
+
+        if rss > self.limit * self.high:
+            if self.release:
+                self.release()
+            gc.collect()
+            self.batch = max(1, self.batch // 2)
+            rss = resident_memory()
+            logger.debug('releasing [memory]: %i KB, batch %i' % (
+                rss, self.batch
+            ))
+            if rss > self.limit:
+                message = 'MEMORY %i MB is over the limit %i MB' % (
+                    rss // 1024, self.limit // 1024
+                )
+                if self.strict:
+                    raise RuntimeError(message)
+                if not self._warned:
+                    self._warned = True
+                    logger.warn(message)
+        elif rss < self.limit * self.low and self.batch < self.max_batch:
+            self.batch = min(self.max_batch, self.batch * 2)
@@ -0,0 +1,267 @@
+# coding: utf-8
+"""
+    writeup.minify
+    ~~~~~~~~~~~~~~
+
+    Remove template whitespace and comments from rendered HTML.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import re
+import hashlib
+import posixpath
+import threading
+from . import __version__
+from ._compat import to_bytes, to_unicode
+
+# content of these elements is never touched, code blocks rendered by
+# HighlightRenderer are wrapped in <pre>
+preserve_pattern = re.compile(
+    r'(<(pre|code|textarea|script|style)\b[^>]*>.*?</\2\s*>'
+    r'|<!--\[if.*?<!\[endif\]-->)',
+    re.S | re.I
+)
+comment_pattern = re.compile(r'<!--.*?-->', re.S)
+space_pattern = re.compile(r'\s+')
+
+_block_tags = (
+    'html|head|body|title|meta|link|div|p|ul|ol|li|dl|dt|dd|table|thead|'
+    'tbody|tfoot|tr|th|td|header|footer|section|article|aside|nav|main|'
+    'figure|figcaption|blockquote|h[1-6]|hr|br|form|fieldset|option|'
+    'select|noscript|!doctype'
+)
+block_pattern = re.compile(
+    r'\s*(</?(?:%s)\b[^>]*>)\s*' % _block_tags, re.I
+)
+
+
+def minify_html(html):
+    """Minify the given HTML, ``<pre>`` and ``<code>`` are preserved."""
+    html = to_unicode(html)
+    rv = []
+    pos = 0
+    for m in preserve_pattern.finditer(html):
+        rv.append(_minify_text(html[pos:m.start()]))
+        rv.append(m.group(0))
+        pos = m.end()
+    rv.append(_minify_text(html[pos:]))
+    return u''.join(rv).strip()
+
+
+def _minify_text(text):
+    text = comment_pattern.sub(u'', text)
+    text = space_pattern.sub(u' ', text)
+    return block_pattern.sub(r'\1', text)
+
+
+class Minifier(object):
+    """Minify HTML outputs, the results are cached by content hash.
+
+    :param cachedir: directory of the minified cache files
+    :param is_cached: a function to tell if a cache file can be read
+    :param ident: the fingerprint of the minifier in cache names
+    """
+    def __init__(self, cachedir, is_cached=os.path.isfile, ident=None):
+        self.cachedir = cachedir
+        self.is_cached = is_cached
+        if ident is None:
+            ident = hashlib.md5(to_bytes(__version__)).hexdigest()[:12]
+        self.ident = ident
+        self.original_bytes = 0
+        self.minified_bytes = 0
+        self._lock = threading.Lock()
+
+    def minify(self, content):
+        content = to_bytes(content)
+        # the output changes with the minifier of a new version, the
+        # fingerprint comes first, outdated files are pruned by it
+        digest = hashlib.md5(content).hexdigest()
+        name = 'minify.%s.%s' % (self.ident, digest)
+        cache_file = os.path.join(self.cachedir, name)
+
+        if self.is_cached(cache_file):
+            with open(cache_file, 'rb') as f:
+                rv = f.read()
+        else:
+            rv = to_bytes(minify_html(content))
+            with open(cache_file, 'wb') as f:
+                f.write(rv)
+
+        with self._lock:
+            self.original_bytes += len(content)
+            self.minified_bytes += len(rv)
+        return rv
+
+
+css_token_pattern = re.compile(
+    r'/\*.*?\*/|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.S
+)
+css_punct_pattern = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """Minify a stylesheet, strings and ``/*! */`` comments are kept."""
+    text = to_unicode(text)
+    rv = []
+    pos = 0
+    for m in css_token_pattern.finditer(text):
+        rv.append(_minify_css_text(text[pos:m.start()]))
+        token = m.group(0)
+        if not token.startswith(u'/*') or token.startswith(u'/*!'):
+            rv.append(token)
+        pos = m.end()
+    rv.append(_minify_css_text(text[pos:]))
+    return u''.join(rv).strip()
+
+
+def _minify_css_text(text):
+    text = space_pattern.sub(u' ', text)
+    text = css_punct_pattern.sub(r'\1', text)
+    return text.replace(u';}', u'}')
+
+
+css_url_pattern = re.compile(
+    r'''url\(\s*(["']?)([^"')\s]+)\1\s*\)''', re.I
+)
+
+
+def rebase_css_urls(text, source, target):
+    """Rewrite relative ``url()`` of a stylesheet in the directory
+    ``source`` to be relative to the directory ``target``."""
+    def rebase(m):
+        quote, url = m.group(1), m.group(2)
+        if url.startswith((u'/', u'#', u'data:')) or u':' in url:
+            return m.group(0)
+        path = posixpath.normpath(posixpath.join(u'/', source, url))
+        url = posixpath.relpath(path, posixpath.join(u'/', target))
+        return u'url(%s%s%s)' % (quote, url, quote)
+    return css_url_pattern.sub(rebase, to_unicode(text))
+
+
+#: quotes of strings and template literals in scripts
+_js_quotes = u'"\'`'
+
+#: a slash after these characters starts a regular expression
+_regex_after = u'(,=:[!&|?{};+-*%<>~^'
+_regex_keyword = re.compile(
+    r'(?:^|[^\w$])(?:return|typeof|case|do|else|in|of|void|yield|'
+    r'delete|throw|new)$'
+)
+
+
+def _starts_regex(tail):
+    tail = tail.rstrip()
+    if not tail or tail[-1] in _regex_after:
+        return True
+    return bool(_regex_keyword.search(tail))
+
+
+def _in_string(state):
+    return state is not None and state in _js_quotes
+
+
+def _flush_js(lines, chars, verbatim, open_string):
+    line = u''.join(chars)
+    if not verbatim:
+        line = line.lstrip()
+    if not open_string:
+        line = line.rstrip()
+    if line or verbatim:
+        lines.append(line)
+
+
+def minify_js(text):
+    """Minify a script conservatively.
+
+    Comments, indentation and blank lines are removed, which is safe
+    without a JavaScript parser. Strings, template literals and regular
+    expressions are kept as they are, so are ``/*! */`` comments. Line
+    breaks outside of comments are kept for automatic semicolons.
+    """
+    text = to_unicode(text).replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    lines = []
+    chars = []
+    # the current line starts inside a string
+    verbatim = False
+    # None in code, '*' in a comment, '!' in a kept comment, '/' in a
+    # regular expression, or the quote of a string
+    state = None
+    in_class = False
+    continued = False
+    # the last characters of code, to tell a regular expression
+    tail = u''
+    i = 0
+    length = len(text)
+    while i < length:
+        c = text[i]
+        nxt = text[i + 1] if i + 1 < length else u''
+        if c == u'\n':
+            _flush_js(lines, chars, verbatim, _in_string(state))
+            chars = []
+            if state == u'/' or (state in (u'"', u"'") and not continued):
+                # only a template literal or an escaped line break
+                # continues on the next line
+                state = None
+            verbatim = _in_string(state)
+            continued = False
+            tail += c
+            i += 1
+        elif state == u'*':
+            if c == u'*' and nxt == u'/':
+                state = None
+                # a comment separates tokens
+                chars.append(u' ')
+                i += 2
+            else:
+                i += 1
+        elif state == u'!':
+            chars.append(c)
+            if c == u'*' and nxt == u'/':
+                chars.append(nxt)
+                state = None
+                i += 1
+            i += 1
+        elif state is not None:
+            # in a string or a regular expression
+            chars.append(c)
+            if c == u'\\' and nxt == u'\n':
+                continued = True
+            elif c == u'\\' and nxt:
+                chars.append(nxt)
+                i += 1
+            elif state == u'/' and c == u'[':
+                in_class = True
+            elif state == u'/' and c == u']':
+                in_class = False
+            elif c == state and not in_class:
+                state = None
+                tail = (tail + c)[-16:]
+            i += 1
+        elif c == u'/' and nxt == u'/':
+            end = text.find(u'\n', i)
+            i = length if end < 0 else end
+        elif c == u'/' and nxt == u'*':
+            if text.startswith(u'/*!', i):
+                state = u'!'
+                chars.append(u'/*!')
+                i += 3
+            else:
+                state = u'*'
+                i += 2
+        else:
+            if c in _js_quotes:
+                state = c
+            elif c == u'/' and _starts_regex(tail):
+                state = u'/'
+                in_class = False
+            elif c == u'\\' and nxt:
+                chars.append(c)
+                c = nxt
+                i += 1
+            chars.append(c)
+            tail = (tail + c)[-16:]
+            i += 1
+    _flush_js(lines, chars, verbatim, _in_string(state))
+    return u'\n'.join(lines)
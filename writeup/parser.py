@@ -10,11 +10,16 @@
 """
 
 import re
-import yaml
-import mistune as m
 from ._compat import to_unicode
 
-rules = m.BlockGrammar()
+_rules = []
+
+
+def _get_rules():
+    if not _rules:
+        import mistune
+        _rules.append(mistune.BlockGrammar())
+    return _rules[0]
 
 
 def parse(filepath):
@@ -46,6 +51,7 @@ def parse_meta(text):
     The meta part contains title, info, and description
     """
     meta = {}
+    rules = _get_rules()
 
     # parse title
     m = rules.heading.match(text)
@@ -64,6 +70,7 @@ def parse_meta(text):
     # parse meta data
     m = rules.list_block.match(text)
     if m:
+        import yaml
         data = m.group(0)
         values = yaml.load(data)
         for item in values:
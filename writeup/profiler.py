@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+    writeup.profiler
+    ~~~~~~~~~~~~~~~~
+
+    Record timings of a build, dump them as a JSON summary and a
+    Chrome trace-event file (open it in ``chrome://tracing``).
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from .utils import _top
+from ._compat import to_bytes
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Profiler(object):
+    """Collect spans and cache counters of a build.
+
+    A disabled profiler costs nothing but a function call::
+
+        with app.profiler.span('markdown', 'markdown'):
+            html = md.render(text)
+
+    :param enabled: record or not
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []
+        self.caches = {}
+        self.begin = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, cat='phase', **args):
+        """Record the time spent in the block."""
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            event = {
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': int((start - self.begin) * 1000000),
+                'dur': int((end - start) * 1000000),
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+            }
+            if args:
+                event['args'] = args
+            with self._lock:
+                self.events.append(event)
+
+    def count(self, cache, hit):
+        """Count a hit or a miss of the given cache."""
+        if not self.enabled:
+            return
+        with self._lock:
+            counter = self.caches.setdefault(cache, [0, 0])
+            if hit:
+                counter[0] += 1
+            else:
+                counter[1] += 1
+
+    def self_times(self):
+        """Durations of the events without the time of the events
+        nested in them, e.g. markdown in a template, in microseconds."""
+        rv = [event['dur'] for event in self.events]
+        threads = {}
+        for i, event in enumerate(self.events):
+            key = (event['pid'], event['tid'])
+            threads.setdefault(key, []).append(i)
+
+        for indexes in threads.values():
+            # parents start first, and last longer when they start at once
+            indexes.sort(key=lambda i: (
+                self.events[i]['ts'], -self.events[i]['dur']
+            ))
+            stack = []
+            for i in indexes:
+                event = self.events[i]
+                while stack:
+                    parent = self.events[stack[-1]]
+                    if parent['ts'] + parent['dur'] > event['ts']:
+                        break
+                    stack.pop()
+                if stack:
+                    rv[stack[-1]] -= event['dur']
+                stack.append(i)
+        return [max(dur, 0) for dur in rv]
+
+    def summary(self, top=20):
+        phases = {}
+        phases_self = {}
+        files = {}
+        templates = {}
+        templates_self = {}
+        for event, self_us in zip(self.events, self.self_times()):
+            dur = event['dur'] / 1000.0
+            self_dur = self_us / 1000.0
+            cat = event['cat']
+            # phases are named spans, others are summed by category
+            key = event['name'] if cat == 'phase' else cat
+            phases[key] = phases.get(key, 0) + dur
+            phases_self[key] = phases_self.get(key, 0) + self_dur
+            if cat != 'template':
+                continue
+            name = event['name']
+            templates[name] = templates.get(name, 0) + dur
+            templates_self[name] = templates_self.get(name, 0) + self_dur
+            source = event.get('args', {}).get('source')
+            if source:
+                files[source] = files.get(source, 0) + dur
+
+        def _slowest(data, self_data=None):
+            items = sorted(data.items(), key=lambda o: o[1], reverse=True)
+            rv = []
+            for k, v in items[:top]:
+                item = {'name': k, 'ms': round(v, 3)}
+                if self_data is not None:
+                    item['self_ms'] = round(self_data[k], 3)
+                rv.append(item)
+            return rv
+
+        caches = {}
+        for name in self.caches:
+            hits, misses = self.caches[name]
+            total = hits + misses
+            caches[name] = {
+                'hits': hits,
+                'misses': misses,
+                'ratio': round(float(hits) / total, 4) if total else None,
+            }
+
+        def _round(data):
+            return dict((k, round(v, 3)) for k, v in data.items())
+
+        return {
+            'elapsed_ms': round((time.time() - self.begin) * 1000, 3),
+            # spans are nested, the inclusive time of a phase contains
+            # the time of the spans in it, the self time does not
+            'phases_ms': _round(phases),
+            'phases_self_ms': _round(phases_self),
+            'slowest_files': _slowest(files),
+            'slowest_templates': _slowest(templates, templates_self),
+            'caches': caches,
+            'peak_memory_kb': peak_memory(),
+        }
+
+    def dump(self, directory):
+        """Write ``profile.json`` and ``profile.trace.json``, return
+        the paths of them."""
+        summary_file = os.path.join(directory, 'profile.json')
+        with open(summary_file, 'wb') as f:
+            f.write(to_bytes(json.dumps(self.summary(), indent=2)))
+
+        trace_file = os.path.join(directory, 'profile.trace.json')
+        with open(trace_file, 'wb') as f:
+            trace = {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+            f.write(to_bytes(json.dumps(trace)))
+        return summary_file, trace_file
+
+
+null_profiler = Profiler(enabled=False)
+
+
+def current_profiler():
+    """The profiler of the application in the current context."""
+    app = getattr(_top, 'app', None)
+    if app is None:
+        return null_profiler
+    return app.profiler
+
+
+def peak_memory():
+    """Peak resident memory of this process in KB."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname()[0] == 'Darwin':
+        # bytes on Mac OS X
+        return rss // 1024
+    return rss
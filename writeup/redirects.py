@@ -0,0 +1,97 @@
+# coding: utf-8
+"""
+    writeup.redirects
+    ~~~~~~~~~~~~~~~~~
+
+    Collect ``redirect_from`` of posts and pages into redirect maps,
+    instead of an HTML stub for every redirect::
+
+        redirects: [nginx, json]
+
+    Available formats are ``html`` (the default stubs), ``nginx``,
+    ``apache`` and ``json``. The JSON map is always written with
+    another map, the preview server answers it with 301.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import logging
+from .builder import Builder
+from .request import Request
+from ._compat import text_types
+
+logger = logging.getLogger('writeup')
+
+#: output file of each map format
+MAP_FILES = {
+    'nginx': 'redirects.map',
+    'apache': '.htaccess',
+    'json': 'redirects.json',
+}
+
+
+def redirect_formats(config):
+    value = config.get('redirects', 'html')
+    if isinstance(value, text_types):
+        return [value]
+    return list(value)
+
+
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class RedirectBuilder(Builder):
+    """Write redirect maps from the indexes."""
+
+    def collect(self):
+        rv = {}
+        for indexer in (self.app.post_indexer, self.app.page_indexer):
+            for filepath in sorted(indexer.keys()):
+                data = indexer[filepath]
+                if 'redirect_from' in data:
+                    redirects = data['redirect_from']
+                else:
+                    # index created by an older version
+                    redirects = Request(filepath).redirect_from
+                if not redirects:
+                    continue
+                if isinstance(redirects, text_types):
+                    redirects = [redirects]
+                url = data.get('url') or Request(filepath).url
+                for redirect_from in redirects:
+                    rv[redirect_from] = url
+        return rv
+
+    def iter_nginx(self, data):
+        yield u'# include it in http {} and use it in server {}:\n'
+        yield u'# if ($redirect_uri) { return 301 $redirect_uri; }\n'
+        yield u'map $uri $redirect_uri {\n'
+        for key in sorted(data):
+            yield u'    %s %s;\n' % (_quote(key), _quote(data[key]))
+        yield u'}\n'
+
+    def iter_apache(self, data):
+        for key in sorted(data):
+            yield u'Redirect 301 %s %s\n' % (_quote(key), _quote(data[key]))
+
+    def iter_json(self, data):
+        yield json.dumps(data, sort_keys=True, indent=2)
+
+    def run(self):
+        formats = redirect_formats(self.app.config)
+        formats = [name for name in formats if name in MAP_FILES]
+        if not formats or not self.app.in_shard('redirects'):
+            return
+
+        if 'json' not in formats:
+            formats.append('json')
+
+        logger.info('BUILDING REDIRECTS')
+        data = self.collect()
+        for name in formats:
+            dest = os.path.join(self.app.sitedir, MAP_FILES[name])
+            chunks = getattr(self, 'iter_%s' % name)(data)
+            self.write_stream(chunks, dest)
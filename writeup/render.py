@@ -0,0 +1,292 @@
+# coding: utf-8
+"""
+    writeup.render
+    ~~~~~~~~~~~~~~
+
+    Render pages on request for previewing, no full build is needed::
+
+        $ writeup serve --render
+
+    An url is mapped back to its source through the indexes, only that
+    source is rendered. The result is kept in memory until the sources,
+    the templates or the indexes changed.
+
+    Changes are found by walking the tree and reading the mtime of
+    every source and template, at most once per interval and only on
+    a request. It costs a few milliseconds for hundreds of sources, set
+    a longer interval for a large site::
+
+        $ writeup serve --render --interval 5
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from .app import walk_tree
+from .builder import PostBuilder, FileBuilder, BundleBuilder
+from .feeds import SitemapBuilder, FeedBuilder, get_options
+from .redirects import RedirectBuilder
+from .request import Request
+from .server import Server, MemoryEntry
+from ._compat import to_bytes
+
+logger = logging.getLogger('writeup')
+
+
+class MemoryOutput(object):
+    """Keep outputs of a builder in memory instead of writing them."""
+    incremental = False
+
+    def __init__(self, app):
+        super(MemoryOutput, self).__init__(app)
+        self.outputs = {}
+
+    def write(self, content, dest, source=None):
+        self.write_count += 1
+        content = self.postprocess(content, dest)
+        self.outputs[dest] = to_bytes(content)
+
+    def write_stream(self, chunks, dest, source=None):
+        self.write_count += 1
+        self.outputs[dest] = b''.join(to_bytes(c) for c in chunks)
+
+
+class MemoryPostBuilder(MemoryOutput, PostBuilder):
+    pass
+
+
+class MemoryFileBuilder(MemoryOutput, FileBuilder):
+    pass
+
+
+class MemoryBundleBuilder(MemoryOutput, BundleBuilder):
+    pass
+
+
+class MemorySitemapBuilder(MemoryOutput, SitemapBuilder):
+    pass
+
+
+class MemoryFeedBuilder(MemoryOutput, FeedBuilder):
+    pass
+
+
+class Renderer(object):
+    """Resolve urls to sources and render them on request.
+
+    :param app: the application
+    :param interval: seconds between two scans of the source tree, a
+                     scan stats every source and template
+    """
+    def __init__(self, app, interval=1):
+        self.app = app
+        self.interval = interval
+        self.routes = {}
+        self.redirects = {}
+        self.version = None
+        self._signature = None
+        self._scanned = 0
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def scan(self):
+        """Mtimes of the sources and the templates."""
+        app = self.app
+        if app.basedir in app.postsdir:
+            includes = [os.path.relpath(app.postsdir, app.basedir)]
+            directories = [(app.basedir, includes)]
+        else:
+            directories = [(app.basedir, None), (app.postsdir, None)]
+
+        sources = []
+        for directory, includes in directories:
+            for filepath in walk_tree(directory, includes=includes):
+                sources.append((filepath, os.path.getmtime(filepath)))
+
+        templates = []
+        for key in ('layouts', 'includes'):
+            directory = app.config.get(key, '_%s' % key)
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    templates.append((filepath, os.path.getmtime(filepath)))
+        return sorted(sources), sorted(templates)
+
+    def refresh(self):
+        """Update the indexes and the routes when the sources changed,
+        the tree is scanned at most once per interval."""
+        with self._lock:
+            now = time.time()
+            if self.version and now - self._scanned < self.interval:
+                return
+            self._scanned = now
+            sources, templates = self.scan()
+            if (sources, templates) == self._signature:
+                return
+            self._signature = (sources, templates)
+
+            app = self.app
+            with app.create_context():
+                app.create_index()
+                app.asset_manifest.save()
+                # static urls and templates are memoized
+                app.__dict__.pop('jinja', None)
+                app.__dict__.pop('asset_manifest', None)
+                app.__dict__.pop('static_urls', None)
+                MemoryBundleBuilder(app).run()
+                self.build_routes()
+
+            # a page is rendered again when its own source changed, or
+            # anything else it may depend on changed, the indexes keep
+            # the dates of posts, an edit changes the mtimes only
+            data = [
+                sources,
+                app.post_indexer._data,
+                app.page_indexer._data,
+                app.file_indexer._data,
+                app.bundle_index,
+                templates,
+            ]
+            self.version = hashlib.md5(
+                to_bytes(json.dumps(data, sort_keys=True, default=str))
+            ).hexdigest()
+            logger.info('ROUTING %i urls' % len(self.routes))
+
+    def site_name(self, dest):
+        relpath = os.path.relpath(dest, self.app.sitedir)
+        return relpath.replace(os.path.sep, '/')
+
+    def build_routes(self):
+        app = self.app
+        builder = PostBuilder(app)
+        routes = {}
+
+        for indexer in (app.post_indexer, app.page_indexer):
+            for filepath in indexer.keys():
+                url = indexer[filepath].get('url')
+                if not url:
+                    url = Request(filepath).url
+                dest = builder.get_html_destination(url)
+                routes[self.site_name(dest)] = ('page', filepath)
+
+        files = FileBuilder(app)
+        assets = []
+        for filepath in app.file_indexer.keys():
+            if files.should_build_paginator(filepath):
+                paginator = files.create_paginator(filepath)
+                for i in range(1, paginator.pages + 1):
+                    paginator.page = i
+                    dest = paginator.create_dest(app.sitedir)
+                    routes[self.site_name(dest)] = ('paginator', filepath)
+            elif app.postsdir in filepath:
+                continue
+            elif files.is_template(filepath):
+                name = os.path.relpath(filepath, app.basedir)
+                routes[name.replace(os.path.sep, '/')] = ('html', filepath)
+            else:
+                name = os.path.relpath(filepath, app.basedir)
+                routes[name.replace(os.path.sep, '/')] = ('asset', filepath)
+                assets.append(name)
+
+        if app.config.get('fingerprint'):
+            for name in assets:
+                entry = app.asset_manifest.get(name)
+                if entry:
+                    source = os.path.join(app.basedir, name)
+                    routes[entry['name']] = ('asset', source)
+
+        for name in app.bundle_index:
+            routes[app.bundle_index[name]['name']] = ('bundle', name)
+
+        for key in ('sitemap', 'feed'):
+            value = app.config.get(key)
+            if value:
+                path = get_options(value, path='%s.xml' % key)['path']
+                routes[path] = (key, None)
+
+        self.routes = routes
+        self.redirects = RedirectBuilder(app).collect()
+
+    def resolve(self, url):
+        """Find the site name and the route of an url."""
+        name = url.lstrip('/')
+        if not name or name.endswith('/'):
+            name += 'index.html'
+        if name in self.routes:
+            return name, self.routes[name]
+        if not name.endswith('.html') and name + '.html' in self.routes:
+            return name + '.html', self.routes[name + '.html']
+        return name, None
+
+    def render(self, kind, source):
+        """Render the outputs of a source in memory."""
+        app = self.app
+        if kind == 'page':
+            builder = MemoryPostBuilder(app)
+            builder.build(source)
+        elif kind in ('html', 'paginator'):
+            builder = MemoryFileBuilder(app)
+            builder.build(source)
+        elif kind == 'bundle':
+            builder = MemoryBundleBuilder(app)
+            builder.build(source)
+        elif kind == 'sitemap':
+            builder = MemorySitemapBuilder(app)
+            builder.run()
+        else:
+            builder = MemoryFeedBuilder(app)
+            builder.run()
+        return builder.outputs
+
+    def get(self, url):
+        """Get a :class:`MemoryEntry` of the url, or the source filepath
+        of an asset. Return None when the url is not found."""
+        self.refresh()
+        name, route = self.resolve(url)
+        if route is None:
+            return None
+
+        kind, source = route
+        if kind == 'asset':
+            return source
+
+        if kind in ('page', 'html', 'paginator'):
+            key = (os.path.getmtime(source), self.version)
+        else:
+            key = (None, self.version)
+        cached = self._cache.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with self._lock:
+            logger.info('RENDERING %s' % name)
+            with self.app.create_context():
+                outputs = self.render(kind, source)
+            for dest in outputs:
+                entry = MemoryEntry(self.site_name(dest), outputs[dest])
+                self._cache[entry.filepath] = (key, entry)
+        cached = self._cache.get(name)
+        return cached and cached[1]
+
+
+class RenderServer(Server):
+    """A preview server rendering pages on request."""
+    def __init__(self, app, cache=None, interval=1):
+        Server.__init__(self, app.sitedir, cache=cache)
+        self.renderer = Renderer(app, interval=interval)
+
+    @property
+    def redirects(self):
+        self.renderer.refresh()
+        return self.renderer.redirects
+
+    def lookup(self, url):
+        rv = self.renderer.get(url)
+        if rv is None or isinstance(rv, MemoryEntry):
+            return rv
+        return self.cache.get(rv)
@@ -18,6 +18,13 @@ class Request(object):
         self._app = kwargs.pop('app', _top.app)
         self._values = kwargs
 
+    def release(self):
+        """Drop the parsed data and the cached attributes, they are
+        loaded again when accessed."""
+        for key in list(self.__dict__):
+            if key not in ('filepath', '_app', '_values'):
+                del self.__dict__[key]
+
     @cached_property
     def mtime(self):
         return os.path.getmtime(self.filepath)
@@ -37,13 +44,20 @@ class Request(object):
         return data
 
     def _parse_file(self):
-        filepath = os.path.join(self._app.cachedir, self._cache_key)
-
-        if os.path.exists(filepath):
+        key = 'parse.%s.%s' % (
+            self._app.fingerprints.digest('index'), self._cache_key
+        )
+        filepath = os.path.join(self._app.cachedir, key)
+
+        profiler = self._app.profiler
+        if self._app.is_cached(filepath):
+            profiler.count('parse', True)
             with open(filepath, 'rb') as f:
                 return json.load(f)
 
-        data = parse(self.filepath)
+        profiler.count('parse', False)
+        with profiler.span(self.relpath, 'parse'):
+            data = parse(self.filepath)
         if data is None:
             logger.warn('parsing failed: %s' % self.relpath)
             return {}
@@ -0,0 +1,209 @@
+# coding: utf-8
+"""
+    writeup.search
+    ~~~~~~~~~~~~~~
+
+    Emit an inverted index of posts for client side search::
+
+        search:
+          path: search
+          prefix: 2
+
+    ``search: true`` uses the defaults. The index is split into shards
+    by the prefix of terms, a browser downloads ``index.json`` and
+    ``docs.json`` first, then only the shards of the query terms:
+
+    - ``index.json``: ``{"prefix": 2, "shards": [...]}``
+    - ``docs.json``: ``{"docs": [[url, title], ...]}``, ``null`` for
+      removed posts, the position is the document id
+    - ``<shard>.json``: ``{term: [[id, frequency], ...]}``
+
+    A shard is named by the prefix when it is made of ``[a-z0-9_]`` and
+    is not ``docs`` or ``index``, otherwise by ``_`` and the hex code
+    points joined with ``-``.
+
+    Terms of every post are persisted, only changed posts are
+    tokenized again and only shards of their terms are written.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import re
+import json
+import logging
+from .builder import Builder
+from .feeds import get_options
+from .filters import word_pattern
+from .request import Request
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: terms longer than it are truncated
+MAX_TERM_LENGTH = 32
+
+_plain_name = re.compile(r'^[a-z0-9_]+$')
+
+
+def is_cjk(word):
+    """If a word found by :data:`writeup.filters.word_pattern` is a run
+    of CJK, kana and hangul included. Latin and Greek words end below
+    U+3040, where kana, the first CJK range of the pattern, begin."""
+    return ord(word[0]) >= 0x3040
+
+
+def tokenize(text):
+    """Split text into terms with :data:`writeup.filters.word_pattern`.
+
+    Latin words are lowercased, a run of CJK is split into characters,
+    every character of it is a term.
+    """
+    rv = []
+    if not text:
+        return rv
+    for word in word_pattern.findall(to_unicode(text)):
+        if is_cjk(word):
+            rv.extend(word)
+        elif len(word) > 1:
+            rv.append(word.lower()[:MAX_TERM_LENGTH])
+    return rv
+
+
+def shard_name(key):
+    if _plain_name.match(key) and key not in ('docs', 'index'):
+        return key
+    return '_' + '-'.join('%x' % ord(c) for c in key)
+
+
+class SearchBuilder(Builder):
+    """Write the sharded search index of posts."""
+
+    @property
+    def options(self):
+        value = self.app.config.get('search')
+        return get_options(value, path='search', prefix=2)
+
+    @property
+    def db_file(self):
+        return os.path.join(self.app.statedir, 'search.index')
+
+    def load(self):
+        if not os.path.exists(self.db_file):
+            return None
+        with open(self.db_file, 'rb') as f:
+            return json.loads(to_unicode(f.read()))
+
+    def save(self, store):
+        data = json.dumps(store)
+        with open(self.db_file, 'wb') as f:
+            f.write(to_bytes(data))
+
+    def destination(self, name):
+        path = self.options['path'].strip('/')
+        return os.path.join(self.app.sitedir, path, '%s.json' % name)
+
+    def analyze(self, filepath):
+        req = Request(filepath)
+        terms = {}
+        texts = [req.title, req.content, u' '.join(req.tags)]
+        for text in texts:
+            for term in tokenize(text):
+                terms[term] = terms.get(term, 0) + 1
+        return {
+            'mtime': req.mtime,
+            'url': req.url,
+            'title': req.title,
+            'terms': terms,
+        }
+
+    def update(self, store):
+        """Tokenize changed posts, return the affected shard keys."""
+        prefix = store['prefix']
+        posts = store['posts']
+        affected = set()
+
+        for filepath in list(posts):
+            if filepath not in self.app.post_indexer.keys():
+                entry = posts.pop(filepath)
+                affected.update(t[:prefix] for t in entry['terms'])
+                store['docs'][entry['id']] = None
+
+        for filepath in self.app.post_indexer:
+            entry = posts.get(filepath)
+            if entry and entry['mtime'] == os.path.getmtime(filepath):
+                continue
+            logger.debug('indexing [search]: %s' % filepath)
+            data = self.analyze(filepath)
+            if entry:
+                data['id'] = entry['id']
+                affected.update(t[:prefix] for t in entry['terms'])
+            else:
+                data['id'] = len(store['docs'])
+                store['docs'].append(None)
+            affected.update(t[:prefix] for t in data['terms'])
+            store['docs'][data['id']] = [data['url'], data['title']]
+            posts[filepath] = data
+        return affected
+
+    def write_json(self, name, data):
+        dest = self.destination(name)
+        self.write(json.dumps(data, sort_keys=True), dest)
+
+    def run(self):
+        if not self.app.config.get('search'):
+            return
+        options = self.options
+        if not self.app.in_shard(options['path']):
+            return
+
+        logger.info('BUILDING SEARCH')
+        prefix = options['prefix']
+        store = self.load()
+        if not store or store['prefix'] != prefix or \
+                self.app.is_stale('search'):
+            store = {'prefix': prefix, 'posts': {}, 'docs': [], 'shards': []}
+
+        docs = list(store['docs'])
+        affected = self.update(store)
+        posts = store['posts']
+
+        keys = set()
+        for filepath in posts:
+            keys.update(term[:prefix] for term in posts[filepath]['terms'])
+        for key in keys - affected:
+            if not self.app.storage.exists(self.destination(shard_name(key))):
+                # a new site dir, or it is removed by hand
+                affected.add(key)
+
+        postings = dict((key, {}) for key in affected & keys)
+        for filepath in posts:
+            entry = posts[filepath]
+            for term in entry['terms']:
+                shard = postings.get(term[:prefix])
+                if shard is not None:
+                    shard.setdefault(term, []).append(
+                        [entry['id'], entry['terms'][term]]
+                    )
+
+        for key in postings:
+            for term in postings[key]:
+                postings[key][term].sort()
+            self.write_json(shard_name(key), postings[key])
+
+        shards = sorted(shard_name(key) for key in keys)
+        for name in set(store['shards']) - set(shards):
+            dest = self.destination(name)
+            self.app.storage.remove(dest)
+            self.app.output_manifest.discard(dest)
+
+        if docs != store['docs'] or \
+                not self.app.storage.exists(self.destination('docs')):
+            self.write_json('docs', {'docs': store['docs']})
+        if shards != store['shards'] or \
+                not self.app.storage.exists(self.destination('index')):
+            self.write_json('index', {'prefix': prefix, 'shards': shards})
+
+        logger.info('WRITTING %i/%i shards' % (len(postings), len(keys)))
+        store['shards'] = shards
+        self.save(store)
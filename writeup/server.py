@@ -9,17 +9,351 @@
 """
 
 import os
+import re
 import sys
+import json
+import time
 import hashlib
 import mimetypes
+import threading
 import email.utils
-from wsgiref.simple_server import make_server
+import select
+import socket
+from collections import OrderedDict
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from wsgiref.simple_server import ServerHandler
 from . import __version__
+from ._compat import to_unicode
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+#: fingerprinted assets look like ``site.0123456789.css``
+fingerprint_pattern = re.compile(r'\.[0-9a-f]{10}\.[^./]+$')
+immutable_cache = 'public, max-age=31536000, immutable'
+#: read large files in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+
+class FileEntry(object):
+    """One version of a file, with the headers computed once.
+
+    Small files keep their body in memory, large files are streamed
+    from the disk and get an ETag of their mtime and size.
+    """
+    def __init__(self, filepath, stat, max_body):
+        self.filepath = filepath
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.body = None
+        if self.size <= max_body:
+            with open(filepath, 'rb') as f:
+                self.body = f.read()
+            self.size = len(self.body)
+            self.etag = '"%s"' % hashlib.md5(self.body).hexdigest()
+        else:
+            self.etag = '"%x-%x"' % (int(self.mtime * 1000), self.size)
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        #: precompressed siblings, ``None`` means looking on the disk
+        self.siblings = None
+
+    def fresh(self, stat):
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+    @property
+    def weight(self):
+        return len(self.body) if self.body is not None else 0
+
+    def iter_range(self, start, end):
+        """Iterate the bytes from start to end (inclusive) on disk."""
+        with open(self.filepath, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class MemoryEntry(FileEntry):
+    """A rendered output that only lives in memory."""
+    def __init__(self, name, body, mtime=None):
+        self.filepath = name
+        self.body = body
+        self.size = len(body)
+        self.mtime = mtime or time.time()
+        self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.siblings = []
+
+
+class FileCache(object):
+    """A bounded LRU cache of :class:`FileEntry`, invalidated by mtime.
+
+    :param max_entries: the most files to remember
+    :param max_memory: the most bytes of bodies to keep in memory
+    :param max_body: files larger than it are streamed from the disk
+    """
+    def __init__(self, max_entries=1024, max_memory=64 * 1024 * 1024,
+                 max_body=1024 * 1024):
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.max_body = max_body
+        self.memory = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filepath):
+        """Get the current version of a file, None if it is missing."""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            self.discard(filepath)
+            return None
+
+        with self._lock:
+            entry = self._entries.pop(filepath, None)
+            if entry is not None and entry.fresh(stat):
+                # move it to the end, it is the most recently used
+                self._entries[filepath] = entry
+                return entry
+            if entry is not None:
+                self.memory -= entry.weight
+
+        try:
+            entry = FileEntry(filepath, stat, self.max_body)
+        except IOError:
+            return None
+
+        with self._lock:
+            old = self._entries.pop(filepath, None)
+            if old is not None:
+                self.memory -= old.weight
+            self._entries[filepath] = entry
+            self.memory += entry.weight
+            while self._entries and (
+                    len(self._entries) > self.max_entries or
+                    self.memory > self.max_memory):
+                _, oldest = self._entries.popitem(last=False)
+                self.memory -= oldest.weight
+        return entry
+
+    def discard(self, filepath):
+        with self._lock:
+            entry = self._entries.pop(filepath, None)
+            if entry is not None:
+                self.memory -= entry.weight
+
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = '1.1'
+    sized = False
+
+    def close(self):
+        # headers are reset on close, remember if the body was sized
+        self.sized = bool(self.headers and 'Content-Length' in self.headers)
+        ServerHandler.close(self)
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """Handle the requests of a connection.
+
+    The handler lives as long as its connection. A worker serves the
+    requests that are ready, then the connection is parked by the
+    server until the next request arrives.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    #: seconds to wait for the rest of a request
+    timeout = 15
+
+    def __init__(self, request, client_address, server):
+        # the server drives the handler, see :meth:`serve`
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def serve(self):
+        """Handle the requests that are ready, return True if the
+        connection is kept open."""
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.buffered():
+                return True
+            self.handle_one_request()
+        return False
+
+    def buffered(self):
+        """If the next request is read into the buffer already."""
+        rbuf = getattr(self.rfile, '_rbuf', None)
+        if rbuf is not None:
+            # socket._fileobject of Python 2
+            rbuf.seek(0, 2)
+            return rbuf.tell() > 0
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except (IOError, OSError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.send_error(414)
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+
+        handler = KeepAliveServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ()
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        if self.request_version != 'HTTP/1.1' or not handler.sized:
+            # the end of the response is the end of the connection
+            self.close_connection = 1
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """A WSGI server handling requests in a pool of threads.
+
+    Connections without a pending request wait in a ``select`` loop,
+    not in a worker, a worker is only given to a connection that has a
+    request to read. Idle connections are closed after
+    :attr:`idle_timeout` seconds.
+
+    :param workers: the number of threads, which is also the number of
+                    requests served at the same time
+    """
+    daemon_threads = True
+    request_queue_size = 128
+    idle_timeout = 15
+
+    def __init__(self, address, handler=KeepAliveHandler, workers=16):
+        WSGIServer.__init__(self, address, handler)
+        self._requests = queue.Queue()
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        # written to wake up the select loop when a connection is parked
+        self._wakeup = os.pipe()
+        t = threading.Thread(target=self._poll)
+        t.daemon = True
+        t.start()
+        for i in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+
+    def process_request(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self.park(handler)
+
+    def park(self, handler):
+        """Wait for the next request of a connection."""
+        with self._idle_lock:
+            self._idle[handler.connection.fileno()] = (handler, time.time())
+        os.write(self._wakeup[1], b'.')
+
+    def close_handler(self, handler):
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+
+    def _poll(self):
+        while True:
+            with self._idle_lock:
+                fds = list(self._idle)
+            try:
+                readable = select.select(
+                    [self._wakeup[0]] + fds, [], [], 1
+                )[0]
+            except (select.error, OSError, ValueError):
+                # a parked socket is broken, find it below
+                readable = []
+                for fd in fds:
+                    try:
+                        select.select([fd], [], [], 0)
+                    except (select.error, OSError, ValueError):
+                        readable.append(fd)
+
+            now = time.time()
+            expired = []
+            with self._idle_lock:
+                for fd in readable:
+                    if fd == self._wakeup[0]:
+                        os.read(fd, 4096)
+                        continue
+                    item = self._idle.pop(fd, None)
+                    if item is not None:
+                        self._requests.put(item[0])
+                for fd in list(self._idle):
+                    if now - self._idle[fd][1] > self.idle_timeout:
+                        expired.append(self._idle.pop(fd)[0])
+            for handler in expired:
+                self.close_handler(handler)
+
+    def _work(self):
+        while True:
+            handler = self._requests.get()
+            try:
+                keep = handler.serve()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+                keep = False
+            if keep:
+                self.park(handler)
+            else:
+                self.close_handler(handler)
 
 
 class Server(object):
-    def __init__(self, sitedir='_site'):
+    def __init__(self, sitedir='_site', cache=None):
         self._sitedir = sitedir
+        self._redirects = {}
+        self._redirects_mtime = None
+        self._paths = {}
+        self.cache = cache or FileCache()
+
+    @property
+    def redirects(self):
+        """The redirect map of the site, reloaded when it changed."""
+        filepath = os.path.join(self._sitedir, 'redirects.json')
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            return {}
+        if mtime != self._redirects_mtime:
+            with open(filepath, 'rb') as f:
+                self._redirects = json.loads(to_unicode(f.read()))
+            self._redirects_mtime = mtime
+        return self._redirects
 
     def filepath(self, url):
         """Parse the real filepath of a url."""
@@ -35,55 +369,263 @@ class Server(object):
             return None
         return url
 
+    def lookup(self, url):
+        """Find the cached entry of a url.
+
+        The resolved filepath of the url is remembered, a hit costs
+        only one ``stat`` of the file.
+        """
+        filepath = self._paths.get(url)
+        if filepath is not None:
+            entry = self.cache.get(filepath)
+            if entry is not None:
+                return entry
+            self._paths.pop(url, None)
+
+        filepath = self.filepath(url)
+        if filepath is None:
+            return None
+        if len(self._paths) >= self.cache.max_entries:
+            self._paths.clear()
+        self._paths[url] = filepath
+        return self.cache.get(filepath)
+
     def read(self, url):
         """Reading from a file."""
-        url = self.filepath(url)
-        if not url:
+        entry = self.lookup(url)
+        if entry is None:
             return None
-        with open(url, 'r') as f:
-            return f.read()
+        if entry.body is not None:
+            return entry.body
+        return b''.join(entry.iter_range(0, entry.size - 1))
 
     def mtime(self, url):
-        url = self.filepath(url)
-        if not url:
+        entry = self.lookup(url)
+        if entry is None:
             return None
-        mtime = os.path.getmtime(url)
-        return email.utils.formatdate(mtime, usegmt=True)
+        return entry.last_modified
 
-    def serve_forever(self, host='0.0.0.0', port=4000):
+    def make_server(self, host='0.0.0.0', port=4000, workers=16):
+        server = PooledWSGIServer((host, int(port)), workers=int(workers))
+        server.set_app(self.wsgi)
+        return server
+
+    def serve_forever(self, host='0.0.0.0', port=4000, workers=16):
         print('Start server at http://%s:%s' % (host, port))
         try:
-            make_server(host, int(port), self.wsgi).serve_forever()
+            self.make_server(host, port, workers).serve_forever()
         except KeyboardInterrupt:
             sys.exit()
 
+    def negotiate(self, entry, accept_encoding):
+        """Find a precompressed sibling the client accepts."""
+        accepted = parse_accept_encoding(accept_encoding)
+        if not accepted:
+            return None, entry
+
+        siblings = entry.siblings
+        if siblings is None:
+            # siblings may be created or removed at any time
+            siblings = [
+                (name, entry.filepath + suffix)
+                for name, suffix in (('br', '.br'), ('gzip', '.gz'))
+            ]
+        for name, filepath in siblings:
+            if name in accepted:
+                sibling = self.cache.get(filepath)
+                # an older sibling is stale, e.g. edited outside a build
+                if sibling is not None and sibling.mtime >= entry.mtime:
+                    return name, sibling
+        return None, entry
+
     def wsgi(self, environ, start_response):
         path = environ['PATH_INFO']
-        mime_types, encoding = mimetypes.guess_type(path)
+        location = self.redirects.get(path)
+        if location:
+            start_response('301 Moved Permanently', [
+                # urls in redirect_from should be ascii (quoted)
+                ('Location', str(location)),
+                ('Content-Length', '0'),
+                ('Server', 'Writeup/%s' % __version__),
+            ])
+            return []
+
+        mime_types, _ = mimetypes.guess_type(path)
         if not mime_types:
             mime_types = 'text/html'
 
-        body = self.read(path)
         headers = [
             ('Content-Type', mime_types),
             ('Server', 'Writeup/%s' % __version__),
         ]
-        if body is None:
+        entry = self.lookup(path)
+        if entry is None:
+            not_found = self.read('404.html') or b''
+            headers.append(('Content-Length', str(len(not_found))))
             start_response('404 Not Found', headers)
-            not_found = self.read('404.html')
-            if not_found:
-                yield not_found
+            return [not_found]
+
+        headers.append(('Vary', 'Accept-Encoding'))
+        byte_range = environ.get('HTTP_RANGE')
+        if byte_range and environ.get('HTTP_IF_RANGE') not in (
+                None, entry.etag, entry.last_modified):
+            byte_range = None
+
+        if byte_range:
+            # ranges are served from the identity representation
+            encoding = None
         else:
-            etag = hashlib.md5(body).hexdigest()
-            match = environ.get('HTTP_IF_NONE_MATCH', None)
+            encoding, entry = self.negotiate(
+                entry, environ.get('HTTP_ACCEPT_ENCODING', '')
+            )
 
-            mtime = self.mtime(path)
-            modified = environ.get('HTTP_IF_MODIFIED_SINCE', None)
-            if etag == match or modified == mtime:
-                start_response('304 Not Modified', headers)
-            else:
-                headers.append(('Etag', etag))
-                headers.append(('Last-Modified', mtime))
-                headers.append(('Content-Length', str(len(body))))
-                start_response('200 OK', headers)
-                yield body
+        # validators of the representation that is actually served
+        if match_etag(environ.get('HTTP_IF_NONE_MATCH'), entry.etag) or \
+                environ.get('HTTP_IF_MODIFIED_SINCE') == entry.last_modified:
+            headers.append(('Etag', entry.etag))
+            start_response('304 Not Modified', headers)
+            return []
+
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Accept-Ranges', 'bytes'))
+        headers.append(('Etag', entry.etag))
+        headers.append(('Last-Modified', entry.last_modified))
+        if fingerprint_pattern.search(path):
+            headers.append(('Cache-Control', immutable_cache))
+
+        start, end = 0, entry.size - 1
+        status = '200 OK'
+        if byte_range:
+            try:
+                rv = parse_range(byte_range, entry.size)
+            except ValueError:
+                headers.append(('Content-Range', 'bytes */%i' % entry.size))
+                headers.append(('Content-Length', '0'))
+                start_response('416 Range Not Satisfiable', headers)
+                return []
+            if rv is not None:
+                start, end = rv
+                status = '206 Partial Content'
+                headers.append(('Content-Range', 'bytes %i-%i/%i' % (
+                    start, end, entry.size
+                )))
+
+        headers.append(('Content-Length', str(end - start + 1)))
+        start_response(status, headers)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return []
+        if entry.body is not None:
+            if start == 0 and end == entry.size - 1:
+                return [entry.body]
+            return [entry.body[start:end + 1]]
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper and status == '200 OK':
+            # the server may send it with sendfile
+            return file_wrapper(open(entry.filepath, 'rb'), CHUNK_SIZE)
+        return entry.iter_range(start, end)
+
+
+class MemoryServer(Server):
+    """Serve the outputs of a :class:`~writeup.storage.MemoryStorage`,
+    nothing is read from the disk."""
+    def __init__(self, storage, cache=None):
+        Server.__init__(self, storage.sitedir, cache=cache)
+        self.storage = storage
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def redirects(self):
+        body = self.storage.files.get('redirects.json')
+        if body is None:
+            return {}
+        if body is not self._redirects_mtime:
+            self._redirects = json.loads(to_unicode(body))
+            self._redirects_mtime = body
+        return self._redirects
+
+    def filepath(self, url):
+        """Parse the output name of a url."""
+        files = self.storage.files
+        name = url.lstrip('/')
+        if not name or name.endswith('/'):
+            name += 'index.html'
+        elif name not in files and not name.endswith('.html'):
+            name += '.html'
+        if name not in files:
+            return None
+        return name
+
+    def lookup(self, url):
+        name = self.filepath(url)
+        if name is None:
+            return None
+        body = self.storage.files[name]
+        entry = self._entries.get(name)
+        if entry is None or entry.body is not body:
+            mtime = self.storage.mtime(os.path.join(self._sitedir, name))
+            entry = MemoryEntry(name, body, mtime)
+            with self._lock:
+                self._entries[name] = entry
+        return entry
+
+
+def parse_accept_encoding(value):
+    """Parse the Accept-Encoding header into a set of encodings."""
+    rv = set()
+    for item in value.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        params = [p.strip().replace(' ', '') for p in parts[1:]]
+        if 'q=0' in params or 'q=0.0' in params:
+            continue
+        rv.add(name)
+    return rv
+
+
+def match_etag(value, etag):
+    """Check an If-None-Match header against the ETag."""
+    if not value:
+        return False
+    if value.strip() == '*':
+        return True
+    for item in value.split(','):
+        item = item.strip()
+        if item.startswith('W/'):
+            item = item[2:]
+        if item == etag or '"%s"' % item == etag:
+            return True
+    return False
+
+
+def parse_range(value, size):
+    """Parse a single ``bytes=`` range into an inclusive (start, end).
+
+    Return None for a range the server should ignore, such as multiple
+    ranges, raise ValueError for a range that is not satisfiable.
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        # a malformed range is ignored
+        return None
+
+    if start is None:
+        # the last N bytes
+        if not end:
+            raise ValueError('Range not satisfiable')
+        return max(size - end, 0), size - 1
+    if end is None:
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError('Range not satisfiable')
+    return start, min(end, size - 1)
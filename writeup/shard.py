@@ -0,0 +1,146 @@
+# coding: utf-8
+"""
+    writeup.shard
+    ~~~~~~~~~~~~~
+
+    Split a build across machines and merge the outputs::
+
+        $ writeup build --shard 1/4    # on every runner
+        $ writeup merge                # combine _site.shard-*
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import json
+import glob
+import hashlib
+import logging
+from .assets import AssetPublisher, file_digest
+from ._compat import to_bytes, to_unicode
+
+logger = logging.getLogger('writeup')
+
+#: the manifest file in the root of a shard directory
+MANIFEST_NAME = '.writeup-shard.json'
+
+
+def parse_shard(value):
+    """Parse a ``i/n`` string into a tuple, ``i`` starts from 1."""
+    try:
+        index, total = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise RuntimeError('Invalid shard: %s' % value)
+    if total < 1 or not 1 <= index <= total:
+        raise RuntimeError('Invalid shard: %s' % value)
+    return index, total
+
+
+def shard_of(key, total):
+    """The shard (starts from 1) a key belongs to, it is stable across
+    machines and Python versions."""
+    digest = hashlib.md5(to_bytes(key)).hexdigest()
+    return int(digest[:8], 16) % total + 1
+
+
+def shard_dirname(sitedir, index, total):
+    return '%s.shard-%i-of-%i' % (sitedir, index, total)
+
+
+def index_digest(app):
+    """Digest of the post index, shards must share the same one."""
+    data = {}
+    for filepath in app.post_indexer:
+        relpath = os.path.relpath(filepath, app.basedir)
+        data[relpath.replace(os.path.sep, '/')] = app.post_indexer[filepath]
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.md5(to_bytes(text)).hexdigest()
+
+
+def walk_outputs(directory):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(filepath, directory)
+            if relpath == MANIFEST_NAME:
+                continue
+            yield relpath.replace(os.path.sep, '/'), filepath
+
+
+def write_manifest(app, index, total):
+    """Write the shard manifest with digests of all the outputs."""
+    outputs = {}
+    for name, filepath in walk_outputs(app.sitedir):
+        outputs[name] = file_digest(filepath)
+
+    data = {
+        'shard': index,
+        'total': total,
+        'index': index_digest(app),
+        'outputs': outputs,
+    }
+    with open(os.path.join(app.sitedir, MANIFEST_NAME), 'wb') as f:
+        f.write(to_bytes(json.dumps(data, sort_keys=True)))
+    return data
+
+
+def load_manifest(directory):
+    filepath = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.isfile(filepath):
+        raise RuntimeError('Not a shard directory: %s' % directory)
+    with open(filepath, 'rb') as f:
+        return json.loads(to_unicode(f.read()))
+
+
+def merge(pattern, sitedir, strategy='hardlink'):
+    """Merge shard directories matching the pattern into the sitedir.
+
+    Every shard must be present and built from the same index. An
+    output produced by two shards with different content is a
+    conflict, nothing is merged then.
+    """
+    directories = sorted(glob.glob(pattern))
+    if not directories:
+        raise RuntimeError('No shard matches %s' % pattern)
+
+    manifests = [(d, load_manifest(d)) for d in directories]
+    totals = set(m['total'] for d, m in manifests)
+    indexes = set(m['index'] for d, m in manifests)
+    if len(totals) != 1:
+        raise RuntimeError('Shards are built with different totals.')
+    if len(indexes) != 1:
+        raise RuntimeError('Shards are built from different indexes.')
+
+    total = totals.pop()
+    found = set(m['shard'] for d, m in manifests)
+    missing = set(range(1, total + 1)) - found
+    if missing:
+        raise RuntimeError('Missing shards: %s' % ', '.join(
+            str(i) for i in sorted(missing)
+        ))
+
+    owners = {}
+    conflicts = []
+    for directory, manifest in manifests:
+        for name, digest in manifest['outputs'].items():
+            if name not in owners:
+                owners[name] = (directory, digest)
+            elif owners[name][1] != digest:
+                conflicts.append(name)
+
+    if conflicts:
+        for name in sorted(conflicts):
+            logger.error('CONFLICT %s' % name)
+        raise RuntimeError('%i conflicting outputs.' % len(conflicts))
+
+    publisher = AssetPublisher(strategy, dedupe=False)
+    for name in owners:
+        directory = owners[name][0]
+        source = os.path.join(directory, name)
+        dest = os.path.join(sitedir, name)
+        if os.path.isfile(dest) and file_digest(dest) == owners[name][1]:
+            continue
+        publisher.publish(source, dest)
+
+    logger.info('MERGING %i shards, %i outputs' % (total, len(owners)))
+    return owners
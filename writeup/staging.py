@@ -0,0 +1,123 @@
+# coding: utf-8
+"""
+    writeup.staging
+    ~~~~~~~~~~~~~~~
+
+    Build the site into a staging generation and publish it by swapping
+    a symlink, readers never see a half written site.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import shutil
+import logging
+import datetime
+
+logger = logging.getLogger('writeup')
+
+
+class Generations(object):
+    """Generations of a site directory.
+
+    The site directory becomes a symlink to the live generation, all
+    generations live in ``<sitedir>.generations``::
+
+        _site -> _site.generations/20150101120000000000
+        _site.generations/20150101120000000000
+        _site.generations/20141231120000000000
+
+    :param sitedir: the site directory
+    :param keep: count of generations retained for rollback
+    """
+    def __init__(self, sitedir, keep=3):
+        self.sitedir = os.path.abspath(sitedir)
+        self.root = self.sitedir + '.generations'
+        self.keep = keep
+
+    def current(self):
+        """The path of the live generation."""
+        if os.path.islink(self.sitedir):
+            return os.path.realpath(self.sitedir)
+        return None
+
+    def names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.listdir(self.root))
+
+    def stage(self):
+        """Create a new generation, unchanged outputs are hard linked
+        from the live one. Return the staging directory."""
+        name = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        staging = os.path.join(self.root, name)
+
+        previous = self.current()
+        if previous is None and os.path.isdir(self.sitedir):
+            previous = self.sitedir
+
+        if previous:
+            logger.info('STAGING %s' % name)
+            link_tree(previous, staging)
+        else:
+            os.makedirs(staging)
+        return staging
+
+    def swap(self, target):
+        """Point the site directory to the given generation atomically."""
+        if os.path.isdir(self.sitedir) and not os.path.islink(self.sitedir):
+            # the first swap, keep the old site as a generation
+            legacy = os.path.join(self.root, '0' * 20)
+            os.rename(self.sitedir, legacy)
+
+        folder = os.path.dirname(self.sitedir)
+        tmp = self.sitedir + '.swap'
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(os.path.relpath(target, folder), tmp)
+        # rename a symlink over a symlink is atomic
+        os.rename(tmp, self.sitedir)
+        logger.info('PUBLISHING %s' % os.path.basename(target))
+
+    def discard(self, target):
+        shutil.rmtree(target, ignore_errors=True)
+
+    def cleanup(self):
+        """Remove old generations, the newest ones are retained."""
+        current = self.current()
+        names = self.names()
+        if current:
+            current = os.path.basename(current)
+        olds = [n for n in names if n != current]
+        for name in olds[:max(len(olds) - self.keep, 0)]:
+            logger.debug('removing [generation]: %s' % name)
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def rollback(self):
+        """Swap back to the generation before the live one."""
+        current = self.current()
+        names = self.names()
+        if not current or os.path.basename(current) not in names:
+            raise RuntimeError('No generation to rollback.')
+        index = names.index(os.path.basename(current))
+        if index == 0:
+            raise RuntimeError('No generation to rollback.')
+        previous = os.path.join(self.root, names[index - 1])
+        self.swap(previous)
+        return previous
+
+
+def link_tree(source, dest):
+    """Mirror a directory with hard links, fallback to copy."""
+    for dirpath, dirnames, filenames in os.walk(source):
+        relpath = os.path.relpath(dirpath, source)
+        folder = os.path.normpath(os.path.join(dest, relpath))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for filename in filenames:
+            src = os.path.join(dirpath, filename)
+            dst = os.path.join(folder, filename)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
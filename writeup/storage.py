@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+    writeup.storage
+    ~~~~~~~~~~~~~~~
+
+    Where the outputs of builders go. Outputs are written into the site
+    directory by default, they can be kept in memory instead::
+
+        storage: memory
+
+    An in-memory build writes nothing into the site directory, it is
+    for previews and tests, see :func:`build_to_memory`. The indexes
+    describing its outputs are kept apart in ``.cache/memory``.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import time
+import threading
+from .assets import copy
+from ._compat import to_bytes
+
+
+class FileStorage(object):
+    """Write outputs into the site directory.
+
+    :param sitedir: the site directory
+    """
+    def __init__(self, sitedir):
+        self.sitedir = sitedir
+
+    def _prepare(self, dest):
+        # make sure the directory exists
+        folder = os.path.split(dest)[0]
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        elif os.path.lexists(dest):
+            # never write through a hard link of a previous generation
+            os.unlink(dest)
+
+    def write(self, dest, data):
+        self._prepare(dest)
+        with open(dest, 'wb') as f:
+            f.write(to_bytes(data))
+
+    def write_stream(self, dest, chunks):
+        self._prepare(dest)
+        with open(dest, 'wb') as f:
+            for chunk in chunks:
+                f.write(to_bytes(chunk))
+
+    def publish(self, publisher, source, dest):
+        """Publish a source file with the asset publisher."""
+        publisher.publish(source, dest)
+
+    def link(self, source, dest):
+        """Publish an output again under another name."""
+        try:
+            os.link(source, dest)
+        except OSError:
+            copy(source, dest)
+
+    def read(self, dest):
+        with open(dest, 'rb') as f:
+            return f.read()
+
+    def mtime(self, dest):
+        """The mtime of an output, ``None`` if it does not exist."""
+        try:
+            return os.stat(dest).st_mtime
+        except OSError:
+            return None
+
+    def exists(self, dest):
+        return os.path.isfile(dest)
+
+    def remove(self, dest):
+        if os.path.isfile(dest):
+            os.unlink(dest)
+
+
+class MemoryStorage(FileStorage):
+    """Keep outputs in memory, keyed by their names in the site.
+
+    :param sitedir: the site directory that outputs are relative to
+    """
+    def __init__(self, sitedir):
+        self.sitedir = sitedir
+        self.files = {}
+        self._mtimes = {}
+        self._lock = threading.Lock()
+
+    def name(self, dest):
+        return os.path.relpath(dest, self.sitedir).replace(os.path.sep, '/')
+
+    def write(self, dest, data):
+        name = self.name(dest)
+        with self._lock:
+            self.files[name] = to_bytes(data)
+            self._mtimes[name] = time.time()
+
+    def write_stream(self, dest, chunks):
+        self.write(dest, b''.join(to_bytes(c) for c in chunks))
+
+    def publish(self, publisher, source, dest):
+        with open(source, 'rb') as f:
+            self.write(dest, f.read())
+
+    def link(self, source, dest):
+        self.write(dest, self.read(source))
+
+    def read(self, dest):
+        data = self.files.get(self.name(dest))
+        if data is None:
+            raise IOError('No such output: %s' % dest)
+        return data
+
+    def mtime(self, dest):
+        return self._mtimes.get(self.name(dest))
+
+    def exists(self, dest):
+        return self.name(dest) in self.files
+
+    def remove(self, dest):
+        name = self.name(dest)
+        with self._lock:
+            self.files.pop(name, None)
+            self._mtimes.pop(name, None)
+
+
+def create_storage(name, sitedir):
+    if name == 'memory':
+        return MemoryStorage(sitedir)
+    if name == 'file':
+        return FileStorage(sitedir)
+    raise RuntimeError('Unknown storage: %s' % name)
+
+
+def build_to_memory(config=None, **kwargs):
+    """Build a site in memory, return a dict of names to contents::
+
+        site = build_to_memory('_config.yml')
+        html = site['index.html']
+    """
+    from . import Writeup
+
+    wp = Writeup(config=config, **kwargs)
+    wp.app.config['storage'] = 'memory'
+    wp.build_site()
+    return wp.app.storage.files
@@ -0,0 +1,316 @@
+# coding: utf-8
+"""
+    writeup.watch
+    ~~~~~~~~~~~~~
+
+    Keep the application warm and rebuild on changes::
+
+        $ writeup watch
+
+    File events come from inotify when ``inotify_simple`` is installed,
+    otherwise the tree is polled. A burst of events is debounced into
+    one batch, the indexes are updated for the changed files only and
+    the affected outputs are rebuilt, including listings, feeds and the
+    pages listing a changed post as a related post.
+
+    :copyright: (c) 2013 - 2015 by Hsiaoming Yang
+"""
+
+import os
+import time
+import logging
+from .utils import is_subdir
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger('writeup')
+
+
+class PollingObserver(object):
+    """Find changed files by comparing mtimes of the tree.
+
+    :param directories: the directories to watch
+    :param ignore: a function to tell if a directory should be ignored
+    """
+    def __init__(self, directories, ignore):
+        self.directories = directories
+        self.ignore = ignore
+        self._mtimes = self.snapshot()
+
+    def snapshot(self):
+        rv = {}
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames[:] = [
+                    name for name in dirnames
+                    if not self.ignore(os.path.join(dirpath, name))
+                ]
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    try:
+                        rv[filepath] = os.stat(filepath).st_mtime
+                    except OSError:
+                        continue
+        return rv
+
+    def read(self, timeout):
+        """Wait for the timeout in seconds, return the changed files."""
+        time.sleep(timeout)
+        mtimes = self.snapshot()
+        old = self._mtimes
+        self._mtimes = mtimes
+        changed = set(p for p in mtimes if old.get(p) != mtimes[p])
+        changed.update(p for p in old if p not in mtimes)
+        return changed
+
+
+class InotifyObserver(PollingObserver):
+    """Receive file events from inotify, a watch per directory."""
+    def __init__(self, directories, ignore):
+        self.directories = directories
+        self.ignore = ignore
+        self.inotify = INotify()
+        self.mask = (
+            flags.CREATE | flags.CLOSE_WRITE | flags.MODIFY |
+            flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+        )
+        self._watches = {}
+        for directory in directories:
+            self.add_tree(directory)
+
+    def add_tree(self, directory):
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [
+                name for name in dirnames
+                if not self.ignore(os.path.join(dirpath, name))
+            ]
+            wd = self.inotify.add_watch(dirpath, self.mask)
+            self._watches[wd] = dirpath
+
+    def read(self, timeout):
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            dirpath = self._watches.get(event.wd)
+            if dirpath is None or not event.name:
+                continue
+            filepath = os.path.join(dirpath, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO) and \
+                        not self.ignore(filepath):
+                    self.add_tree(filepath)
+                    changed.update(self.walk_files(filepath))
+                continue
+            changed.add(filepath)
+        return changed
+
+    def walk_files(self, directory):
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                yield os.path.join(dirpath, filename)
+
+
+class Watcher(object):
+    """Rebuild the affected outputs of changed files.
+
+    :param writeup: the :class:`~writeup.Writeup` instance
+    :param interval: seconds to wait for file events
+    :param debounce: seconds without events that ends a batch
+    """
+    def __init__(self, writeup, interval=0.5, debounce=0.1):
+        self.writeup = writeup
+        self.app = writeup.app
+        self.interval = interval
+        self.debounce = debounce
+
+    @property
+    def template_dirs(self):
+        rv = []
+        for key in ('layouts', 'includes'):
+            directory = self.app.config.get(key, '_%s' % key)
+            rv.append(os.path.abspath(directory))
+        return rv
+
+    def ignore(self, dirpath):
+        dirpath = os.path.abspath(dirpath)
+        app = self.app
+        if dirpath in (app.sitedir, app.cachedir):
+            return True
+        keep = [app.postsdir] + self.template_dirs
+        if any(is_subdir(dirpath, d) for d in keep):
+            return False
+        name = os.path.basename(dirpath)
+        return name.startswith('.') or name.startswith('_')
+
+    def create_observer(self):
+        directories = [self.app.basedir]
+        for directory in [self.app.postsdir] + self.template_dirs:
+            if not is_subdir(directory, self.app.basedir):
+                directories.append(directory)
+        directories = [d for d in directories if os.path.isdir(d)]
+        if INotify is not None:
+            return InotifyObserver(directories, self.ignore)
+        logger.info('inotify_simple is not installed, polling')
+        return PollingObserver(directories, self.ignore)
+
+    def run(self):
+        """Build the site, then rebuild on changes until interrupted."""
+        self.writeup.build_site()
+        observer = self.create_observer()
+        logger.info('WATCHING %s' % self.app.basedir)
+        while True:
+            changed = observer.read(self.interval)
+            if not changed:
+                continue
+            while True:
+                more = observer.read(self.debounce)
+                if not more:
+                    break
+                changed.update(more)
+            try:
+                self.rebuild(changed)
+            except Exception as e:
+                logger.error('REBUILDING ERROR %r' % e)
+
+    def rebuild(self, filepaths):
+        """Update the indexes and rebuild outputs of the changed files."""
+        begin = time.time()
+        app = self.app
+        filepaths = set(os.path.abspath(p) for p in filepaths)
+        templates = [
+            p for p in filepaths
+            if any(is_subdir(p, d) for d in self.template_dirs)
+        ]
+        sources = [p for p in filepaths if p not in templates]
+
+        with app.create_context():
+            changes = app.update_index(sources)
+            assets = [
+                os.path.relpath(c[1], app.basedir) for c in changes
+                if c[0] == 'file' and
+                not self.writeup.file_builder.is_template(c[1])
+            ]
+            # urls of the assets carry their digests or mtimes
+            linked = app.reset_assets(assets)
+            if templates or linked or \
+                    (assets and app.config.get('fingerprint')):
+                # every page may depend on them
+                self.rebuild_all()
+            else:
+                self.rebuild_changes(changes)
+
+        logger.info('REBUILDING %i files in %i ms' % (
+            len(filepaths), (time.time() - begin) * 1000
+        ))
+
+    def rebuild_all(self):
+        app = self.app
+        app.__dict__.pop('jinja', None)
+        app.__dict__.pop('asset_manifest', None)
+        app.__dict__.pop('static_urls', None)
+        # outputs older than it are built again
+        app.jinja._mtime = time.time()
+        self.writeup.build_site()
+
+    def rebuild_changes(self, changes):
+        wp = self.writeup
+        app = self.app
+        posts = []
+        listings = False
+        for file_type, filepath, old, new in changes:
+            if file_type == 'post':
+                posts.append(filepath)
+                # the order or the tags of posts changed
+                listings = listings or old != new
+            if new is None:
+                continue
+            if file_type == 'post':
+                wp.post_builder.build(filepath)
+            elif file_type == 'page':
+                wp.page_builder.build(filepath)
+            else:
+                wp.file_builder.build(filepath)
+
+        if any(c[0] == 'file' for c in changes):
+            wp.bundle_builder.run()
+            app.asset_manifest.save()
+
+        for filepath in sorted(self.related_dependents(changes)):
+            if filepath in app.post_indexer.keys():
+                wp.post_builder.build(filepath, force=True)
+            elif filepath in app.page_indexer.keys():
+                wp.page_builder.build(filepath, force=True)
+
+        if posts:
+            self.rebuild_listings(posts, listings)
+            wp.feed_builder.run()
+            wp.archive_builder.run()
+            wp.search_builder.run()
+        if listings or any(c[0] == 'page' for c in changes):
+            wp.sitemap_builder.run()
+            wp.redirect_builder.run()
+
+        wp.compress()
+        if app.config.get('prune'):
+            wp.prune()
+        app.output_manifest.flush()
+        app.save_dependencies()
+
+    def related_dependents(self, changes):
+        """Posts and pages listing a changed post as a related post.
+
+        Related posts share a tag, when the tags or the date of a post
+        changed, every post sharing a tag may list it now.
+        """
+        app = self.app
+        if not app.related_index:
+            # no template lists related posts
+            return set()
+
+        changed = set()
+        tags = set()
+        for file_type, filepath, old, new in changes:
+            if file_type != 'post':
+                continue
+            changed.add(filepath)
+            if old != new:
+                for entry in (old, new):
+                    if entry:
+                        tags.update(entry['tags'] or [])
+
+        rv = set()
+        for source, listed in app.related_index.items():
+            if changed.intersection(listed):
+                rv.add(source)
+        if tags:
+            for filepath in app.post_indexer:
+                if tags.intersection(app.post_indexer[filepath]['tags'] or []):
+                    rv.add(filepath)
+        return rv - changed
+
+    def rebuild_listings(self, posts, shifted):
+        """Rebuild the paginators and templates iterating posts.
+
+        :param posts: the changed posts
+        :param shifted: if the order of posts changed, every page of a
+                        paginator is built again then
+        """
+        builder = self.writeup.file_builder
+        for filepath in list(self.app.file_indexer.keys()):
+            if builder.should_build_paginator(filepath):
+                if shifted:
+                    builder.build_paginator(filepath)
+                    continue
+                paginator = builder.create_paginator(filepath)
+                pages = set()
+                for post in posts:
+                    if post in paginator.items:
+                        index = paginator.items.index(post)
+                        pages.add(index // paginator.per_page + 1)
+                if pages:
+                    builder.build_paginator(filepath, pages)
+            elif builder.is_template(filepath):
+                # templates not iterating posts are skipped by it
+                builder.build(filepath)